@@ -7,6 +7,17 @@ import sys
 
 def main():
     """Run administrative tasks."""
+    if sys.argv[1:2] == ["ingest"]:
+        # client of the ingest daemon, run once per message: no Django
+        from marc.ingest import main as ingest
+
+        sys.exit(ingest(sys.argv[2:]))
+    if sys.argv[1:2] == ["upload"]:
+        # client of the chunked upload API, run on remote sites: no Django
+        from marc.upload import main as upload
+
+        sys.exit(upload(sys.argv[2:]))
+
     os.environ.setdefault("DJANGO_SETTINGS_MODULE", "marc.settings")
     try:
         from django.core.management import execute_from_command_line
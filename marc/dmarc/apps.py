@@ -1,6 +1,7 @@
 import sys
 
 from django.apps import AppConfig
+from django.conf import settings
 from django.db.backends.signals import connection_created
 from django.db.backends.sqlite3.base import DatabaseWrapper
 
@@ -9,11 +10,23 @@ def display_database_location(*args, connection: DatabaseWrapper, **kwargs):
     print("Database located at", connection.get_connection_params().get("database", ""))
 
 
+def apply_sqlite_pragmas(*args, connection: DatabaseWrapper, **kwargs):
+    """Tune every new SQLite connection according to settings.SQLITE_PRAGMAS"""
+    if connection.vendor != "sqlite":
+        return
+    if getattr(settings, "SQLITE_PROFILE", "tuned") != "tuned":
+        return
+    with connection.cursor() as cursor:
+        for pragma, value in getattr(settings, "SQLITE_PRAGMAS", {}).items():
+            cursor.execute(f"PRAGMA {pragma} = {value}")
+
+
 class DmarcConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "marc.dmarc"
 
     def ready(self) -> None:
+        connection_created.connect(apply_sqlite_pragmas)
         if "runserver" in sys.argv:
             connection_created.connect(display_database_location)
         return super().ready()
@@ -0,0 +1,245 @@
+"""
+Ingestion benchmark: time every stage of the import of report files.
+
+Stages:
+- decompress: sniff and decompress the file (gzip, zip or raw xml)
+- parse: build the XML tree
+- validate: bind the tree to the marc.report dataclasses (pydantic validation)
+- import: write the report into the database
+"""
+
+import json
+import os
+import platform
+import resource
+import sys
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, List
+from xml.etree import ElementTree
+
+from django.db import connection, transaction
+
+from marc.dmarc.parser import extract_stream, import_to_database, validate
+from marc.dmarc.records import Report
+
+STAGES = ("decompress", "parse", "validate", "import")
+
+
+def current_rss() -> int:
+    """Resident set size of the process in bytes (0 if unknown)"""
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+def max_rss() -> int:
+    """Peak resident set size of the process in bytes"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class RssSampler(threading.Thread):
+    """Sample the RSS in background and keep, for every stage, the peak RSS
+    and the largest growth of the RSS during one run of the stage"""
+
+    def __init__(self, interval: float = 0.005):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.stage: str | None = None
+        self.start_rss = 0
+        self.peaks: Dict[str, int] = {}
+        self.growths: Dict[str, int] = {}
+        self._done = threading.Event()
+
+    def enter(self, stage: str):
+        self.start_rss = current_rss() or max_rss()
+        self.stage = stage
+        self.sample()
+
+    def sample(self):
+        stage = self.stage
+        if stage is not None:
+            rss = current_rss() or max_rss()
+            if rss > self.peaks.get(stage, 0):
+                self.peaks[stage] = rss
+            if rss - self.start_rss > self.growths.get(stage, 0):
+                self.growths[stage] = rss - self.start_rss
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            self.sample()
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+@dataclass
+class StageResult:
+    seconds: float = 0.0
+    files: int = 0
+    records: int = 0
+    peak_rss_bytes: int = 0
+    rss_growth_bytes: int = 0
+
+    def as_dict(self) -> Dict[str, Any]:
+        out = asdict(self)
+        out["files_per_s"] = self.files / self.seconds if self.seconds else None
+        out["records_per_s"] = self.records / self.seconds if self.seconds else None
+        return out
+
+
+@dataclass
+class BenchmarkResult:
+    files: int = 0
+    records: int = 0
+    bytes: int = 0
+    failures: Dict[str, int] = field(default_factory=dict)
+    stages: Dict[str, StageResult] = field(
+        default_factory=lambda: {s: StageResult() for s in STAGES}
+    )
+
+    def as_dict(self) -> Dict[str, Any]:
+        total = StageResult(
+            seconds=sum(s.seconds for s in self.stages.values()),
+            files=self.files,
+            records=self.records,
+            peak_rss_bytes=max_rss(),
+        )
+        return {
+            "meta": {
+                "date": datetime.now(UTC).isoformat(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "database": connection.vendor,
+                "argv": sys.argv,
+            },
+            "files": self.files,
+            "records": self.records,
+            "bytes": self.bytes,
+            "failures": self.failures,
+            "stages": {k: v.as_dict() for k, v in self.stages.items()},
+            "total": total.as_dict(),
+        }
+
+
+def run(paths: Iterable[Path], commit: bool = False) -> BenchmarkResult:
+    """Import the files stage by stage.
+
+    Unless commit is True, every import is rolled back so that the benchmark
+    can be run several times against the same database.
+    """
+    result = BenchmarkResult()
+    sampler = RssSampler()
+    sampler.start()
+
+    def timed(stage: str, func, *args):
+        sampler.enter(stage)
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            result.stages[stage].seconds += time.perf_counter() - start
+            sampler.sample()
+
+    def load(path: Path) -> bytes:
+        with open(path, "rb") as f:
+            return extract_stream(f).read()
+
+    def store(obj: Report):
+        with transaction.atomic():
+            import_to_database(obj)
+            transaction.set_rollback(not commit)
+
+    try:
+        for path in paths:
+            stage = "decompress"
+            try:
+                data = timed(stage, load, path)
+                result.bytes += len(data)
+                result.stages[stage].files += 1
+
+                stage = "parse"
+                tree = timed(stage, ElementTree.fromstring, data)
+                del data
+                result.stages[stage].files += 1
+
+                stage = "validate"
+                obj = timed(stage, validate, tree)
+                del tree
+                result.stages[stage].files += 1
+
+                stage = "import"
+                timed(stage, store, obj)
+                result.stages[stage].files += 1
+            except Exception as err:
+                key = f"{stage}:{type(err).__name__}"
+                result.failures[key] = result.failures.get(key, 0) + 1
+                continue
+
+            n = len(obj.record)
+            result.files += 1
+            result.records += n
+            for s in result.stages.values():
+                s.records += n
+    finally:
+        sampler.stop()
+
+    for stage, peak in sampler.peaks.items():
+        result.stages[stage].peak_rss_bytes = peak
+    for stage, growth in sampler.growths.items():
+        result.stages[stage].rss_growth_bytes = growth
+    return result
+
+
+def iter_files(paths: Iterable[str]) -> Iterable[Path]:
+    for p in map(Path, paths):
+        if p.is_dir():
+            yield from sorted(f for f in p.rglob("*") if f.is_file())
+        else:
+            yield p
+
+
+def load_results(path: str | Path) -> Dict[str, Any]:
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_results(results: Dict[str, Any], path: str | Path):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+
+
+def format_results(
+    results: Dict[str, Any], baseline: Dict[str, Any] | None = None
+) -> List[str]:
+    """Human readable table (with the ratio to a baseline if given)"""
+    lines = [
+        f"{results['files']} file(s), {results['records']} record(s), "
+        f"{results['bytes'] / 1e6:.1f} MB of xml, failures: {results['failures'] or 0}",
+        f"{'stage':<12}{'seconds':>10}{'files/s':>12}{'records/s':>14}"
+        f"{'peak rss':>12}{'rss growth':>12}"
+        + (f"{'vs base':>10}" if baseline else ""),
+    ]
+    for name, stage in list(results["stages"].items()) + [("total", results["total"])]:
+        line = (
+            f"{name:<12}{stage['seconds']:>10.3f}"
+            f"{stage['files_per_s'] or 0:>12.1f}{stage['records_per_s'] or 0:>14.0f}"
+            f"{stage['peak_rss_bytes'] / 2**20:>10.1f}MB"
+            f"{stage['rss_growth_bytes'] / 2**20:>10.1f}MB"
+        )
+        if baseline:
+            base = (
+                baseline["total"] if name == "total" else baseline["stages"].get(name)
+            )
+            if base and base.get("records_per_s") and stage["records_per_s"]:
+                line += f"{stage['records_per_s'] / base['records_per_s']:>9.2f}x"
+        lines.append(line)
+    return lines
@@ -0,0 +1,209 @@
+"""
+Startup benchmark: time the marc commands from the start of the interpreter.
+
+Every command runs in a new interpreter with -X importtime. The bytecode is
+compiled by a warm-up run (in a temporary cache, like an installed package)
+and the best of the measured runs is kept:
+- wall: time until the command exits
+- imports: sum of the import times reported by -X importtime (the modules
+  loaded by importlib.import_module, like the models of the apps, are not
+  reported, only what they import)
+- app: imports of the app and of its dependencies, i.e. neither the standard
+  library nor Django (and the database driver)
+"""
+
+import json
+import os
+import re
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
+
+import marc
+
+# commands which do not import reports
+COMMANDS = (
+    ("help",),
+    ("cleanall", "--help"),
+    ("prune", "--help"),
+    ("loadreport", "--help"),
+    ("check",),
+)
+
+# seconds
+STARTUP_GOAL = 0.2
+APP_IMPORT_BUDGET = 0.05
+
+# imported where they are used only (report parsing, help texts, logging...)
+HEAVY_MODULES = ("pydantic", "xsdata", "markdown", "tzlocal", "marc.report")
+
+# Django, its dependencies and the database drivers (loaded by the backend)
+DJANGO_PACKAGES = {
+    "django",
+    "asgiref",
+    "sqlparse",
+    "psycopg",
+    "psycopg_binary",
+    "psycopg_c",
+    "psycopg2",
+}
+
+_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| +(\S+)$")
+
+
+@dataclass
+class StartupResult:
+    command: List[str]
+    wall: float
+    imports: float
+    app: float
+    # import time by top level package
+    packages: Dict[str, float]
+    heavy: List[str]
+
+    def as_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+def parse_importtime(output: str) -> Dict[str, float]:
+    """module -> self import time (seconds) from the -X importtime output"""
+    out = {}
+    for line in output.splitlines():
+        match = _LINE.match(line)
+        if match:
+            out[match.group(3)] = int(match.group(1)) / 1e6
+    return out
+
+
+def is_app_module(name: str) -> bool:
+    package = name.split(".")[0]
+    return (
+        package not in sys.stdlib_module_names
+        and package not in DJANGO_PACKAGES
+        and not package.startswith("_")
+    )
+
+
+def _environ(cache: str) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    env["PYTHONPYCACHEPREFIX"] = cache
+    # the marc package being measured
+    source = str(Path(marc.__file__).resolve().parent.parent)
+    env["PYTHONPATH"] = os.pathsep.join(
+        filter(None, [source, os.environ.get("PYTHONPATH")])
+    )
+    return env
+
+
+def _run(command: Sequence[str], env: Dict[str, str]) -> Tuple[float, Dict[str, float]]:
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "marc", *command],
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(
+            f"marc {shlex.join(command)} exited with {proc.returncode}:\n"
+            + "\n".join(
+                line
+                for line in proc.stderr.splitlines()
+                if not line.startswith("import time:")
+            )
+        )
+    return wall, parse_importtime(proc.stderr)
+
+
+def measure(
+    command: Sequence[str], runs: int = 3, cache: str | None = None
+) -> StartupResult:
+    """Best of `runs` startups of the command (after a warm-up run)"""
+    if cache is None:
+        with tempfile.TemporaryDirectory(prefix="marc-pycache-") as tmp:
+            return measure(command, runs, tmp)
+
+    env = _environ(cache)
+    _run(command, env)
+    samples = [_run(command, env) for _ in range(max(1, runs))]
+
+    wall, modules = min(samples, key=lambda s: s[0])
+    packages: Dict[str, float] = {}
+    for name, seconds in modules.items():
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0.0) + seconds
+    heavy = sorted(
+        h
+        for h in HEAVY_MODULES
+        if any(m == h or m.startswith(h + ".") for m in modules)
+    )
+    return StartupResult(
+        command=list(command),
+        wall=wall,
+        imports=min(sum(s[1].values()) for s in samples),
+        app=min(sum(t for m, t in s[1].items() if is_app_module(m)) for s in samples),
+        packages=dict(sorted(packages.items(), key=lambda kv: -kv[1])),
+        heavy=heavy,
+    )
+
+
+def run(
+    commands: Iterable[Sequence[str]] = COMMANDS, runs: int = 3
+) -> List[StartupResult]:
+    # one bytecode cache for all the commands
+    with tempfile.TemporaryDirectory(prefix="marc-pycache-") as cache:
+        return [measure(command, runs, cache) for command in commands]
+
+
+def save_results(results: List[StartupResult], path: str | Path):
+    with open(path, "w") as f:
+        json.dump([r.as_dict() for r in results], f, indent=2)
+
+
+def over_budget(
+    results: List[StartupResult], budget: float = APP_IMPORT_BUDGET
+) -> List[str]:
+    """Commands importing heavy modules or over the app import budget"""
+    out = []
+    for r in results:
+        command = shlex.join(r.command)
+        if r.heavy:
+            out.append(f"{command} imports {', '.join(r.heavy)}")
+        if r.app > budget:
+            out.append(
+                f"{command}: {r.app * 1e3:.0f} ms of app imports "
+                f"(budget: {budget * 1e3:.0f} ms)"
+            )
+    return out
+
+
+def format_results(
+    results: List[StartupResult], goal: float = STARTUP_GOAL, top: int = 3
+) -> List[str]:
+    """Human readable table (milliseconds)"""
+    lines = [
+        f"{'command':<22}{'wall':>8}{'imports':>9}{'app':>7}  "
+        f"heaviest packages (goal: {goal * 1e3:.0f} ms)"
+    ]
+    for r in results:
+        heaviest = ", ".join(
+            f"{name} {seconds * 1e3:.0f}"
+            for name, seconds in list(r.packages.items())[:top]
+        )
+        line = (
+            f"{shlex.join(r.command):<22}{r.wall * 1e3:>8.0f}"
+            f"{r.imports * 1e3:>9.0f}{r.app * 1e3:>7.0f}  {heaviest}"
+        )
+        if r.wall > goal:
+            line += "  [slow]"
+        if r.heavy:
+            line += f"  [heavy: {', '.join(r.heavy)}]"
+        lines.append(line)
+    return lines
@@ -0,0 +1,193 @@
+"""
+View benchmark: seed a database with synthetic reports and measure the
+latency, the number of SQL queries and the size of the response of every
+route of marc.dmarc.urls.
+"""
+
+import random
+import time
+from dataclasses import dataclass, field
+from datetime import UTC, datetime
+from io import BytesIO
+from typing import Any, Callable, Dict, List
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.test import Client
+from django.urls import URLPattern, reverse
+
+from marc.dmarc import urls
+from marc.dmarc.models import Feedback, Record
+from marc.dmarc.parser import extract_parse, import_to_database
+from marc.report.synthetic import GeneratorConfig, ReportGenerator
+
+# model used to pick the <int:pk> of a route
+ROUTE_MODELS = {
+    "feedback": Feedback,
+    "record": Record,
+}
+
+
+def seed(
+    feedbacks: int,
+    records: int,
+    seed: int = 0,
+    progress: Callable[[int, int], None] | None = None,
+) -> int:
+    """Import `feedbacks` synthetic reports holding about `records` records in total"""
+    per_report = max(1, records // max(1, feedbacks))
+    config = GeneratorConfig(records=(max(1, per_report // 2), per_report * 3 // 2))
+    generator = ReportGenerator(seed=seed, config=config)
+    total = 0
+    for i in range(feedbacks):
+        obj = extract_parse(BytesIO(generator.report(i)))
+        import_to_database(obj)
+        total += len(obj.record)
+        if progress and (i + 1) % 100 == 0:
+            progress(i + 1, total)
+    return total
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Nearest-rank percentile of a list of values"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, round(p / 100 * len(ordered) + 0.5) - 1))
+    return ordered[k]
+
+
+class QueryCounter:
+    """Count the queries run on a connection (no limit, unlike CaptureQueriesContext)"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+@dataclass
+class RouteResult:
+    name: str
+    latencies: List[float] = field(default_factory=list)
+    queries: List[int] = field(default_factory=list)
+    sizes: List[int] = field(default_factory=list)
+    statuses: Dict[int, int] = field(default_factory=dict)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "requests": len(self.latencies),
+            "p50_ms": percentile(self.latencies, 50) * 1e3,
+            "p95_ms": percentile(self.latencies, 95) * 1e3,
+            "p99_ms": percentile(self.latencies, 99) * 1e3,
+            "queries_p50": percentile(self.queries, 50),
+            "queries_max": max(self.queries, default=0),
+            "bytes_p50": percentile(self.sizes, 50),
+            "statuses": self.statuses,
+        }
+
+
+def routes() -> List[URLPattern]:
+    return [p for p in urls.urlpatterns if isinstance(p, URLPattern) and p.name]
+
+
+def route_args(pattern: URLPattern, rnd: random.Random, pks: Dict[str, List[int]]):
+    """Arguments to reverse the route (None if the route cannot be reversed)"""
+    converters = set(pattern.pattern.converters)
+    if not converters:
+        return ()
+    if converters != {"pk"}:
+        return None
+    kind = pattern.name.split("-")[0]
+    if kind not in pks or not pks[kind]:
+        return None
+    return (rnd.choice(pks[kind]),)
+
+
+def run(
+    requests: int = 50,
+    sample: int = 1000,
+    htmx: bool = False,
+    warm_cache: bool = False,
+    seed: int = 0,
+) -> Dict[str, Any]:
+    """GET every named route `requests` times (pk routes on `sample` random objects)"""
+    rnd = random.Random(seed)
+    pks: Dict[str, List[int]] = {}
+    for kind, model in ROUTE_MODELS.items():
+        ids = list(model.objects.values_list("id", flat=True).order_by("id"))
+        pks[kind] = rnd.sample(ids, min(sample, len(ids)))
+
+    # ALLOWED_HOSTS defaults to localhost when DEBUG is on
+    host = next((h for h in settings.ALLOWED_HOSTS if "*" not in h), "localhost")
+    headers = {"HTTP_HX_REQUEST": "true"} if htmx else {}
+    if settings.UPLOAD_TOKEN:
+        # the upload API
+        headers["HTTP_AUTHORIZATION"] = f"Bearer {settings.UPLOAD_TOKEN}"
+    # errors are recorded as 500 instead of being raised
+    client = Client(
+        raise_request_exception=False, HTTP_HOST=host.lstrip("."), **headers
+    )
+    results: Dict[str, RouteResult] = {}
+    for pattern in routes():
+        for _ in range(requests):
+            args = route_args(pattern, rnd, pks)
+            if args is None:
+                break
+            result = results.setdefault(pattern.name, RouteResult(pattern.name))
+            url = reverse(pattern.name, args=args)
+            if not warm_cache:
+                for c in caches.all():
+                    c.clear()
+            counter = QueryCounter()
+            with connection.execute_wrapper(counter):
+                start = time.perf_counter()
+                response = client.get(url)
+                content = b"".join(response) if response.streaming else response.content
+                elapsed = time.perf_counter() - start
+            result.latencies.append(elapsed)
+            result.queries.append(counter.count)
+            result.sizes.append(len(content))
+            result.statuses[response.status_code] = (
+                result.statuses.get(response.status_code, 0) + 1
+            )
+
+    return {
+        "meta": {
+            "date": datetime.now(UTC).isoformat(),
+            "database": connection.vendor,
+            "feedbacks": Feedback.objects.count(),
+            "records": Record.objects.count(),
+            "htmx": htmx,
+            "warm_cache": warm_cache,
+        },
+        "routes": {name: r.as_dict() for name, r in results.items()},
+    }
+
+
+def format_results(
+    results: Dict[str, Any], baseline: Dict[str, Any] | None = None
+) -> List[str]:
+    """Human readable table (with the p95 ratio to a baseline if given)"""
+    meta = results["meta"]
+    lines = [
+        f"{meta['feedbacks']} feedback(s), {meta['records']} record(s) ({meta['database']})",
+        f"{'route':<16}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+        f"{'queries':>9}{'max':>6}{'bytes':>10}"
+        + (f"{'p95 vs base':>13}" if baseline else ""),
+    ]
+    for name, r in results["routes"].items():
+        line = (
+            f"{name:<16}{r['requests']:>6}{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}"
+            f"{r['p99_ms']:>10.1f}{r['queries_p50']:>9}{r['queries_max']:>6}"
+            f"{r['bytes_p50']:>10}"
+        )
+        if baseline:
+            base = baseline["routes"].get(name)
+            if base and base["p95_ms"]:
+                line += f"{r['p95_ms'] / base['p95_ms']:>12.2f}x"
+        lines.append(line)
+    return lines
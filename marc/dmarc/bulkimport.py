@@ -0,0 +1,179 @@
+"""
+Restartable import of large backlogs (loadreport --bulk).
+
+- the files to import (directories are walked) are written to the manifest of
+  a job (ImportJobFile rows) before anything is imported
+- the pending files are imported by batches: parsed first, then written in
+  one transaction along with their state in the manifest and the counters of
+  the job (checkpoint). An interrupted batch is entirely redone.
+- an interrupted job continues from its first pending file (loadreport --resume)
+- the manifest is removed once the job is finished (the failed files are in
+  the quarantine, see marc.dmarc.quarantine)
+"""
+
+import itertools
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+
+from django.db import IntegrityError, OperationalError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from marc.dmarc import metrics, quarantine
+from marc.dmarc.models import ImportJob, ImportJobFile
+
+logger = logging.getLogger("django.marc")
+
+DEFAULT_BATCH_SIZE = 100
+
+# manifest rows inserted per query
+MANIFEST_CHUNK_SIZE = 1000
+
+State = ImportJobFile.State
+
+
+@dataclass
+class Progress:
+    """Throughput of the current run (the previous runs of the job excluded)"""
+
+    start: float = field(default_factory=time.monotonic)
+    files: int = 0
+    records: int = 0
+
+    def format(self, job: ImportJob) -> str:
+        elapsed = max(time.monotonic() - self.start, 1e-6)
+        rate = self.files / elapsed
+        left = job.total - job.done
+        eta = str(timedelta(seconds=round(left / rate))) if rate > 0 else "?"
+        percent = 100 * job.done / job.total if job.total else 100.0
+        return (
+            f"job {job.id}: {job.done}/{job.total} files ({percent:.1f}%), "
+            f"{job.imported} imported, {job.duplicates} duplicate(s), "
+            f"{job.failed} failed, {job.skipped} quarantined | "
+            f"{rate:.1f} files/s, {self.records / elapsed:.0f} records/s, ETA {eta}"
+        )
+
+
+def walk(paths: Iterable[str | os.PathLike]) -> Iterator[str]:
+    """Absolute paths of the files (directories are walked, in order)"""
+    for p in paths:
+        p = os.path.abspath(p)
+        if not os.path.isdir(p):
+            yield p
+            continue
+        for root, dirs, files in os.walk(p):
+            dirs.sort()
+            for name in sorted(files):
+                yield os.path.join(root, name)
+
+
+def create_job(
+    paths: Iterable[str | os.PathLike], batch_size: int = DEFAULT_BATCH_SIZE
+) -> ImportJob:
+    """Write the manifest of a new job"""
+    with transaction.atomic():
+        job = ImportJob.objects.create(batch_size=batch_size)
+        files = walk(paths)
+        while chunk := list(itertools.islice(files, MANIFEST_CHUNK_SIZE)):
+            ImportJobFile.objects.bulk_create(
+                [ImportJobFile(job=job, path=path) for path in chunk]
+            )
+            job.total += len(chunk)
+        job.save(update_fields=["total"])
+    return job
+
+
+def unfinished_jobs() -> List[ImportJob]:
+    return list(ImportJob.objects.filter(finished_at__isnull=True).order_by("-id"))
+
+
+def import_batch(
+    job: ImportJob,
+    files: List[ImportJobFile],
+    quarantined: quarantine.Fingerprints,
+) -> int:
+    """Import the files and checkpoint the job, return the number of records
+    imported (OperationalError: nothing is written)"""
+    # heavy (xsdata, pydantic, report dataclasses)
+    from marc.dmarc.parser import extract_parse, import_to_database, open_report
+
+    states: Dict[str, List[int]] = {s: [] for s in State if s != State.PENDING}
+    failures: List[Tuple[str, Exception]] = []
+    parsed = []
+    for f in files:
+        metrics.registry.inc("marc_files_total", source="loadreport")
+        if quarantine.is_quarantined(f.path, quarantined):
+            states[State.SKIPPED].append(f.id)
+            continue
+        try:
+            with open_report(f.path) as raw:
+                parsed.append((f, extract_parse(raw)))
+        except IntegrityError:
+            # found by the pre-scan
+            states[State.DUPLICATE].append(f.id)
+        except Exception as err:
+            logger.error(f"{f.path}: {err}")
+            failures.append((f.path, err))
+            states[State.FAILED].append(f.id)
+
+    records = 0
+    with transaction.atomic():
+        for f, obj in parsed:
+            try:
+                import_to_database(obj)
+            except IntegrityError:
+                states[State.DUPLICATE].append(f.id)
+            except OperationalError:
+                raise
+            except Exception as err:
+                logger.error(f"{f.path}: {err}")
+                failures.append((f.path, err))
+                states[State.FAILED].append(f.id)
+            else:
+                states[State.IMPORTED].append(f.id)
+                records += len(obj.record)
+                if f.path in quarantined:
+                    quarantine.release(f.path)
+        for path, err in failures:
+            quarantine.record(path, err)
+
+        # checkpoint
+        for state, ids in states.items():
+            if ids:
+                ImportJobFile.objects.filter(id__in=ids).update(state=state)
+        ImportJob.objects.filter(id=job.id).update(
+            imported=F("imported") + len(states[State.IMPORTED]),
+            duplicates=F("duplicates") + len(states[State.DUPLICATE]),
+            failed=F("failed") + len(states[State.FAILED]),
+            skipped=F("skipped") + len(states[State.SKIPPED]),
+            checkpoint_at=timezone.now(),
+        )
+    job.refresh_from_db()
+    return records
+
+
+def run(
+    job: ImportJob,
+    on_checkpoint: Callable[[ImportJob, Progress], None] | None = None,
+) -> ImportJob:
+    """Import the pending files of the job, batch by batch"""
+    quarantined = quarantine.fingerprints()
+    progress = Progress()
+    pending = job.files.filter(state=State.PENDING).order_by("id")
+    while batch := list(pending[: job.batch_size]):
+        progress.records += import_batch(job, batch, quarantined)
+        progress.files += len(batch)
+        # counters of the command visible on /metrics
+        metrics.save()
+        if on_checkpoint is not None:
+            on_checkpoint(job, progress)
+
+    with transaction.atomic():
+        job.finished_at = timezone.now()
+        job.save(update_fields=["finished_at"])
+        job.files.all().delete()
+    return job
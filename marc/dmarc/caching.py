@@ -0,0 +1,124 @@
+"""
+HTTP caching of the views of reports.
+
+A report never changes once imported, so the detail and row views support
+conditional GET: the ETag is built from the pk and the global data version
+(incremented by every import and deletion), Last-Modified is the import
+time of the feedback.
+
+Row fragments requested with the current data version in their URL
+(?v=<version>, see the list templates) never change: they are served with
+a long immutable Cache-Control.
+
+The same version keys the template fragment cache ({% cache %} in the row,
+report metadata and policy published templates).
+"""
+
+from datetime import datetime
+from functools import lru_cache, wraps
+from typing import Callable, Tuple
+
+from django.db.models import Model
+from django.http import HttpRequest, HttpResponse
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import condition
+
+from marc.dmarc.models import (
+    Feedback,
+    Record,
+    data_version_subquery,
+    get_data_version,
+)
+
+# one year
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+@lru_cache(maxsize=None)
+def app_version() -> str:
+    """Version of marc (templates change with the app), looked up on the
+    first request: importlib.metadata scans the installed distributions"""
+    from importlib.metadata import PackageNotFoundError, version
+
+    try:
+        return version("marc")
+    except PackageNotFoundError:
+        return "dev"
+
+
+# model -> lookup of the import time
+IMPORTED_AT = {
+    Feedback: "imported_at",
+    Record: "feedback__imported_at",
+}
+
+
+def _state(request: HttpRequest, model: type[Model], pk: int) -> Tuple | None:
+    """(import time, data version) of the object, None if it does not exist
+    (single query, shared by the ETag and Last-Modified functions)"""
+    if not hasattr(request, "_report_state"):
+        request._report_state = (
+            model.objects.filter(pk=pk)
+            .annotate(data_version=data_version_subquery())
+            .values_list(IMPORTED_AT[model], "data_version")
+            .first()
+        )
+    return request._report_state
+
+
+def data_version(request: HttpRequest) -> int:
+    """Data version, queried at most once per request"""
+    if not hasattr(request, "_data_version"):
+        state = getattr(request, "_report_state", None)
+        request._data_version = (state[1] or 0) if state else get_data_version()
+    return request._data_version
+
+
+def report_etag(model: type[Model]) -> Callable[..., str | None]:
+    name = model._meta.model_name
+
+    def etag(request: HttpRequest, pk: int, **kwargs) -> str | None:
+        state = _state(request, model, pk)
+        if state is None:
+            return None
+        # the full page and the htmx fragment are different representations
+        kind = "f" if request.headers.get("HX-Request") == "true" else "p"
+        return f'"{name}-{pk}-{state[1] or 0}-{kind}-{app_version()}"'
+
+    return etag
+
+
+def report_last_modified(model: type[Model]) -> Callable[..., datetime | None]:
+    def last_modified(request: HttpRequest, pk: int, **kwargs) -> datetime | None:
+        state = _state(request, model, pk)
+        return state[0] if state else None
+
+    return last_modified
+
+
+def conditional_report(model: type[Model], view: Callable) -> Callable:
+    """Conditional GET on a view of a single report object (pk in the URL)"""
+    conditional_view = condition(
+        etag_func=report_etag(model),
+        last_modified_func=report_last_modified(model),
+    )(view)
+
+    @wraps(view)
+    def wrapper(request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        response = conditional_view(request, *args, **kwargs)
+        patch_vary_headers(response, ["HX-Request"])
+        if response.status_code not in (200, 304):
+            return response
+
+        requested = request.GET.get("v")
+        if requested is not None and requested == str(data_version(request)):
+            # the URL changes with the data version
+            patch_cache_control(
+                response, public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True
+            )
+        else:
+            # always revalidate (cheap 304)
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    return wrapper
@@ -0,0 +1,383 @@
+"""
+Chunked uploads of large report archives (remote sites, flaky links).
+
+1. init: the size (and the sha256) of the file are declared, an id is returned
+2. chunks are sent in order, each one with its offset and its sha256. A chunk
+   is written to a temporary file and checked before being appended, so the
+   size of the staged file is always the offset to resume from (it is
+   returned by the status of the upload)
+3. finalize: the size and the sha256 of the file are checked and a bulk
+   import job is created (zip bundles of several reports are extracted
+   first). The job runs in a thread of the server: finalize is sent again to
+   poll it, and resumes it if it was interrupted (the process died).
+
+Everything lives in the staging directory (settings.UPLOAD_STAGING), no
+database write happens before the import:
+- <id>.json: declared name, size, sha256 (and the import job once started)
+- <id>.part: bytes received
+- <id>.d/: members of a zip bundle
+- <id>.lock, <id>.import: locks of the upload and of its import
+- failed/: files which could not be imported (quarantined)
+
+Once imported, only <id>.json is kept: a repeated finalize returns the result
+of the job. Uploads left unchanged for settings.UPLOAD_TTL seconds are removed
+(on each init).
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+import zipfile
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import BinaryIO, Iterator, List
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+
+from marc.dmarc import bulkimport, quarantine
+from marc.dmarc.models import ImportJob, QuarantinedFile
+
+try:
+    import fcntl
+except ImportError:  # windows
+    fcntl = None
+
+logger = logging.getLogger("django.marc")
+
+COPY_CHUNK = 64 * 1024
+
+_ID = re.compile(r"^[0-9a-f]{32}$")
+_SHA256 = re.compile(r"^[0-9a-f]{64}$")
+
+
+class UploadError(Exception):
+    """Invalid request (HTTP 400)"""
+
+    status = 400
+
+
+class UploadNotFound(UploadError):
+    status = 404
+
+
+class OffsetMismatch(UploadError):
+    """The chunk does not start where the staged file ends (HTTP 409)"""
+
+    status = 409
+
+    def __init__(self, offset: int):
+        super().__init__(f"expected offset {offset}")
+        self.offset = offset
+
+
+@dataclass
+class Upload:
+    id: str
+    filename: str
+    size: int
+    sha256: str = ""
+    created: float = 0.0
+    job: int | None = None
+
+    @property
+    def meta_path(self) -> Path:
+        return staging() / f"{self.id}.json"
+
+    @property
+    def part_path(self) -> Path:
+        return staging() / f"{self.id}.part"
+
+    @property
+    def members_dir(self) -> Path:
+        return staging() / f"{self.id}.d"
+
+    @property
+    def offset(self) -> int:
+        try:
+            return self.part_path.stat().st_size
+        except FileNotFoundError:
+            return 0
+
+    def as_dict(self) -> dict:
+        return asdict(self) | {
+            "offset": self.offset,
+            "chunk_size": settings.UPLOAD_CHUNK_SIZE,
+        }
+
+    def save(self):
+        tmp = self.meta_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(asdict(self)))
+        os.replace(tmp, self.meta_path)
+
+
+def staging() -> Path:
+    return Path(settings.UPLOAD_STAGING)
+
+
+def _check_sha256(value: str) -> str:
+    value = value.lower()
+    if value and not _SHA256.match(value):
+        raise UploadError("sha256 must be 64 hexadecimal digits")
+    return value
+
+
+def init(filename: str, size: int, sha256: str = "") -> Upload:
+    """Declare a new upload"""
+    if size <= 0:
+        raise UploadError("size must be positive")
+    if size > settings.UPLOAD_CHUNKED_MAX_SIZE:
+        raise UploadError(f"file larger than {settings.UPLOAD_CHUNKED_MAX_SIZE} bytes")
+    cleanup()
+    staging().mkdir(parents=True, exist_ok=True)
+    upload = Upload(
+        id=uuid.uuid4().hex,
+        filename=os.path.basename(filename)[:255],
+        size=size,
+        sha256=_check_sha256(sha256),
+        created=time.time(),
+    )
+    upload.save()
+    upload.part_path.touch()
+    return upload
+
+
+def get(upload_id: str) -> Upload:
+    if not _ID.match(upload_id):
+        raise UploadNotFound(f"no upload {upload_id}")
+    try:
+        with open(staging() / f"{upload_id}.json") as f:
+            return Upload(**json.load(f))
+    except FileNotFoundError:
+        raise UploadNotFound(f"no upload {upload_id}") from None
+
+
+def uploads() -> List[Upload]:
+    """Staged uploads, oldest first"""
+    out = []
+    for meta in staging().glob("*.json"):
+        try:
+            out.append(get(meta.stem))
+        except (UploadNotFound, ValueError):
+            # removed meanwhile or partially written
+            continue
+    return sorted(out, key=lambda u: u.created)
+
+
+@contextmanager
+def _locked(upload: Upload, name: str = "lock", wait: bool = True) -> Iterator[bool]:
+    # one writer per upload (the workers of marc serve are processes), False
+    # if the lock is taken and wait is False
+    with open(staging() / f"{upload.id}.{name}", "a") as lock:
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | (0 if wait else fcntl.LOCK_NB))
+            except BlockingIOError:
+                yield False
+                return
+        yield True
+
+
+def write_chunk(
+    upload: Upload, offset: int, length: int, sha256: str, stream: BinaryIO
+) -> int:
+    """Append the chunk read from the stream and return the new offset"""
+    sha256 = _check_sha256(sha256)
+    if not sha256:
+        raise UploadError("the sha256 of the chunk is required")
+    if length <= 0 or length > settings.UPLOAD_CHUNK_SIZE:
+        raise UploadError(f"chunks are 1 to {settings.UPLOAD_CHUNK_SIZE} bytes")
+    if offset + length > upload.size:
+        raise UploadError(f"chunk past the declared size ({upload.size} bytes)")
+
+    with _locked(upload):
+        if get(upload.id).job is not None:
+            raise UploadError("the upload is finalized")
+        if offset != upload.offset:
+            raise OffsetMismatch(upload.offset)
+        tmp = staging() / f"{upload.id}.chunk"
+        h = hashlib.sha256()
+        received = 0
+        with open(tmp, "wb") as f:
+            while received < length:
+                data = stream.read(min(COPY_CHUNK, length - received))
+                if not data:
+                    break
+                h.update(data)
+                f.write(data)
+                received += len(data)
+        try:
+            if received != length:
+                raise UploadError(f"truncated chunk ({received}/{length} bytes)")
+            if h.hexdigest() != sha256:
+                raise UploadError("sha256 mismatch, send the chunk again")
+            # only checked bytes are appended: the size of the staged file is
+            # the offset to resume from, even after a crash
+            with open(tmp, "rb") as src, open(upload.part_path, "ab") as dst:
+                shutil.copyfileobj(src, dst, COPY_CHUNK)
+        finally:
+            tmp.unlink(missing_ok=True)
+    os.utime(upload.meta_path)
+    return upload.offset
+
+
+def extract_members(upload: Upload) -> List[Path]:
+    """Write the members of a zip bundle to the members directory (nothing if
+    the file is not a bundle of several reports). The number of members and
+    their sizes are bounded (ReportTooLarge)."""
+    from marc.dmarc.parser import RATIO_MIN_SIZE, ReportTooLarge
+
+    with zipfile.ZipFile(upload.part_path) as z:
+        infos = [i for i in z.infolist() if not i.is_dir()]
+        if len(infos) < 2:
+            return []
+        if len(infos) > settings.UPLOAD_BUNDLE_MAX_MEMBERS:
+            raise ReportTooLarge(
+                f"more than {settings.UPLOAD_BUNDLE_MAX_MEMBERS} members in the bundle"
+            )
+        # the sizes are enforced by zipfile while the members are read
+        if sum(i.file_size for i in infos) > settings.UPLOAD_BUNDLE_MAX_SIZE:
+            raise ReportTooLarge(
+                f"members larger than {settings.UPLOAD_BUNDLE_MAX_SIZE} bytes in total"
+            )
+        upload.members_dir.mkdir(exist_ok=True)
+        paths = []
+        for n, info in enumerate(infos):
+            if info.file_size > settings.REPORT_MAX_SIZE or (
+                settings.REPORT_MAX_RATIO > 0
+                and info.file_size > RATIO_MIN_SIZE
+                and info.file_size > settings.REPORT_MAX_RATIO * info.compress_size
+            ):
+                raise ReportTooLarge(f"{info.filename}: member too large")
+            # no directory from the archive (path traversal)
+            path = upload.members_dir / f"{n:06d}-{os.path.basename(info.filename)}"
+            with z.open(info) as src, open(path, "wb") as dst:
+                shutil.copyfileobj(src, dst, COPY_CHUNK)
+            paths.append(path)
+    return paths
+
+
+def finalize(upload: Upload) -> ImportJob:
+    """Check the file and create its import job (once), return the job (see
+    import_upload)"""
+    with _locked(upload):
+        upload = get(upload.id)
+        if upload.job is not None:
+            return ImportJob.objects.get(id=upload.job)
+        if upload.offset != upload.size:
+            raise UploadError(f"{upload.offset}/{upload.size} bytes received")
+        sha256 = quarantine.file_sha256(upload.part_path)
+        if upload.sha256 and sha256 != upload.sha256:
+            raise UploadError("sha256 mismatch, upload the file again")
+        paths = [upload.part_path]
+        if zipfile.is_zipfile(upload.part_path):
+            try:
+                paths = extract_members(upload) or paths
+            except (ValueError, zipfile.BadZipFile) as err:
+                # ReportTooLarge is a ValueError
+                raise UploadError(str(err)) from err
+        job = bulkimport.create_job(paths)
+        upload.job = job.id
+        upload.save()
+    return job
+
+
+def import_upload(upload_id: str) -> ImportJob | None:
+    """Run (or resume) the import job of a finalized upload, then remove its
+    staged bytes. None if it is imported by another thread or process."""
+    upload = get(upload_id)
+    if upload.job is None:
+        raise UploadError("the upload is not finalized")
+    with _locked(upload, "import", wait=False) as locked:
+        if not locked:
+            return None
+        job = ImportJob.objects.get(id=upload.job)
+        if job.finished_at is None:
+            # not stale while it is imported
+            bulkimport.run(job, on_checkpoint=lambda *_: os.utime(upload.meta_path))
+            logger.info(
+                f"upload {upload.id} ({upload.filename}): {job.imported} imported, "
+                f"{job.duplicates} duplicate(s), {job.failed} failed"
+            )
+        keep_failed(upload)
+        discard(upload)
+    return job
+
+
+def _import_thread(upload_id: str):
+    try:
+        import_upload(upload_id)
+    except Exception as err:
+        # the job is resumed by the next finalize
+        logger.error(f"upload {upload_id}: import interrupted: {err}")
+    finally:
+        # the connection of the thread
+        connection.close()
+
+
+def start_import(upload: Upload):
+    """Import the upload in a thread of the server (nothing if it is already
+    being imported)"""
+    threading.Thread(target=_import_thread, args=(upload.id,), daemon=True).start()
+
+
+def keep_failed(upload: Upload):
+    """Move the quarantined files of the upload out of the staged files"""
+    failed_dir = staging() / "failed"
+    files = QuarantinedFile.objects.filter(
+        Q(path=os.path.abspath(upload.part_path))
+        | Q(path__startswith=os.path.abspath(upload.members_dir) + os.sep)
+    )
+    for f in files:
+        failed_dir.mkdir(exist_ok=True)
+        path = failed_dir / f"{upload.id}-{Path(f.path).name}"
+        try:
+            os.replace(f.path, path)
+        except FileNotFoundError:
+            continue
+        f.path = os.path.abspath(path)
+        f.save(update_fields=["path"])
+
+
+def discard(upload: Upload):
+    """Remove the staged bytes of an imported upload. Its metadata is kept
+    until it expires, so that a repeated finalize returns the job."""
+    shutil.rmtree(upload.members_dir, ignore_errors=True)
+    for suffix in (".part", ".chunk"):
+        (staging() / f"{upload.id}{suffix}").unlink(missing_ok=True)
+    os.utime(upload.meta_path)
+
+
+def remove(upload: Upload):
+    shutil.rmtree(upload.members_dir, ignore_errors=True)
+    for suffix in (".part", ".chunk", ".lock", ".import", ".json"):
+        (staging() / f"{upload.id}{suffix}").unlink(missing_ok=True)
+
+
+def cleanup(ttl: float | None = None) -> int:
+    """Remove the uploads unchanged for ttl seconds"""
+    ttl = settings.UPLOAD_TTL if ttl is None else ttl
+    deadline = time.time() - ttl
+    removed = 0
+    for meta in staging().glob("*.json"):
+        changed = 0.0
+        # no .part once imported
+        for path in (meta, meta.with_suffix(".part")):
+            try:
+                changed = max(changed, path.stat().st_mtime)
+            except FileNotFoundError:
+                pass
+        if changed < deadline:
+            upload = Upload(id=meta.stem, filename="", size=0)
+            remove(upload)
+            logger.info(f"stale upload {meta.stem} removed")
+            removed += 1
+    return removed
@@ -0,0 +1,89 @@
+"""
+Set-based deletion of reports.
+
+Deleting a Feedback through the ORM makes Django collect every related
+object in memory to emulate the cascade. Here every table is purged with a
+single DELETE per chunk of feedbacks, children first, each chunk in its
+own (short) transaction.
+"""
+
+from typing import Iterable, List
+
+from django.db import transaction
+from django.db.models import QuerySet
+
+from marc.dmarc.models import (
+    AuthResult,
+    DkimAuthResult,
+    Feedback,
+    Identifier,
+    PolicyEvaluated,
+    PolicyOverrideReason,
+    PolicyPublished,
+    Record,
+    ReportMetadata,
+    Row,
+    SpfAuthResult,
+    bump_data_version,
+)
+
+DEFAULT_CHUNK_SIZE = 100
+
+# (model, lookup to the feedback id), children first
+CASCADE = [
+    (PolicyOverrideReason, "policy_evaluated__row__record__feedback__in"),
+    (PolicyEvaluated, "row__record__feedback__in"),
+    (Row, "record__feedback__in"),
+    (SpfAuthResult, "auth_results__record__feedback__in"),
+    (DkimAuthResult, "auth_results__record__feedback__in"),
+    (AuthResult, "record__feedback__in"),
+    (Record, "feedback__in"),
+    (ReportMetadata, "feedback__in"),
+    (Feedback, "id__in"),
+]
+
+
+def _raw_delete(qs: QuerySet) -> int:
+    # plain DELETE ... WHERE, without collecting the objects
+    # (this is what the deletion Collector does for fast deletes)
+    return qs._raw_delete(qs.db)
+
+
+def delete_feedback_ids(ids: Iterable[int]) -> int:
+    """Delete the given feedbacks and all their children (no transaction)"""
+    ids = list(ids)
+    deleted = 0
+    for model, lookup in CASCADE:
+        n = _raw_delete(model.objects.filter(**{lookup: ids}))
+        if model is Feedback:
+            deleted = n
+    return deleted
+
+
+def delete_feedbacks(
+    feedbacks: QuerySet[Feedback],
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> int:
+    """Delete feedbacks by chunks, each chunk in its own transaction.
+    It returns the number of deleted feedbacks.
+    """
+    total = 0
+    while True:
+        with transaction.atomic():
+            ids: List[int] = list(
+                feedbacks.order_by("id").values_list("id", flat=True)[:chunk_size]
+            )
+            if not ids:
+                break
+            total += delete_feedback_ids(ids)
+            bump_data_version()
+    delete_orphans()
+    return total
+
+
+def delete_orphans() -> int:
+    """Remove the policies and identifiers that are no longer referenced"""
+    with transaction.atomic():
+        return _raw_delete(
+            PolicyPublished.objects.filter(feedback__isnull=True)
+        ) + _raw_delete(Identifier.objects.filter(record__isnull=True))
@@ -0,0 +1,55 @@
+import logging
+import os
+from pathlib import Path
+
+from django.db import IntegrityError, transaction
+
+from marc.dmarc import metrics, quarantine
+from marc.dmarc.models import Config, get_config
+from marc.dmarc.parser import extract_parse, import_to_database, open_report
+
+logger = logging.getLogger("django.marc")
+
+
+def collect_path(
+    p: Path,
+    recursive: bool = False,
+    quarantined: quarantine.Fingerprints | None = None,
+) -> int:
+    """Import the report file (or the reports of the directory) and return the
+    number of imported reports. Quarantined files are skipped."""
+    if quarantined is None:
+        quarantined = quarantine.fingerprints()
+    if p.is_dir():
+        return sum(collect_path(p / f, recursive, quarantined) for f in os.listdir(p))
+    else:
+        metrics.registry.inc("marc_files_total", source="collect")
+        if quarantine.is_quarantined(p, quarantined):
+            logger.debug(f"{p} is quarantined")
+            return 0
+        try:
+            with open_report(p) as raw:
+                with transaction.atomic():
+                    import_to_database(extract_parse(raw))
+            logger.info(f"{p} imported")
+            if os.path.abspath(p) in quarantined:
+                # failed before, changed since
+                quarantine.release(p)
+            return 1
+        except IntegrityError as err:
+            logger.debug(f"{p}: {err}")
+        except Exception as err:
+            logger.error(f"{p}: {err}")
+            quarantine.record(p, err)
+
+    return 0
+
+
+def collect(config: Config | None = None) -> int:
+    """Import the reports of the directories of the config"""
+    config = config or get_config()
+    quarantined = quarantine.fingerprints()
+    return sum(
+        collect_path(Path(d), recursive=config.recursive, quarantined=quarantined)
+        for d in config.dirlist()
+    )
@@ -0,0 +1,11 @@
+from functools import partial
+
+from django.http import HttpRequest
+from django.utils.functional import SimpleLazyObject
+
+from marc.dmarc import caching
+
+
+def data_version(request: HttpRequest) -> dict:
+    """Global data version (queried only if a template uses it)"""
+    return {"data_version": SimpleLazyObject(partial(caching.data_version, request))}
@@ -0,0 +1,193 @@
+"""
+Streaming export of the records (joined with their report, identifiers, row,
+policy evaluated and auth results) and of the feedbacks, as CSV or NDJSON
+(/dmarc/export/<kind>/ and `marc export`).
+
+Rows are read settings.EXPORT_CHUNK_SIZE at a time (a server-side cursor on
+PostgreSQL, see QuerySet.iterator) in a read transaction, and written as soon
+as they are read: the memory used does not depend on the number of rows and
+the first bytes are sent before the query is over.
+"""
+
+import csv
+import json
+from datetime import date, datetime, time, timedelta
+from typing import Any, Dict, Iterable, Iterator, List, Sequence, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, QuerySet, Sum
+from django.utils import timezone
+
+from marc.dmarc.models import Feedback, Record
+
+# column -> lookup
+RECORD_COLUMNS: Dict[str, str] = {
+    "id": "id",
+    "report_id": "feedback__report_metadata__report_id",
+    "org_name": "feedback__report_metadata__org_name",
+    "date_range_begin": "feedback__report_metadata__date_range_begin",
+    "date_range_end": "feedback__report_metadata__date_range_end",
+    "domain": "feedback__policy_published__domain",
+    "source_ip": "row__source_ip",
+    "count": "row__count",
+    "disposition": "row__policy_evaluated__disposition",
+    "dkim": "row__policy_evaluated__dkim",
+    "spf": "row__policy_evaluated__spf",
+    "header_from": "identifiers__header_from",
+    "envelope_from": "identifiers__envelope_from",
+    "envelope_to": "identifiers__envelope_to",
+    "dkim_domain": "auth_results__dkim__domain",
+    "dkim_selector": "auth_results__dkim__selector",
+    "dkim_result": "auth_results__dkim__result",
+    "spf_domain": "auth_results__spf__domain",
+    "spf_scope": "auth_results__spf__scope",
+    "spf_result": "auth_results__spf__result",
+}
+
+FEEDBACK_COLUMNS: Dict[str, str] = {
+    "id": "id",
+    "report_id": "report_metadata__report_id",
+    "org_name": "report_metadata__org_name",
+    "email": "report_metadata__email",
+    "date_range_begin": "report_metadata__date_range_begin",
+    "date_range_end": "report_metadata__date_range_end",
+    "domain": "policy_published__domain",
+    "adkim": "policy_published__adkim",
+    "aspf": "policy_published__aspf",
+    "p": "policy_published__p",
+    "sp": "policy_published__sp",
+    "pct": "policy_published__pct",
+    # annotations
+    "records": "records",
+    "messages": "messages",
+}
+
+KINDS = ("records", "feedbacks")
+
+# format -> content type
+FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+# characters written at once (after the header)
+BUFFER_SIZE = 64 * 1024
+
+
+def _midnight(day: date) -> datetime:
+    # in the time zone of the settings
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def queryset(
+    kind: str,
+    since: date | None = None,
+    until: date | None = None,
+    domain: str | None = None,
+    disposition: str | None = None,
+) -> Tuple[List[str], QuerySet]:
+    """Columns and rows of the export: reports whose period overlaps
+    [since, until] (days), of the domain (policy published). The disposition
+    is the evaluated one for records, the published policy for feedbacks."""
+    if kind == "records":
+        columns, prefix = RECORD_COLUMNS, "feedback__"
+        rows = Record.objects.all()
+        if disposition:
+            rows = rows.filter(row__policy_evaluated__disposition=disposition)
+    elif kind == "feedbacks":
+        columns, prefix = FEEDBACK_COLUMNS, ""
+        rows = Feedback.objects.annotate(
+            records=Count("record"), messages=Sum("record__row__count")
+        )
+        if disposition:
+            rows = rows.filter(policy_published__p=disposition)
+    else:
+        raise ValueError(f"unknown export {kind} (expected one of {KINDS})")
+
+    if since is not None:
+        rows = rows.filter(
+            **{f"{prefix}report_metadata__date_range_end__gte": _midnight(since)}
+        )
+    if until is not None:
+        rows = rows.filter(
+            **{
+                f"{prefix}report_metadata__date_range_begin__lt": _midnight(
+                    until + timedelta(1)
+                )
+            }
+        )
+    if domain:
+        rows = rows.filter(**{f"{prefix}policy_published__domain": domain})
+    return list(columns), rows.order_by("id").values_list(*columns.values())
+
+
+def _value(v: Any) -> Any:
+    if isinstance(v, datetime):
+        return v.isoformat()
+    return v
+
+
+class _Line:
+    """File-like object returning what the csv writer writes"""
+
+    def write(self, value: str) -> str:
+        return value
+
+
+def _buffered(header: str, lines: Iterable[str]) -> Iterator[str]:
+    # the header and the first row alone: the response starts as soon as the
+    # first rows are fetched, the next rows are sent by BUFFER_SIZE
+    if header:
+        yield header
+    buffer: List[str] = []
+    size = 0
+    first = True
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if first or size >= BUFFER_SIZE:
+            yield "".join(buffer)
+            buffer.clear()
+            size = 0
+            first = False
+    if buffer:
+        yield "".join(buffer)
+
+
+def csv_lines(columns: Sequence[str], rows: Iterable[Sequence[Any]]) -> Iterator[str]:
+    writer = csv.writer(_Line())
+    return _buffered(
+        writer.writerow(columns),
+        (writer.writerow([_value(v) for v in row]) for row in rows),
+    )
+
+
+def ndjson_lines(
+    columns: Sequence[str], rows: Iterable[Sequence[Any]]
+) -> Iterator[str]:
+    return _buffered(
+        "",
+        (
+            json.dumps(dict(zip(columns, map(_value, row), strict=True))) + "\n"
+            for row in rows
+        ),
+    )
+
+
+def rows(queryset: QuerySet, chunk_size: int) -> Iterator[Tuple[Any, ...]]:
+    # in a transaction: out of one, the server-side cursor of PostgreSQL is
+    # WITH HOLD, materialized by the server before the first row is returned
+    with transaction.atomic():
+        yield from queryset.iterator(chunk_size=chunk_size)
+
+
+def stream(
+    kind: str, format: str = "csv", chunk_size: int | None = None, **filters
+) -> Iterator[str]:
+    """The export, chunk by chunk (see queryset for the filters)"""
+    if format not in FORMATS:
+        raise ValueError(f"unknown format {format} (expected one of {list(FORMATS)})")
+    columns, qs = queryset(kind, **filters)
+    lines = csv_lines if format == "csv" else ndjson_lines
+    return lines(columns, rows(qs, chunk_size or settings.EXPORT_CHUNK_SIZE))
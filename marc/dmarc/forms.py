@@ -1,8 +1,25 @@
-from django.core.files.uploadedfile import InMemoryUploadedFile
-from django.forms import FileField, Form, ModelForm, ValidationError
+from typing import Any, Dict
 
+from django.core.files.uploadedfile import InMemoryUploadedFile
+from django.db.models import Q, QuerySet
+from django.forms import (
+    CharField,
+    ChoiceField,
+    DateField,
+    FileField,
+    Form,
+    IntegerField,
+    ModelForm,
+    ValidationError,
+)
 
-from marc.dmarc.models import Config
+from marc.dmarc.export import FORMATS
+from marc.dmarc.models import (
+    DEFAULT_MAX_LENGTH,
+    Config,
+    DispositionType,
+    DmarcResultType,
+)
 
 
 class ConfigForm(ModelForm):
@@ -22,3 +39,76 @@ def validate_file(file: InMemoryUploadedFile):
 
 class FileForm(Form):
     file = FileField(validators=[validate_file])
+
+
+class RecordFilterForm(Form):
+    """Filter, sort and paginate the records of a feedback (in SQL)"""
+
+    # sort key -> ordering
+    SORTS = {
+        "": ("id",),
+        "count": ("row__count", "id"),
+        "-count": ("-row__count", "id"),
+        "source_ip": ("row__source_ip", "id"),
+        "disposition": ("row__policy_evaluated__disposition", "id"),
+        "header_from": ("identifiers__header_from", "id"),
+        "envelope_from": ("identifiers__envelope_from", "id"),
+    }
+
+    disposition = ChoiceField(
+        choices=[("", "any disposition")] + DispositionType.choices,
+        required=False,
+    )
+    dmarc = ChoiceField(
+        choices=[("", "any dmarc"), ("pass", "dmarc pass"), ("fail", "dmarc fail")],
+        required=False,
+    )
+    source_ip = CharField(max_length=64, required=False)
+    sort = ChoiceField(
+        choices=[
+            ("", "report order"),
+            ("-count", "count (desc)"),
+            ("count", "count (asc)"),
+            ("source_ip", "source_ip"),
+            ("disposition", "disposition"),
+            ("header_from", "header_from"),
+            ("envelope_from", "envelope_from"),
+        ],
+        required=False,
+    )
+    page = IntegerField(min_value=1, required=False)
+
+    def apply(self, queryset: QuerySet) -> QuerySet:
+        """Filter and sort the queryset (invalid fields are ignored)"""
+        data = self.cleaned_data if self.is_valid() else {}
+        if disposition := data.get("disposition"):
+            queryset = queryset.filter(row__policy_evaluated__disposition=disposition)
+        if source_ip := data.get("source_ip"):
+            queryset = queryset.filter(row__source_ip__startswith=source_ip.strip())
+        if dmarc := data.get("dmarc"):
+            passed = Q(row__policy_evaluated__dkim=DmarcResultType.PASS) | Q(
+                row__policy_evaluated__spf=DmarcResultType.PASS
+            )
+            queryset = queryset.filter(passed if dmarc == "pass" else ~passed)
+        return queryset.order_by(*self.SORTS[data.get("sort") or ""])
+
+    def page_number(self) -> int:
+        return (self.cleaned_data.get("page") if self.is_valid() else None) or 1
+
+
+class ExportForm(Form):
+    """Format and filters of an export (see marc.dmarc.export)"""
+
+    # csv when empty
+    format = ChoiceField(choices=[(f, f) for f in FORMATS], required=False)
+    since = DateField(required=False)
+    until = DateField(required=False)
+    domain = CharField(max_length=DEFAULT_MAX_LENGTH, required=False)
+    disposition = ChoiceField(
+        choices=[("", "any disposition")] + DispositionType.choices,
+        required=False,
+    )
+
+    def filters(self) -> Dict[str, Any]:
+        data = self.cleaned_data
+        return {k: data[k] or None for k in ("since", "until", "domain", "disposition")}
@@ -0,0 +1,350 @@
+"""
+Ingest daemon: import the reports sent over a Unix socket (see marc.ingest)
+in batches, from a single writer (one thread, one database connection).
+
+- raw reports, and the paths of the reports sent by path, are written to
+  the spool before they are acknowledged and removed once their batch is
+  committed: the spool left by a crash is imported on startup
+- reports are only read by path from the spool, the collected directories
+  and settings.INGEST_PATHS (any client of the socket could make the daemon
+  read and quarantine its files otherwise)
+- the reports of a batch are parsed first, then written in one transaction
+  (one savepoint per report, duplicates are skipped)
+- the batch is retried when the database is unavailable (locked...), the
+  reports which cannot be parsed or written are moved to the failed/
+  subdirectory of the spool and quarantined (see marc.dmarc.quarantine)
+"""
+
+import itertools
+import logging
+import os
+import queue
+import selectors
+import socket
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Deque, List, Set, Tuple
+
+from django.conf import settings
+from django.db import IntegrityError, OperationalError, connection, transaction
+
+from marc.dmarc import metrics, quarantine
+from marc.dmarc.models import Config
+from marc.dmarc.parser import extract_parse, import_to_database, open_report
+
+logger = logging.getLogger("django.marc")
+
+# bytes
+MAX_DATA_SIZE = 64 * 2**20
+
+# seconds
+CLIENT_TIMEOUT = 30.0
+RETRY_DELAY = 1.0
+
+
+@dataclass
+class Item:
+    path: Path
+    # file of the spool (removed once imported)
+    spooled: bool
+    # file of the spool holding the path of a report sent by path (removed
+    # once imported, the report is not)
+    marker: Path | None = None
+
+
+@dataclass
+class BatchResult:
+    imported: int = 0
+    duplicates: int = 0
+    failed: int = 0
+
+
+class IngestDaemon:
+    def __init__(
+        self,
+        socket_path: str,
+        spool: Path | None = None,
+        batch_size: int = 100,
+        batch_wait: float = 0.5,
+        max_size: int = MAX_DATA_SIZE,
+    ):
+        self.socket_path = socket_path
+        self.spool = Path(spool or settings.INGEST_SPOOL)
+        self.failed_dir = self.spool / "failed"
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.max_size = max_size
+        self.queue: queue.Queue[Item] = queue.Queue()
+        # items of a batch to retry
+        self.pending: Deque[Item] = deque()
+        self.sock: socket.socket | None = None
+        self.stopping = threading.Event()
+        # directories of the reports sent by path (see start)
+        self.allowed: List[Path] = []
+        self._names = itertools.count()
+        self._thread: threading.Thread | None = None
+        self._clients: Set[threading.Thread] = set()
+
+    # socket side
+
+    def bind(self):
+        if os.path.exists(self.socket_path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.socket_path)
+            except OSError:
+                # left by a dead daemon
+                os.unlink(self.socket_path)
+            else:
+                raise OSError(f"{self.socket_path}: a daemon is already running")
+            finally:
+                probe.close()
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(self.socket_path)
+        # the mail system may run as another user of the group
+        os.chmod(self.socket_path, 0o660)
+        self.sock.listen(128)
+        self.sock.setblocking(False)
+
+    def start(self):
+        """Bind the socket, queue the spool and accept clients in a thread"""
+        self.spool.mkdir(parents=True, exist_ok=True)
+        self.failed_dir.mkdir(exist_ok=True)
+        self.allowed = self.allowed_directories()
+        self.recover()
+        self.bind()
+        self._thread = threading.Thread(target=self.accept_loop, daemon=True)
+        self._thread.start()
+
+    def allowed_directories(self) -> List[Path]:
+        """Where the reports sent by path may be (read once, when starting)"""
+        config = Config.objects.first()
+        collected = config.dirlist() if config and config.directories else []
+        paths = [self.spool, *settings.INGEST_PATHS, *collected]
+        return [Path(os.path.realpath(p)) for p in paths]
+
+    def check_path(self, value: bytes) -> Path:
+        # symbolic links are resolved: they cannot lead out of the directories
+        path = Path(os.path.realpath(os.fsdecode(value)))
+        if not any(path.is_relative_to(d) for d in self.allowed):
+            raise ValueError(f"{path} is not in an allowed directory")
+        return path
+
+    def accept_loop(self):
+        with selectors.DefaultSelector() as selector:
+            selector.register(self.sock, selectors.EVENT_READ)
+            while not self.stopping.is_set():
+                if not selector.select(timeout=0.2):
+                    continue
+                try:
+                    conn, _ = self.sock.accept()
+                except BlockingIOError:
+                    continue
+                thread = threading.Thread(target=self.handle, args=(conn,), daemon=True)
+                self._clients.add(thread)
+                thread.start()
+
+    def handle(self, conn: socket.socket):
+        """Queue the items of a client"""
+        conn.setblocking(True)
+        conn.settimeout(CLIENT_TIMEOUT)
+        n = 0
+        try:
+            with conn, conn.makefile("rb") as f:
+                try:
+                    while line := f.readline(4096):
+                        kind, _, value = line.rstrip(b"\n").partition(b" ")
+                        if kind == b"PATH":
+                            path = self.check_path(value)
+                            marker = self.write_spool(os.fsencode(path), ".path")
+                            self.queue.put(Item(path, False, marker))
+                        elif kind == b"DATA":
+                            size = int(value)
+                            if size > self.max_size:
+                                raise ValueError(f"report too large ({size} B)")
+                            data = f.read(size)
+                            if len(data) != size:
+                                raise ValueError("truncated report")
+                            self.queue.put(Item(self.write_spool(data), True))
+                        else:
+                            raise ValueError(f"unknown item {kind[:16]!r}")
+                        metrics.registry.inc("marc_files_total", source="ingestd")
+                        n += 1
+                except (ValueError, OSError) as err:
+                    logger.error(f"ingestd: client error after {n} item(s): {err}")
+                    conn.sendall(f"ERR {err}\n".encode())
+                else:
+                    conn.sendall(f"OK {n}\n".encode())
+        except OSError:
+            # client gone
+            pass
+        finally:
+            self._clients.discard(threading.current_thread())
+
+    def write_spool(self, data: bytes, suffix: str = ".report") -> Path:
+        # time ordered names
+        name = f"{time.time_ns():020d}-{os.getpid()}-{next(self._names)}"
+        tmp = self.spool / f"{name}.tmp"
+        tmp.write_bytes(data)
+        return tmp.rename(self.spool / f"{name}{suffix}")
+
+    def recover(self):
+        spooled = [*self.spool.glob("*.report"), *self.spool.glob("*.path")]
+        for path in sorted(spooled, key=lambda p: p.name):
+            if path.suffix == ".path":
+                self.queue.put(Item(Path(os.fsdecode(path.read_bytes())), False, path))
+            else:
+                self.queue.put(Item(path, True))
+        for path in self.spool.glob("*.tmp"):
+            # never acknowledged
+            path.unlink()
+        if self.queue.qsize():
+            logger.info(f"ingestd: {self.queue.qsize()} spooled report(s) queued")
+
+    # writer side
+
+    def next_batch(self, timeout: float | None = None) -> List[Item]:
+        """Up to batch_size items, waiting at most batch_wait after the first
+        one (and at most timeout for the first one)"""
+        batch = [self.pending.popleft() for _ in range(len(self.pending))]
+        if not batch:
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                return batch
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(
+                    self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                )
+            except queue.Empty:
+                break
+        return batch
+
+    def import_batch(self, items: List[Item]) -> BatchResult:
+        """Import the items (OperationalError: nothing is written, retry)"""
+        result = BatchResult()
+        parsed = []
+        done = []
+        failed: List[Tuple[Item, Exception]] = []
+        for item in items:
+            try:
+                with open_report(item.path) as f:
+                    parsed.append((item, extract_parse(f)))
+            except IntegrityError:
+                # found by the pre-scan
+                logger.debug(f"ingestd: {item.path} already imported")
+                result.duplicates += 1
+                done.append(item)
+            except FileNotFoundError as err:
+                logger.error(f"ingestd: {err}")
+                result.failed += 1
+                done.append(item)
+            except Exception as err:
+                logger.error(f"ingestd: {item.path}: {err}")
+                failed.append((item, err))
+                result.failed += 1
+
+        with transaction.atomic():
+            for item, obj in parsed:
+                # one savepoint per report (see import_to_database)
+                try:
+                    import_to_database(obj)
+                    result.imported += 1
+                    done.append(item)
+                except IntegrityError:
+                    logger.debug(f"ingestd: {item.path} already imported")
+                    result.duplicates += 1
+                    done.append(item)
+                except OperationalError:
+                    raise
+                except Exception as err:
+                    logger.error(f"ingestd: {item.path}: {err}")
+                    failed.append((item, err))
+                    result.failed += 1
+
+        # only once the batch is committed: a batch rolled back is retried with
+        # its files and markers untouched
+        for item in done:
+            self.unspool(item)
+        for item, err in failed:
+            self.move_failed(item, err)
+        return result
+
+    def unspool(self, item: Item):
+        if item.spooled:
+            item.path.unlink(missing_ok=True)
+        if item.marker is not None:
+            item.marker.unlink(missing_ok=True)
+
+    def move_failed(self, item: Item, err: Exception):
+        path = item.path
+        if item.spooled:
+            path = path.replace(self.failed_dir / path.name)
+        quarantine.record(path, err)
+        if item.marker is not None:
+            item.marker.unlink(missing_ok=True)
+
+    def process(self, items: List[Item]) -> BatchResult | None:
+        """Import a batch, requeue it if the database is unavailable"""
+        start = time.perf_counter()
+        try:
+            result = self.import_batch(items)
+        except OperationalError as err:
+            logger.warning(f"ingestd: {len(items)} report(s) postponed: {err}")
+            self.recycle_connection()
+            self.pending.extend(items)
+            return None
+        finally:
+            metrics.save()
+        logger.info(
+            f"ingestd: {result.imported} imported, {result.duplicates} duplicate(s), "
+            f"{result.failed} failed in {time.perf_counter() - start:.3f}s"
+        )
+        self.recycle_connection()
+        return result
+
+    def recycle_connection(self):
+        """Drop the connection if it is broken or older than CONN_MAX_AGE (like
+        at the end of a request)"""
+        if not connection.in_atomic_block:
+            connection.close_if_unusable_or_obsolete()
+
+    def flush(self):
+        """Import everything queued"""
+        while batch := self.next_batch(timeout=0):
+            if self.process(batch) is None:
+                break
+
+    def run(self):
+        """Import the batches until stop() is called, then the queue left"""
+        while not self.stopping.is_set():
+            batch = self.next_batch(timeout=0.5)
+            if batch and self.process(batch) is None:
+                self.stopping.wait(RETRY_DELAY)
+        if self._thread is not None:
+            self._thread.join()
+        for thread in list(self._clients):
+            thread.join(CLIENT_TIMEOUT)
+        self.flush()
+        left = len(self.pending) + self.queue.qsize()
+        if left:
+            logger.warning(f"ingestd: {left} report(s) not imported")
+
+    def stop(self, *args):
+        self.stopping.set()
+
+    def close(self):
+        self.stop()
+        if self._thread is not None:
+            self._thread.join()
+        if self.sock is not None:
+            self.sock.close()
+            try:
+                os.unlink(self.socket_path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,52 @@
+from pathlib import Path
+from typing import List, Literal
+
+from django.core.management.base import BaseCommand
+
+from marc.dmarc import benchmark
+from marc.dmarc.management.commands._logging import logger
+
+
+class Command(BaseCommand):
+    help = "Benchmark the import of DMARC reports stage by stage"
+
+    def add_arguments(self, parser):
+        parser.add_argument("report", type=str, nargs="+", help="Files or directories")
+        parser.add_argument(
+            "-o",
+            "--output",
+            type=Path,
+            help="Save the results to this JSON file",
+        )
+        parser.add_argument(
+            "--compare",
+            type=Path,
+            help="JSON results of a previous run to compare with",
+        )
+        parser.add_argument(
+            "--commit",
+            action="store_true",
+            help="Keep the imported reports (they are rolled back by default)",
+        )
+
+    def handle(
+        self,
+        *args,
+        report: List[str],
+        output: Path | None,
+        compare: Path | None,
+        commit: bool,
+        verbosity: Literal[0, 1, 2, 3],
+        **options,
+    ):
+        logger.setLevel(40 - 10 * verbosity)
+        result = benchmark.run(benchmark.iter_files(report), commit=commit)
+        results = result.as_dict()
+
+        baseline = benchmark.load_results(compare) if compare else None
+        for line in benchmark.format_results(results, baseline):
+            self.stdout.write(line)
+
+        if output:
+            benchmark.save_results(results, output)
+            logger.info(f"Results saved to {output}")
@@ -0,0 +1,67 @@
+import shlex
+from pathlib import Path
+from typing import List, Literal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from marc.dmarc import benchmark_startup
+from marc.dmarc.management.commands._logging import logger
+
+
+class Command(BaseCommand):
+    help = "Benchmark the startup time of marc commands (python -X importtime)"
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "command",
+            type=str,
+            nargs="*",
+            help='Commands to measure, e.g. "cleanall --help" (non-import commands by default)',
+        )
+        parser.add_argument(
+            "-r",
+            "--runs",
+            type=int,
+            default=3,
+            help="Measured runs per command (the best one is kept)",
+        )
+        parser.add_argument(
+            "-o",
+            "--output",
+            type=Path,
+            help="Save the results to this JSON file",
+        )
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Fail if a command imports heavy modules or exceeds the app "
+            f"import budget ({benchmark_startup.APP_IMPORT_BUDGET * 1e3:.0f} ms)",
+        )
+
+    def handle(
+        self,
+        *args,
+        command: List[str],
+        runs: int,
+        output: Path | None,
+        check: bool,
+        verbosity: Literal[0, 1, 2, 3],
+        **options,
+    ):
+        logger.setLevel(40 - 10 * verbosity)
+        commands = (
+            [shlex.split(c) for c in command] if command else benchmark_startup.COMMANDS
+        )
+        results = benchmark_startup.run(commands, runs=runs)
+        for line in benchmark_startup.format_results(results):
+            self.stdout.write(line)
+
+        if output:
+            benchmark_startup.save_results(results, output)
+            logger.info(f"Results saved to {output}")
+
+        if check:
+            failures = benchmark_startup.over_budget(results)
+            if failures:
+                raise CommandError("\n".join(failures))
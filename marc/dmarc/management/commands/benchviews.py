@@ -0,0 +1,104 @@
+from pathlib import Path
+from typing import Literal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from marc.dmarc import benchmark, benchmark_views
+from marc.dmarc.management.commands._logging import logger
+from marc.dmarc.models import Feedback
+
+
+class Command(BaseCommand):
+    help = "Benchmark the latency of every route against a (seeded) database"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--feedbacks",
+            type=int,
+            default=0,
+            help="Seed the (empty) database with this number of synthetic reports",
+        )
+        parser.add_argument(
+            "--records",
+            type=int,
+            default=0,
+            help="Total number of records of the seeded reports",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "-n",
+            "--requests",
+            type=int,
+            default=50,
+            help="Number of requests per route",
+        )
+        parser.add_argument(
+            "--sample",
+            type=int,
+            default=1000,
+            help="Number of objects picked for the detail and row routes",
+        )
+        parser.add_argument(
+            "--htmx",
+            action="store_true",
+            help="Send the HX-Request header (fragment rendering)",
+        )
+        parser.add_argument(
+            "--warm-cache",
+            action="store_true",
+            help="Do not clear the cache before each request",
+        )
+        parser.add_argument("-o", "--output", type=Path, help="Save results as JSON")
+        parser.add_argument(
+            "--compare",
+            type=Path,
+            help="JSON results of a previous run to compare with",
+        )
+
+    def handle(
+        self,
+        *args,
+        feedbacks: int,
+        records: int,
+        seed: int,
+        requests: int,
+        sample: int,
+        htmx: bool,
+        warm_cache: bool,
+        output: Path | None,
+        compare: Path | None,
+        verbosity: Literal[0, 1, 2, 3],
+        **options,
+    ):
+        logger.setLevel(40 - 10 * verbosity)
+        if feedbacks > 0:
+            if Feedback.objects.exists():
+                raise CommandError(
+                    "The database is not empty: seed a scratch database "
+                    "(MARC_DB_NAME) or run without --feedbacks"
+                )
+            total = benchmark_views.seed(
+                feedbacks,
+                records or feedbacks * 50,
+                seed=seed,
+                progress=lambda n, r: logger.info(f"{n} report(s), {r} record(s)"),
+            )
+            logger.info(
+                f"Database seeded with {feedbacks} report(s), {total} record(s)"
+            )
+
+        results = benchmark_views.run(
+            requests=requests,
+            sample=sample,
+            htmx=htmx,
+            warm_cache=warm_cache,
+            seed=seed,
+        )
+
+        baseline = benchmark.load_results(compare) if compare else None
+        for line in benchmark_views.format_results(results, baseline):
+            self.stdout.write(line)
+
+        if output:
+            benchmark.save_results(results, output)
+            logger.info(f"Results saved to {output}")
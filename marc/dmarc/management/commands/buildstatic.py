@@ -0,0 +1,69 @@
+from pathlib import Path
+from typing import Literal
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from marc.dmarc import staticfiles
+from marc.dmarc.management.commands._logging import logger
+
+
+class Command(BaseCommand):
+    help = (
+        "Collect the static files to STATIC_ROOT with hashed names "
+        "and write their gzip/brotli variants"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--fonts",
+            action="store_true",
+            help="Regenerate the woff2 subsets of the fonts first (requires fontTools and brotli)",
+        )
+        parser.add_argument(
+            "--clear",
+            action="store_true",
+            help="Remove the files of the previous builds",
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Recompress files whose variants are up to date",
+        )
+
+    def handle(
+        self,
+        *args,
+        fonts: bool,
+        clear: bool,
+        force: bool,
+        verbosity: Literal[0, 1, 2, 3],
+        **options,
+    ):
+        logger.setLevel(40 - 10 * verbosity)
+        if fonts:
+            try:
+                for directory in settings.STATICFILES_DIRS:
+                    for path in staticfiles.subset_fonts(Path(directory)):
+                        logger.debug(f"{path} ({path.stat().st_size} B)")
+            except ImportError as err:
+                raise CommandError(f"fontTools and brotli are required: {err}") from err
+
+        call_command(
+            "collectstatic", interactive=False, clear=clear, verbosity=verbosity - 1
+        )
+
+        root = Path(settings.STATIC_ROOT)
+        # the pages only reference the hashed names
+        hashed_files, _ = staticfiles_storage.load_manifest()
+        variants = 0
+        for path, _, size in staticfiles.compress(
+            root, hashed_files.values(), force=force
+        ):
+            logger.debug(f"{path.relative_to(root)} ({size} B)")
+            variants += 1
+        if staticfiles.load_brotli() is None:
+            logger.warning("brotli is not installed: gzip variants only")
+        logger.info(f"{variants} compressed file(s) written to {root}")
@@ -2,19 +2,29 @@ from typing import Literal
 
 from django.core.management.base import BaseCommand
 
+from marc.dmarc.cleanup import DEFAULT_CHUNK_SIZE, delete_feedbacks
 from marc.dmarc.management.commands._logging import logger
-from marc.dmarc.models import Feedback, PolicyPublished
+from marc.dmarc.models import Feedback
 
 
 class Command(BaseCommand):
     help = "Remove all DMARC reports"
 
     def add_arguments(self, parser):
-        pass
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=DEFAULT_CHUNK_SIZE,
+            help="Number of reports removed per transaction",
+        )
 
-    def handle(self, *args, verbosity: Literal[0, 1, 2, 3], **options):
+    def handle(
+        self,
+        *args,
+        chunk_size: int,
+        verbosity: Literal[0, 1, 2, 3],
+        **options,
+    ):
         logger.setLevel(40 - 10 * verbosity)
-        key = f"{Feedback._meta.app_label}.{Feedback.__name__}"
-        _, results = Feedback.objects.all().delete()
-        PolicyPublished.objects.all().delete()
-        logger.info(f"{results.get(key, 0)} report(s) removed")
+        total = delete_feedbacks(Feedback.objects.all(), chunk_size=chunk_size)
+        logger.info(f"{total} report(s) removed")
@@ -0,0 +1,33 @@
+from typing import Literal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from marc.dmarc import metrics, profiling
+from marc.dmarc.management.commands._logging import logger
+
+
+class Command(BaseCommand):
+    help = "Import the reports of the configured directories"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--profile",
+            action="store_true",
+            help="Profile the import (cProfile and tracemalloc), see MARC_PROFILE_DIR",
+        )
+
+    def handle(
+        self,
+        *args,
+        profile: bool,
+        verbosity: Literal[0, 1, 2, 3],
+        **options,
+    ):
+        logger.setLevel(40 - 10 * verbosity)
+        from marc.dmarc.collect import collect
+
+        with profiling.profile("collect", enabled=profile or settings.PROFILE):
+            total = collect()
+        logger.info(f"{total} report(s) imported")
+        metrics.save()
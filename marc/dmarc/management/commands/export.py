@@ -0,0 +1,82 @@
+from argparse import ArgumentTypeError
+from datetime import date
+from typing import Literal
+
+from django.core.management.base import BaseCommand
+
+from marc.dmarc import export
+from marc.dmarc.management.commands._logging import logger
+from marc.dmarc.models import DispositionType
+
+
+def day(value: str) -> date:
+    """Parse days like 2024-06-30"""
+    try:
+        return date.fromisoformat(value.strip())
+    except ValueError:
+        raise ArgumentTypeError(
+            f"invalid day '{value}' (expected YYYY-MM-DD)"
+        ) from None
+
+
+class Command(BaseCommand):
+    help = "Export the records (or the feedbacks) as CSV or NDJSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument("kind", choices=export.KINDS)
+        parser.add_argument("--format", choices=list(export.FORMATS), default="csv")
+        parser.add_argument(
+            "--since",
+            type=day,
+            metavar="DAY",
+            help="Reports whose period ends on or after that day",
+        )
+        parser.add_argument(
+            "--until",
+            type=day,
+            metavar="DAY",
+            help="Reports whose period starts on or before that day",
+        )
+        parser.add_argument("--domain", help="Domain of the published policy")
+        parser.add_argument(
+            "--disposition",
+            choices=DispositionType.values,
+            help="Disposition of the records (published policy of the feedbacks)",
+        )
+        parser.add_argument(
+            "-o", "--output", help="File to write (default: standard output)"
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            help="Rows fetched at once (default: MARC_EXPORT_CHUNK_SIZE)",
+        )
+
+    def handle(
+        self,
+        *args,
+        kind: str,
+        format: str,
+        output: str | None,
+        chunk_size: int | None,
+        verbosity: Literal[0, 1, 2, 3],
+        **options,
+    ):
+        logger.setLevel(40 - 10 * verbosity)
+        chunks = export.stream(
+            kind,
+            format,
+            chunk_size,
+            since=options["since"],
+            until=options["until"],
+            domain=options["domain"],
+            disposition=options["disposition"],
+        )
+        if output is None:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending="")
+            return
+        with open(output, "w", newline="", encoding="utf-8") as f:
+            for chunk in chunks:
+                f.write(chunk)
+        logger.info(f"{kind} exported to {output}")
@@ -0,0 +1,91 @@
+from pathlib import Path
+from typing import Literal, Tuple
+
+from django.core.management.base import BaseCommand
+
+from marc.dmarc.management.commands._logging import logger
+from marc.report.synthetic import GeneratorConfig, ReportGenerator
+
+
+def int_range(value: str) -> Tuple[int, int]:
+    """Parse 'n' or 'min-max'"""
+    low, _, high = value.partition("-")
+    return int(low), int(high or low)
+
+
+class Command(BaseCommand):
+    help = "Generate synthetic DMARC reports (seeded)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("directory", type=Path)
+        parser.add_argument("-n", "--count", type=int, default=100)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--records",
+            type=int_range,
+            default=GeneratorConfig.records,
+            help="Number of records per report ('n' or 'min-max')",
+        )
+        parser.add_argument(
+            "--dkim",
+            type=int_range,
+            default=GeneratorConfig.dkim,
+            help="Number of DKIM results per record ('n' or 'min-max')",
+        )
+        parser.add_argument(
+            "--spf",
+            type=int_range,
+            default=GeneratorConfig.spf,
+            help="Number of SPF results per record ('n' or 'min-max')",
+        )
+        parser.add_argument(
+            "--override-ratio",
+            type=float,
+            default=GeneratorConfig.override_ratio,
+            help="Probability that a record has policy override reasons",
+        )
+        parser.add_argument(
+            "--ipv6-ratio",
+            type=float,
+            default=GeneratorConfig.ipv6_ratio,
+            help="Probability that a source IP is IPv6",
+        )
+        parser.add_argument(
+            "--fail-ratio",
+            type=float,
+            default=GeneratorConfig.fail_ratio,
+            help="Probability that a record fails DMARC",
+        )
+        parser.add_argument(
+            "--compression",
+            choices=["none", "gzip", "zip", "mixed"],
+            default="none",
+        )
+
+    def handle(
+        self,
+        *args,
+        directory: Path,
+        count: int,
+        seed: int,
+        records: Tuple[int, int],
+        dkim: Tuple[int, int],
+        spf: Tuple[int, int],
+        override_ratio: float,
+        ipv6_ratio: float,
+        fail_ratio: float,
+        compression: Literal["none", "gzip", "zip", "mixed"],
+        verbosity: Literal[0, 1, 2, 3],
+        **options,
+    ):
+        logger.setLevel(40 - 10 * verbosity)
+        config = GeneratorConfig(
+            records=records,
+            dkim=dkim,
+            spf=spf,
+            override_ratio=override_ratio,
+            ipv6_ratio=ipv6_ratio,
+            fail_ratio=fail_ratio,
+        )
+        paths = ReportGenerator(seed, config).write_all(directory, count, compression)
+        logger.info(f"{len(paths)} report(s) written to {directory}")
@@ -0,0 +1,72 @@
+import signal
+from pathlib import Path
+from typing import Literal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from marc import ingest
+from marc.dmarc.ingestd import IngestDaemon
+from marc.dmarc.management.commands._logging import logger
+
+
+class Command(BaseCommand):
+    help = (
+        "Import the reports sent by `marc ingest` over a Unix socket, "
+        "in batches through a single database connection"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-s",
+            "--socket",
+            default=ingest.socket_path(),
+            help="Unix socket to listen on (MARC_INGEST_SOCKET, default: %(default)s)",
+        )
+        parser.add_argument(
+            "--spool",
+            type=Path,
+            default=Path(settings.INGEST_SPOOL),
+            help="Where raw reports are kept until imported (MARC_INGEST_SPOOL, default: %(default)s)",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="Maximum number of reports imported per transaction (default: %(default)s)",
+        )
+        parser.add_argument(
+            "--batch-wait",
+            type=float,
+            default=0.5,
+            help="Seconds to wait for more reports before importing a batch (default: %(default)s)",
+        )
+
+    def handle(
+        self,
+        *args,
+        socket: str,
+        spool: Path,
+        batch_size: int,
+        batch_wait: float,
+        verbosity: Literal[0, 1, 2, 3],
+        **options,
+    ):
+        logger.setLevel(40 - 10 * verbosity)
+        if batch_size < 1:
+            raise CommandError("the batch size must be positive")
+        daemon = IngestDaemon(
+            socket, spool=spool, batch_size=batch_size, batch_wait=batch_wait
+        )
+        signal.signal(signal.SIGTERM, daemon.stop)
+        signal.signal(signal.SIGINT, daemon.stop)
+        try:
+            daemon.start()
+        except OSError as err:
+            raise CommandError(f"cannot listen on {socket}: {err}") from err
+        logger.info(f"ingestd listening on {socket} (spool: {spool})")
+        try:
+            daemon.run()
+        finally:
+            daemon.close()
+        logger.info("ingestd stopped")
@@ -1,46 +1,151 @@
 import os
+import time
 from typing import List, Literal
 
-from django.core.management.base import BaseCommand
-from django.db import IntegrityError, transaction
-from pydantic import ValidationError
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, OperationalError, transaction
 
+from marc.dmarc import bulkimport, metrics, profiling, quarantine
 from marc.dmarc.management.commands._logging import logger
-from marc.dmarc.parser import extract_parse, import_to_database
+from marc.dmarc.models import ImportJob
+
+# seconds between two progress lines of a bulk import
+PROGRESS_INTERVAL = 5.0
 
 
 class Command(BaseCommand):
     help = "Import DMARC report (xml: raw, zipped or gzipped)"
 
     def add_arguments(self, parser):
-        parser.add_argument("report", type=str, nargs="+")
+        parser.add_argument("report", type=str, nargs="*")
+        parser.add_argument(
+            "--profile",
+            action="store_true",
+            help="Profile the import (cProfile and tracemalloc), see MARC_PROFILE_DIR",
+        )
+        parser.add_argument(
+            "--bulk",
+            action="store_true",
+            help="Import by batches recorded in the database, restartable with "
+            "--resume (directories are walked)",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=bulkimport.DEFAULT_BATCH_SIZE,
+            help="Reports per transaction of a bulk import",
+        )
+        parser.add_argument(
+            "--resume",
+            type=int,
+            nargs="?",
+            const=0,
+            metavar="JOB",
+            help="Continue an interrupted bulk import (the last one by default)",
+        )
 
     def handle(
         self,
         *args,
         report: List[str],
+        profile: bool,
+        bulk: bool,
+        batch_size: int,
+        resume: int | None,
         verbosity: Literal[0, 1, 2, 3],
         **options,
     ):
         # see https://docs.python.org/3/library/logging.html#logging-levels
         logger.setLevel(40 - 10 * verbosity)
 
+        if resume is not None:
+            if report:
+                raise CommandError("--resume continues a job: no report expected")
+            job = self.unfinished_job(resume)
+        elif not report:
+            raise CommandError("the following arguments are required: report")
+        elif bulk:
+            if batch_size < 1:
+                raise CommandError("--batch-size must be positive")
+            for unfinished in bulkimport.unfinished_jobs():
+                logger.warning(
+                    f"job {unfinished.id} is unfinished "
+                    f"(loadreport --resume {unfinished.id})"
+                )
+            job = bulkimport.create_job(report, batch_size)
+            logger.info(f"job {job.id}: {job.total} files")
+        else:
+            job = None
+
+        with profiling.profile("loadreport", enabled=profile or settings.PROFILE):
+            if job is None:
+                total = self.load(report)
+            else:
+                total = self.load_bulk(job, progress=verbosity > 0)
+
+        logger.info(f"{total} report(s) imported")
+        # make the metrics of this run visible on /metrics
+        metrics.save()
+
+    def unfinished_job(self, job_id: int) -> ImportJob:
+        jobs = bulkimport.unfinished_jobs()
+        if job_id:
+            jobs = [job for job in jobs if job.id == job_id]
+        if not jobs:
+            raise CommandError(
+                f"no unfinished job {job_id}" if job_id else "no unfinished job"
+            )
+        return jobs[0]
+
+    def load_bulk(self, job: ImportJob, progress: bool = True) -> int:
+        last = 0.0
+
+        def checkpoint(job: ImportJob, p: bulkimport.Progress):
+            nonlocal last
+            if time.monotonic() - last >= PROGRESS_INTERVAL or job.done == job.total:
+                last = time.monotonic()
+                self.stdout.write(p.format(job))
+
+        imported = job.imported
+        try:
+            bulkimport.run(job, on_checkpoint=checkpoint if progress else None)
+        except (KeyboardInterrupt, OperationalError) as err:
+            # the batch in progress is rolled back
+            raise CommandError(
+                f"job {job.id} interrupted at {job.done}/{job.total} files "
+                f"({type(err).__name__}), continue with loadreport --resume {job.id}"
+            ) from err
+        return job.imported - imported
+
+    def load(self, report: List[str]) -> int:
+        # heavy (xsdata, pydantic, report dataclasses): not needed by --help
+        from marc.dmarc.parser import extract_parse, import_to_database, open_report
+
+        quarantined = quarantine.fingerprints(report)
         total = 0
         for r in report:
             if os.path.isdir(r):
                 continue
 
+            metrics.registry.inc("marc_files_total", source="loadreport")
+            if quarantine.is_quarantined(r, quarantined):
+                logger.warning(f"File {r} is quarantined (see marc quarantine)")
+                continue
             try:
                 with transaction.atomic():
-                    with open(r, "rb") as f:
+                    # named on the command line: mapped (see open_report)
+                    with open_report(r, mapped=True) as f:
                         import_to_database(extract_parse(f))
                 total += 1
                 logger.debug(f"File {r} imported")
                 # if verbosity >= 2:
                 #     print(f"File {r} imported")
+                if os.path.abspath(r) in quarantined:
+                    quarantine.release(r)
             except IntegrityError:
                 logger.debug(f"File {r} already imported")
-            except ValidationError as err:
-                logger.error(err)
-
-        logger.info(f"{total} report(s) imported")
+            except Exception as err:
+                logger.error(f"File {r}: {err}")
+                quarantine.record(r, err)
+        return total
@@ -0,0 +1,72 @@
+import re
+from argparse import ArgumentTypeError
+from datetime import UTC, datetime, timedelta
+from typing import Literal
+
+from django.core.management.base import BaseCommand
+
+from marc.dmarc.cleanup import DEFAULT_CHUNK_SIZE, delete_feedbacks
+from marc.dmarc.management.commands._logging import logger
+from marc.dmarc.models import Feedback
+
+UNITS = {
+    "s": "seconds",
+    "m": "minutes",
+    "h": "hours",
+    "d": "days",
+    "w": "weeks",
+}
+
+duration_regex = re.compile(r"^(\d+)([smhdw])$")
+
+
+def duration(value: str) -> timedelta:
+    """Parse durations like 180d, 12h or 2w"""
+    m = duration_regex.match(value.strip())
+    if m is None:
+        raise ArgumentTypeError(
+            f"invalid duration '{value}' (expected <int><unit> with unit in {''.join(UNITS)})"
+        )
+    return timedelta(**{UNITS[m.group(2)]: int(m.group(1))})
+
+
+class Command(BaseCommand):
+    help = "Remove DMARC reports older than a given duration"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--older-than",
+            type=duration,
+            required=True,
+            help="Remove reports whose period ended before now - duration (ex: 180d)",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=DEFAULT_CHUNK_SIZE,
+            help="Number of reports removed per transaction",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only count the reports that would be removed",
+        )
+
+    def handle(
+        self,
+        *args,
+        older_than: timedelta,
+        chunk_size: int,
+        dry_run: bool,
+        verbosity: Literal[0, 1, 2, 3],
+        **options,
+    ):
+        logger.setLevel(40 - 10 * verbosity)
+        before = datetime.now(UTC) - older_than
+        expired = Feedback.objects.filter(report_metadata__date_range_end__lt=before)
+        if dry_run:
+            logger.info(f"{expired.count()} report(s) ended before {before}")
+            return
+
+        total = delete_feedbacks(expired, chunk_size=chunk_size)
+        logger.info(f"{total} report(s) ended before {before} removed")
@@ -0,0 +1,65 @@
+from datetime import timedelta
+from typing import List, Literal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from marc.dmarc import metrics, quarantine
+from marc.dmarc.management.commands._logging import logger
+from marc.dmarc.management.commands.prune import duration
+
+
+class Command(BaseCommand):
+    help = "List, retry or purge the report files which could not be imported"
+
+    def add_arguments(self, parser):
+        parser.add_argument("action", choices=["list", "retry", "purge"])
+        parser.add_argument(
+            "ids", metavar="id", type=int, nargs="*", help="Files (all if none)"
+        )
+        parser.add_argument("--error", help="Only the files failing with this error")
+        parser.add_argument("--path", help="Only the files under this path")
+        parser.add_argument(
+            "--older-than",
+            type=duration,
+            help="Only the files which failed for the last time before now - duration (ex: 30d)",
+        )
+        parser.add_argument(
+            "--delete-files",
+            action="store_true",
+            help="purge: remove the files from the disk too",
+        )
+
+    def handle(
+        self,
+        *args,
+        action: str,
+        ids: List[int],
+        error: str | None,
+        path: str | None,
+        older_than: timedelta | None,
+        delete_files: bool,
+        verbosity: Literal[0, 1, 2, 3],
+        **options,
+    ):
+        logger.setLevel(40 - 10 * verbosity)
+        files = quarantine.select(ids, error, path, older_than)
+
+        if action == "list":
+            for f in files:
+                self.stdout.write(
+                    f"{f.id:>6}  {f.last_seen:%Y-%m-%d %H:%M:%S}  {f.attempts:>3}  "
+                    f"{f.error_class:<20}  {f.path}\n"
+                    f"        {f.message.splitlines()[0] if f.message else ''}"
+                )
+        elif action == "retry":
+            result = quarantine.retry(files)
+            logger.info(
+                f"{result.imported} imported, {result.duplicates} already imported, "
+                f"{result.failed} failed, {result.missing} missing"
+            )
+            metrics.save()
+            if result.failed:
+                raise CommandError(f"{result.failed} file(s) still failing")
+        else:
+            total = quarantine.purge(files, delete_files=delete_files)
+            logger.info(f"{total} file(s) purged")
@@ -0,0 +1,142 @@
+import importlib
+import os
+from typing import Literal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from marc.dmarc.management.commands._logging import logger
+
+LOG_LEVELS = ["error", "info", "debug", "debug"]
+
+
+def post_fork(server, worker):
+    from marc.dmarc import metrics
+
+    # each worker has its own registry
+    metrics.share()
+
+
+def worker_exit(server, worker):
+    from marc.dmarc import metrics
+
+    metrics.save()
+
+
+def run_gunicorn(options: dict):
+    """Run marc.wsgi with gunicorn (pre-forked workers)"""
+    from gunicorn.app.base import BaseApplication
+
+    class Application(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            # in the workers: a reload (HUP) picks up the new code
+            from marc.wsgi import application
+
+            return application
+
+    Application().run()
+
+
+def run_waitress(bind: str, threads: int):
+    """Run marc.wsgi with waitress (one process, no fork on Windows)"""
+    from waitress import serve
+
+    from marc.wsgi import application
+
+    if bind.startswith("unix:"):
+        serve(application, unix_socket=bind[len("unix:") :], threads=threads)
+    else:
+        serve(application, listen=bind, threads=threads)
+
+
+class Command(BaseCommand):
+    help = "Run the production server (gunicorn, or waitress without fork)"
+    # the workers import the application (reloads pick up the new code)
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-b",
+            "--bind",
+            default=os.getenv("MARC_BIND", "127.0.0.1:8000"),
+            help="host:port or unix:/path/to/socket (default: %(default)s)",
+        )
+        parser.add_argument(
+            "-w",
+            "--workers",
+            type=int,
+            default=int(os.getenv("MARC_WORKERS", os.cpu_count() or 1)),
+            help="Number of worker processes (default: %(default)s)",
+        )
+        parser.add_argument(
+            "-t",
+            "--threads",
+            type=int,
+            default=int(os.getenv("MARC_THREADS", "8")),
+            help="Threads handling requests in each worker (default: %(default)s)",
+        )
+        parser.add_argument(
+            "--keep-alive",
+            type=int,
+            default=int(os.getenv("MARC_KEEP_ALIVE", "5")),
+            help="Seconds an idle connection is kept open (default: %(default)s)",
+        )
+        parser.add_argument(
+            "--graceful-timeout",
+            type=int,
+            default=30,
+            help="Seconds given to the workers to finish their requests on stop/reload",
+        )
+        parser.add_argument(
+            "--max-requests",
+            type=int,
+            default=0,
+            help="Restart a worker after this number of requests (0: never)",
+        )
+
+    def handle(
+        self,
+        *args,
+        bind: str,
+        workers: int,
+        threads: int,
+        keep_alive: int,
+        graceful_timeout: int,
+        max_requests: int,
+        verbosity: Literal[0, 1, 2, 3],
+        **options,
+    ):
+        logger.setLevel(40 - 10 * verbosity)
+        if workers < 1 or threads < 1:
+            raise CommandError("at least one worker and one thread are required")
+        fork = hasattr(os, "fork")
+        try:
+            importlib.import_module("gunicorn" if fork else "waitress")
+        except ImportError as err:
+            raise CommandError(
+                f'gunicorn (waitress on Windows) is required, pip install "marc[serve]": {err}'
+            ) from err
+        # connections must not be shared with the workers
+        connections.close_all()
+        if not fork:
+            if workers > 1:
+                logger.warning("waitress runs a single worker (no fork)")
+            return run_waitress(bind, threads)
+        run_gunicorn(
+            {
+                "bind": [bind],
+                "workers": workers,
+                "threads": threads,
+                "keepalive": keep_alive,
+                "graceful_timeout": graceful_timeout,
+                "max_requests": max_requests,
+                "loglevel": LOG_LEVELS[verbosity],
+                "accesslog": "-" if verbosity > 1 else None,
+                "post_fork": post_fork,
+                "worker_exit": worker_exit,
+            }
+        )
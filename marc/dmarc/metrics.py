@@ -0,0 +1,315 @@
+"""
+Metrics in the Prometheus text exposition format (served on /metrics).
+
+Counters and histograms live in a process-wide registry. Commands (loadreport)
+run in their own process: they add their registry to settings.METRICS_FILE
+when they end and /metrics merges this file with the registry of the server.
+The workers of marc serve are processes too (see share): they add their
+registry to the file every few seconds and before answering /metrics, which
+then serves the file alone (the counters never go back when the scrapes hit
+different workers).
+Gauges (database size, rows per table, last import) are read from the
+database at scrape time, at most once per settings.METRICS_GAUGES_TTL (the
+counts of the big tables are full scans on SQLite).
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple, Type
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, models, router, transaction
+from django.db.models import Max
+
+from marc.dmarc.models import Feedback, ReportMetadata
+
+try:
+    import fcntl
+except ImportError:  # windows
+    fcntl = None
+
+logger = logging.getLogger("django.marc")
+
+# seconds
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# between two saves of the registry of a worker
+SHARE_INTERVAL = 10.0
+
+COUNTERS = {
+    "marc_files_total": "Report files processed by source (collect, loadreport)",
+    "marc_reports_imported_total": "Reports imported",
+    "marc_records_imported_total": "Records imported",
+    "marc_duplicates_skipped_total": "Reports skipped because already imported",
+    "marc_quarantine_skipped_total": "Files skipped because they failed before",
+    "marc_import_failures_total": "Failed imports by stage and exception type",
+    "marc_rows_inserted_total": "Rows inserted by table",
+}
+
+HISTOGRAMS = {
+    "marc_import_stage_seconds": "Time spent in each stage of the import of a report",
+    "marc_request_duration_seconds": "Request latency by URL name",
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+# the registry is shared with other processes serving /metrics (marc serve)
+shared = False
+
+
+def _value(value: float) -> str:
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def _labels(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(labels: Labels, extra: Labels = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    escaped = (
+        (k, v.replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\""))
+        for k, v in pairs
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+class Registry:
+    """Thread safe counters and histograms"""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.counters: Dict[str, Dict[Labels, float]] = {}
+        # name -> labels -> [bucket counts..., count, sum]
+        self.histograms: Dict[str, Dict[Labels, List[float]]] = {}
+
+    def inc(self, name: str, value: float = 1, **labels: str):
+        key = _labels(labels)
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels: str):
+        key = _labels(labels)
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            h = series.get(key)
+            if h is None:
+                h = series[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    h[i] += 1
+            h[-2] += 1
+            h[-1] += value
+
+    @contextmanager
+    def timer(self, name: str, **labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def clear(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def _dump(self) -> dict:
+        return {
+            "counters": {
+                name: [[list(map(list, k)), v] for k, v in series.items()]
+                for name, series in self.counters.items()
+            },
+            "histograms": {
+                name: [[list(map(list, k)), list(h)] for k, h in series.items()]
+                for name, series in self.histograms.items()
+            },
+        }
+
+    def dump(self) -> dict:
+        with self._lock:
+            return self._dump()
+
+    def drain(self) -> dict:
+        """Dump and clear at once (nothing counted in between is lost)"""
+        with self._lock:
+            data = self._dump()
+            self.counters.clear()
+            self.histograms.clear()
+        return data
+
+    def merge(self, data: dict):
+        """Add the dump of another registry (with the same buckets)"""
+        with self._lock:
+            for name, items in data.get("counters", {}).items():
+                series = self.counters.setdefault(name, {})
+                for k, v in items:
+                    key = tuple(map(tuple, k))
+                    series[key] = series.get(key, 0) + v
+            for name, items in data.get("histograms", {}).items():
+                series = self.histograms.setdefault(name, {})
+                for k, values in items:
+                    key = tuple(map(tuple, k))
+                    h = series.get(key)
+                    if h is None or len(h) != len(values):
+                        series[key] = list(values)
+                    else:
+                        series[key] = [a + b for a, b in zip(h, values, strict=True)]
+
+    def exposition(self) -> List[str]:
+        lines = []
+        with self._lock:
+            for name, help_text in COUNTERS.items():
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+                for key, value in sorted(self.counters.get(name, {}).items()):
+                    lines.append(f"{name}{_format_labels(key)} {_value(value)}")
+            for name, help_text in HISTOGRAMS.items():
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+                for key, h in sorted(self.histograms.get(name, {}).items()):
+                    # h ends with the count and the sum
+                    buckets = h[: len(self.buckets)]
+                    for bound, count in zip(self.buckets, buckets, strict=True):
+                        le = (("le", f"{bound:g}"),)
+                        lines.append(
+                            f"{name}_bucket{_format_labels(key, le)} {_value(count)}"
+                        )
+                    inf = (("le", "+Inf"),)
+                    lines.append(
+                        f"{name}_bucket{_format_labels(key, inf)} {_value(h[-2])}"
+                    )
+                    lines.append(f"{name}_count{_format_labels(key)} {_value(h[-2])}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {_value(h[-1])}")
+        return lines
+
+
+registry = Registry()
+
+
+def inserted(model: Type[models.Model], n: int):
+    """Count rows inserted in the table of the model once committed"""
+    if n:
+        table = model._meta.db_table
+        transaction.on_commit(
+            lambda: registry.inc("marc_rows_inserted_total", n, table=table),
+            using=router.db_for_write(model),
+        )
+
+
+@contextmanager
+def _locked(path: Path) -> Iterator[None]:
+    with open(f"{path}.lock", "a") as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+def load(path: Path | None = None) -> dict:
+    path = Path(path or settings.METRICS_FILE)
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save(path: Path | None = None):
+    """Add the registry of the process to the metrics file and clear it (kept
+    if the file cannot be written: the metrics are not worth a failure)"""
+    path = Path(path or settings.METRICS_FILE)
+    data = registry.drain()
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with _locked(path):
+            total = Registry(registry.buckets)
+            total.merge(load(path))
+            total.merge(data)
+            tmp = f"{path}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(total.dump(), f)
+            os.replace(tmp, path)
+    except OSError as err:
+        logger.warning(f"metrics not saved to {path}: {err}")
+        registry.merge(data)
+
+
+def share(interval: float = SHARE_INTERVAL):
+    """Share the registry of a worker process (marc serve) through the metrics
+    file, saved every interval seconds and before /metrics is answered"""
+    global shared
+    shared = True
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            save()
+
+    threading.Thread(target=loop, name="marc-metrics", daemon=True).start()
+
+
+def database_size() -> int:
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute("SELECT pg_database_size(current_database())")
+            return cursor.fetchone()[0]
+        if connection.vendor == "sqlite":
+            cursor.execute("PRAGMA page_count")
+            pages = cursor.fetchone()[0]
+            cursor.execute("PRAGMA page_size")
+            return pages * cursor.fetchone()[0]
+    return 0
+
+
+def gauges() -> List[str]:
+    lines = [
+        "# HELP marc_database_size_bytes Size of the database",
+        "# TYPE marc_database_size_bytes gauge",
+        f"marc_database_size_bytes {database_size()}",
+        "# HELP marc_table_rows Rows by table",
+        "# TYPE marc_table_rows gauge",
+    ]
+    for model in apps.get_app_config("dmarc").get_models():
+        table = model._meta.db_table
+        lines.append(f'marc_table_rows{{table="{table}"}} {model.objects.count()}')
+
+    last_import = Feedback.objects.aggregate(t=Max("imported_at"))["t"]
+    last_report = ReportMetadata.objects.aggregate(t=Max("date_range_end"))["t"]
+    lines += [
+        "# HELP marc_last_import_timestamp_seconds Time of the last import",
+        "# TYPE marc_last_import_timestamp_seconds gauge",
+        f"marc_last_import_timestamp_seconds {_timestamp(last_import)}",
+        "# HELP marc_last_report_end_timestamp_seconds End of the most recent report",
+        "# TYPE marc_last_report_end_timestamp_seconds gauge",
+        f"marc_last_report_end_timestamp_seconds {_timestamp(last_report)}",
+    ]
+    return lines
+
+
+def _timestamp(date: datetime | None) -> str:
+    return _value(date.timestamp()) if date else "0"
+
+
+GAUGES_CACHE_KEY = "marc:metrics:gauges"
+
+
+def exposition() -> str:
+    if shared:
+        # the other workers add theirs every few seconds
+        save()
+    total = Registry(registry.buckets)
+    total.merge(load())
+    total.merge(registry.dump())
+    ttl = settings.METRICS_GAUGES_TTL
+    lines = cache.get_or_set(GAUGES_CACHE_KEY, gauges, ttl) if ttl > 0 else gauges()
+    return "\n".join(total.exposition() + lines) + "\n"
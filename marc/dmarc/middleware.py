@@ -0,0 +1,127 @@
+"""
+Per-request statistics: number of SQL queries, SQL time, template rendering
+time and slowest queries.
+
+They are sent in the Server-Timing header, appended to the django.server log
+line (see marc.logging.ServerFormatter) and a warning is logged when a request
+runs more queries than settings.QUERY_BUDGET.
+"""
+
+import heapq
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import List, Tuple
+
+from django.conf import settings
+from django.db import connection
+
+from marc.dmarc import metrics, profiling
+from marc.logging import request_stats
+
+logger = logging.getLogger("django.marc")
+
+
+@dataclass
+class RequestStats:
+    queries: int = 0
+    sql_seconds: float = 0.0
+    # rendering of template responses (including the queries it runs)
+    render_seconds: float = 0.0
+    total_seconds: float = 0.0
+    # (seconds, sql) min-heap of the slowest queries
+    slowest: List[Tuple[float, str]] = field(default_factory=list)
+    keep: int = 3
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.queries += 1
+            self.sql_seconds += elapsed
+            if len(self.slowest) < self.keep:
+                heapq.heappush(self.slowest, (elapsed, sql))
+            elif elapsed > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, (elapsed, sql))
+
+    def slowest_queries(self) -> List[Tuple[float, str]]:
+        return sorted(self.slowest, reverse=True)
+
+    def server_timing(self) -> str:
+        return ", ".join(
+            [
+                f'db;dur={self.sql_seconds * 1e3:.1f};desc="{self.queries} queries"',
+                f"tpl;dur={self.render_seconds * 1e3:.1f}",
+                f"total;dur={self.total_seconds * 1e3:.1f}",
+            ]
+        )
+
+
+class RequestStatsMiddleware:
+    """Measure the SQL queries and the rendering time of every request"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = RequestStats(keep=settings.SLOW_QUERIES)
+        request.stats = stats
+        start = time.perf_counter()
+        with connection.execute_wrapper(stats):
+            response = self.get_response(request)
+        stats.total_seconds = time.perf_counter() - start
+
+        match = request.resolver_match
+        metrics.registry.observe(
+            "marc_request_duration_seconds",
+            stats.total_seconds,
+            url_name=(match.url_name if match else None) or "",
+        )
+
+        response["Server-Timing"] = stats.server_timing()
+        # read by the log formatter of the dev server (same thread)
+        request_stats.value = stats
+
+        budget = settings.QUERY_BUDGET
+        if budget and stats.queries > budget:
+            slowest = "".join(
+                f"\n  {seconds * 1e3:.1f}ms {sql}"
+                for seconds, sql in stats.slowest_queries()
+            )
+            logger.warning(
+                f"{request.method} {request.path}: {stats.queries} queries "
+                f"(budget {budget}), {stats.sql_seconds * 1e3:.1f}ms of SQL, "
+                f"slowest:{slowest}"
+            )
+        return response
+
+    def process_template_response(self, request, response):
+        # template responses are rendered after this hook
+        start = time.perf_counter()
+
+        def rendered(response):
+            request.stats.render_seconds = time.perf_counter() - start
+
+        response.add_post_render_callback(rendered)
+        return response
+
+
+class ProfileMiddleware:
+    """Profile the request when DEBUG is on and the 'profile' query parameter
+    is given (see marc.dmarc.profiling)"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not (settings.DEBUG and "profile" in request.GET):
+            return self.get_response(request)
+
+        name = f"{request.method} {request.path}"
+        with profiling.profile(name) as result:
+            response = self.get_response(request)
+        if result is not None:
+            response["X-Profile"] = result.stem
+        return response
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("dmarc", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="feedback",
+            name="imported_at",
+            field=models.DateTimeField(auto_now_add=True, null=True),
+        ),
+    ]
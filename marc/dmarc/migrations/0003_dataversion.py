@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:24
+
+from django.db import migrations, models
+
+
+def create_data_version(apps, schema_editor):
+    DataVersion = apps.get_model("dmarc", "DataVersion")
+    DataVersion.objects.get_or_create(id=1)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("dmarc", "0002_feedback_imported_at"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DataVersion",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("version", models.PositiveBigIntegerField(default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(create_data_version, migrations.RunPython.noop),
+    ]
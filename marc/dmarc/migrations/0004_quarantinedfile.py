@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("dmarc", "0003_dataversion"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="QuarantinedFile",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("path", models.CharField(max_length=4096, unique=True)),
+                ("sha256", models.CharField(blank=True, db_index=True, max_length=64)),
+                ("size", models.BigIntegerField()),
+                ("mtime_ns", models.BigIntegerField()),
+                ("error_class", models.CharField(max_length=255)),
+                ("message", models.TextField(blank=True)),
+                ("first_seen", models.DateTimeField(auto_now_add=True)),
+                ("last_seen", models.DateTimeField(auto_now=True)),
+                ("attempts", models.PositiveIntegerField(default=1)),
+            ],
+            options={
+                "ordering": ["-last_seen"],
+            },
+        ),
+    ]
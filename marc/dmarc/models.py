@@ -6,8 +6,9 @@ from typing import List
 from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
-from django.db.models import Count, F, Q
+from django.db import models, transaction
+from django.db.models import Count, F, Q, Subquery
+from django.db.models.functions import Now
 
 DEFAULT_MAX_LENGTH = 4096
 
@@ -22,6 +23,13 @@ def validate_directories(directories: str):
             raise ValidationError(f"path '{p}' does not exist")
 
 
+def reverse_dns(ip: str) -> str | None:
+    try:
+        return socket.gethostbyaddr(ip)[0]
+    except OSError:
+        return None
+
+
 class HelpTextMixin:
     def __init__(self, *args, **kwargs) -> None:
         super().__init__(*args, **kwargs)
@@ -209,6 +217,8 @@ class Feedback(models.Model):
     version = models.DecimalField(decimal_places=4, max_digits=8, blank=True, null=True)
     # report_metadata = models.ForeignKey(ReportMetadata, on_delete=models.CASCADE)
     policy_published = models.ForeignKey(PolicyPublished, on_delete=models.CASCADE)
+    # null for reports imported before this field existed
+    imported_at = models.DateTimeField(auto_now_add=True, null=True)
 
     def auth(self):
         dkim_pass = Q(record__auth_results__dkim__result=DkimResultType.PASS)
@@ -417,9 +427,10 @@ class Row(models.Model):
 
     def domain(self):
         if self.source_ip:
+            # the lookup only runs on cache miss
             return cache.get_or_set(
                 self.source_ip,
-                socket.gethostbyaddr(self.source_ip)[0],
+                partial(reverse_dns, self.source_ip),
             )
         return None
 
@@ -500,8 +511,130 @@ class Config(models.Model):
         return [v.strip() for v in self.directories.split("\n") if v.strip() != ""]
 
 
+class DataVersion(models.Model):
+    """
+    Version of the reports stored in the database, incremented after every
+    import and deletion (single row). It is part of the ETags of the views.
+    """
+
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+DATA_VERSION_ID = 1
+
+
+def data_version_subquery() -> Subquery:
+    """Current data version, to annotate a queryset"""
+    return Subquery(
+        DataVersion.objects.filter(id=DATA_VERSION_ID).values("version")[:1]
+    )
+
+
+def get_data_version() -> int:
+    version = (
+        DataVersion.objects.filter(id=DATA_VERSION_ID)
+        .values_list("version", flat=True)
+        .first()
+    )
+    return version or 0
+
+
+class _DataVersionBump:
+    """Increment of the data version shared by the on_commit callbacks of a
+    transaction: the first one run does it"""
+
+    done = False
+
+    def run(self, connection):
+        if self.done:
+            return
+        self.done = True
+        # the next transaction gets its own
+        connection.marc_data_version_bump = None
+        updated = DataVersion.objects.filter(id=DATA_VERSION_ID).update(
+            version=F("version") + 1, updated_at=Now()
+        )
+        if not updated:
+            DataVersion.objects.get_or_create(
+                id=DATA_VERSION_ID, defaults={"version": 1}
+            )
+
+
+def bump_data_version():
+    """Increment the data version once the current transaction is committed
+    (at once out of a transaction). The update of the single row is not part
+    of the transaction, so concurrent imports do not wait for each other on
+    it, and several imports in the same transaction increment it once."""
+    connection = transaction.get_connection()
+    # left by a rolled back transaction (its callbacks were dropped): reused
+    bump = getattr(connection, "marc_data_version_bump", None)
+    if bump is None:
+        bump = connection.marc_data_version_bump = _DataVersionBump()
+    transaction.on_commit(lambda: bump.run(connection))
+
+
 def get_config() -> Config:
     config = Config.objects.first()
     if config is None:
         config = Config.objects.create()
     return config
+
+
+class QuarantinedFile(models.Model):
+    """
+    Report file which could not be imported. The collector skips it while its
+    size and modification time are unchanged (without reading it again).
+    """
+
+    path = models.CharField(max_length=DEFAULT_MAX_LENGTH, unique=True)
+    sha256 = models.CharField(max_length=64, blank=True, db_index=True)
+    size = models.BigIntegerField()
+    mtime_ns = models.BigIntegerField()
+    error_class = models.CharField(max_length=255)
+    message = models.TextField(blank=True)
+    first_seen = models.DateTimeField(auto_now_add=True)
+    last_seen = models.DateTimeField(auto_now=True)
+    attempts = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        ordering = ["-last_seen"]
+
+
+class ImportJob(models.Model):
+    """
+    Bulk import (loadreport --bulk). Its manifest (ImportJobFile) and its
+    counters are updated in the transaction of each batch (checkpoint) so that
+    an interrupted import continues from its last batch (loadreport --resume).
+    """
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    checkpoint_at = models.DateTimeField(null=True)
+    finished_at = models.DateTimeField(null=True)
+    batch_size = models.PositiveIntegerField()
+    total = models.PositiveIntegerField(default=0)
+    imported = models.PositiveIntegerField(default=0)
+    duplicates = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    # quarantined files
+    skipped = models.PositiveIntegerField(default=0)
+
+    @property
+    def done(self) -> int:
+        return self.imported + self.duplicates + self.failed + self.skipped
+
+
+class ImportJobFile(models.Model):
+    class State(models.TextChoices):
+        PENDING = "pending"
+        IMPORTED = "imported"
+        DUPLICATE = "duplicate"
+        FAILED = "failed"
+        SKIPPED = "skipped"
+
+    job = models.ForeignKey(ImportJob, on_delete=models.CASCADE, related_name="files")
+    path = models.CharField(max_length=DEFAULT_MAX_LENGTH)
+    state = models.CharField(max_length=16, choices=State, default=State.PENDING)
+
+    class Meta:
+        indexes = [models.Index(fields=["job", "state", "id"])]
@@ -1,13 +1,23 @@
 import gzip
+import mmap
+import os
+import time
 import zipfile
+from contextlib import contextmanager
 from datetime import UTC, datetime
 from io import BufferedReader
-from typing import Any, Dict
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Tuple
+from xml.etree import ElementTree
+from xml.parsers import expat
 
+from django.conf import settings
+from django.db import IntegrityError, transaction
 from xsdata.formats.dataclass.context import XmlContext
 from xsdata.formats.dataclass.parsers import XmlParser
 from xsdata.formats.dataclass.parsers.config import ParserConfig
 
+from marc.dmarc import metrics, records
+from marc.dmarc.bulk import reserve_ids, write_rows
 from marc.dmarc.models import (
     AuthResult,
     DkimAuthResult,
@@ -20,8 +30,10 @@ from marc.dmarc.models import (
     ReportMetadata,
     Row,
     SpfAuthResult,
+    bump_data_version,
 )
 from marc.report import Feedback as FeedbackDataclass
+from marc.report import RecordType
 
 #     with open(file, "rb") as f:
 #         return f.read(2) == b"\x1f\x8b"
@@ -44,28 +56,395 @@ from marc.report import Feedback as FeedbackDataclass
 #         return parse(file)
 
 
-def extract_stream(stream: BufferedReader) -> BufferedReader:
-    """Extract a stream if it is zipped or gzipped"""
+# decompressed bytes before the compression ratio is checked
+RATIO_MIN_SIZE = 1024 * 1024
+READ_CHUNK = 64 * 1024
+
+
+class ReportTooLarge(ValueError):
+    """The decompressed report exceeds settings.REPORT_MAX_SIZE or
+    settings.REPORT_MAX_RATIO (decompression bomb)"""
+
+
+class CountingReader:
+    """Count the bytes read from a stream (compressed input)"""
+
+    def __init__(self, stream: BufferedReader):
+        self.stream = stream
+        self.size = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.stream.read(size)
+        self.size += len(data)
+        return data
+
+    def seek(self, *args) -> int:
+        return self.stream.seek(*args)
+
+    def tell(self) -> int:
+        return self.stream.tell()
+
+
+class LimitedReader:
+    """Stop reading a decompressed stream past max_size bytes or once its size
+    exceeds max_ratio times the compressed bytes read"""
+
+    def __init__(
+        self,
+        stream: BufferedReader,
+        max_size: int,
+        compressed: CountingReader | None = None,
+        max_ratio: float = 0,
+    ):
+        self.stream = stream
+        self.max_size = max_size
+        self.compressed = compressed
+        self.max_ratio = max_ratio
+        self.size = 0
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0:
+            # by chunks: the limits are checked along the way
+            return b"".join(iter(lambda: self.read(READ_CHUNK), b""))
+        data = self.stream.read(size)
+        self.size += len(data)
+        if self.size > self.max_size:
+            raise ReportTooLarge(f"report larger than {self.max_size} bytes")
+        if (
+            self.compressed is not None
+            and self.max_ratio > 0
+            and self.size > RATIO_MIN_SIZE
+            and self.size > self.max_ratio * self.compressed.size
+        ):
+            raise ReportTooLarge(f"compression ratio above {self.max_ratio:g}")
+        return data
+
+
+# bytes of a memory-mapped report given to the XML parser at once
+MAPPED_CHUNK = 1024 * 1024
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZIP_MAGIC = b"\x50\x4b"
+
+
+@contextmanager
+def open_report(
+    path: str | os.PathLike, mapped: bool = False
+) -> Iterator[BinaryIO | mmap.mmap]:
+    """Open a local report file, memory-mapped from settings.REPORT_MMAP_MIN_SIZE
+    bytes if mapped (a regular file otherwise, or if it cannot be mapped: empty
+    file, pipe...). An uncompressed mapped report is parsed from the mapping,
+    without being copied (see extract_parse).
+
+    Reading a mapping past the end of a file truncated meanwhile kills the
+    process (SIGBUS): only map the files no other process writes (the ones
+    named on the command line), not the collected directories or the spool."""
+    with open(path, "rb") as f:
+        mapping = None
+        min_size = settings.REPORT_MMAP_MIN_SIZE
+        if mapped and min_size >= 0:
+            try:
+                if os.fstat(f.fileno()).st_size >= max(min_size, 1):
+                    mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                pass
+        if mapping is None:
+            yield f
+        else:
+            with mapping:
+                yield mapping
+
+
+def sniff(stream: BufferedReader | mmap.mmap) -> bytes:
+    """First bytes of the stream (its position is left at 0)"""
+    if isinstance(stream, mmap.mmap):
+        return stream[:2]
     magic = stream.read(2)
     stream.seek(0)  # reset
-    if magic == b"\x1f\x8b":  # gzip
-        return gzip.GzipFile(fileobj=stream, mode="rb")
-    elif magic == b"\x50\x4b":  # zip
+    return magic
+
+
+def extract_stream(
+    stream: BufferedReader,
+    max_size: int | None = None,
+    max_ratio: float | None = None,
+) -> LimitedReader:
+    """Extract a stream if it is zipped or gzipped. The stream is decompressed
+    as it is read, within the limits of the settings (ReportTooLarge)."""
+    if max_size is None:
+        max_size = settings.REPORT_MAX_SIZE
+    if max_ratio is None:
+        max_ratio = settings.REPORT_MAX_RATIO
+    magic = sniff(stream)
+    if magic == GZIP_MAGIC:
+        compressed = CountingReader(stream)
+        return LimitedReader(
+            gzip.GzipFile(fileobj=compressed, mode="rb"),
+            max_size,
+            compressed,
+            max_ratio,
+        )
+    elif magic == ZIP_MAGIC:
         z = zipfile.ZipFile(stream)
-        return z.open(z.namelist()[0])
-    return stream
+        info = z.infolist()[0]
+        # the size of the member is enforced by zipfile
+        if info.file_size > max_size:
+            raise ReportTooLarge(f"report larger than {max_size} bytes")
+        if (
+            max_ratio > 0
+            and info.file_size > RATIO_MIN_SIZE
+            and info.file_size > max_ratio * info.compress_size
+        ):
+            raise ReportTooLarge(f"compression ratio above {max_ratio:g}")
+        return LimitedReader(z.open(info), max_size)
+    return LimitedReader(stream, max_size)
 
 
-def parse(xml_stream: BufferedReader) -> FeedbackDataclass:
-    """Read an XML report and return a Feedback object"""
+# bytes of the decompressed report read to find its identifiers
+PRESCAN_LIMIT = 64 * 1024
+PRESCAN_CHUNK = 4096
+
+
+class DuplicateReport(IntegrityError):
+    """The report is already in the database (found by the pre-scan)"""
+
+
+class _Found(Exception):
+    pass
+
+
+def scan_identifiers(chunks: Iterable[bytes]) -> Tuple[str, str] | None:
+    """Parse the chunks until the org_name and the report_id of the
+    report_metadata are found, None if they are not found"""
+    found: Dict[str, str] = {}
+    path: List[str] = []
+    text: List[str] = []
+
+    def start(name: str, attrs: Any):
+        path.append(name.rpartition(":")[2])
+        text.clear()
+
+    def end(name: str):
+        tag = path.pop()
+        if tag in ("org_name", "report_id") and path[1:] == ["report_metadata"]:
+            found[tag] = "".join(text)
+            if len(found) == 2:
+                raise _Found
+
+    p = expat.ParserCreate()
+    p.StartElementHandler = start
+    p.EndElementHandler = end
+    p.CharacterDataHandler = text.append
+    p.buffer_text = True
+    try:
+        for chunk in chunks:
+            p.Parse(chunk, not chunk)
+    except _Found:
+        return found["org_name"], found["report_id"]
+    except expat.ExpatError:
+        # reported by the full parse
+        pass
+    return None
+
+
+def prescan(reader: BufferedReader) -> Tuple[bytes, Tuple[str, str] | None]:
+    """Read the beginning of a decompressed report until the org_name and
+    the report_id of its report_metadata are found (at most PRESCAN_LIMIT
+    bytes). Return the bytes read and (org_name, report_id), None if they
+    are not found."""
+    chunks: List[bytes] = []
+
+    def read() -> Iterator[bytes]:
+        size = 0
+        while size < PRESCAN_LIMIT:
+            chunk = reader.read(PRESCAN_CHUNK)
+            chunks.append(chunk)
+            size += len(chunk)
+            yield chunk
+            if not chunk:
+                break
+
+    key = scan_identifiers(read())
+    return b"".join(chunks), key
+
+
+def mapped_chunks(
+    buffer: mmap.mmap, size: int, limit: int | None = None
+) -> Iterator[memoryview | bytes]:
+    """Views of the mapped buffer (no copy), up to limit bytes. Every view is
+    released once consumed, so that the mapping can be closed. An empty chunk
+    ends the buffer."""
+    with memoryview(buffer) as view:
+        end = len(view) if limit is None else min(len(view), limit)
+        for pos in range(0, end, size):
+            with view[pos : pos + size] as chunk:
+                yield chunk
+        if end == len(view):
+            yield b""
+
+
+def is_known(org_name: str, report_id: str) -> bool:
+    return ReportMetadata.objects.filter(
+        report_id=report_id, org_name=org_name
+    ).exists()
+
+
+class PrefixedReader:
+    """Read the given bytes, then the stream"""
+
+    def __init__(self, prefix: bytes, stream: BufferedReader):
+        self.prefix = prefix
+        self.stream = stream
+
+    def read(self, size: int = -1) -> bytes:
+        if not self.prefix:
+            return self.stream.read(size)
+        if size < 0:
+            out, self.prefix = self.prefix + self.stream.read(), b""
+        else:
+            out, self.prefix = self.prefix[:size], self.prefix[size:]
+        return out
+
+
+def xml_parser() -> XmlParser:
+    """Return the parser that binds XML reports to the marc.report dataclasses"""
     config = ParserConfig()
     context = XmlContext()
-    xml_parser = XmlParser(context=context, config=config)
-    return xml_parser.parse(xml_stream, FeedbackDataclass)
+    return XmlParser(context=context, config=config)
+
+
+def parse(xml_stream: BufferedReader) -> FeedbackDataclass:
+    """Read an XML report and return a Feedback object"""
+    return xml_parser().parse(xml_stream, FeedbackDataclass)
+
+
+def validate(root: ElementTree.Element) -> records.Report:
+    """Bind the parsed report to the marc.report dataclasses, its records one
+    at a time: each one is converted to a compact record (see
+    marc.dmarc.records) and its elements are freed before the next one"""
+    parser = xml_parser()
+    elements = [e for e in root if e.tag == "record"]
+    root[:] = [e for e in root if e.tag != "record"]
+    feedback = parser.parse(root, FeedbackDataclass)
+    converter = records.Converter()
+    compact: List[records.Record] = []
+    for i, element in enumerate(elements):
+        elements[i] = None
+        compact.append(converter.record(parser.parse(element, RecordType)))
+    return records.Report(
+        feedback.version, feedback.report_metadata, feedback.policy_published, compact
+    )
+
+
+class TimedReader:
+    """Measure the time spent reading (decompressing) a stream"""
+
+    def __init__(self, stream: BufferedReader):
+        self.stream = stream
+        self.seconds = 0.0
+        self.failed = False
+
+    def read(self, size: int = -1) -> bytes:
+        start = time.perf_counter()
+        try:
+            return self.stream.read(size)
+        except BaseException:
+            self.failed = True
+            raise
+        finally:
+            self.seconds += time.perf_counter() - start
+
+
+def extract_parse(
+    stream: BufferedReader | mmap.mmap, skip_known: bool = True
+) -> records.Report:
+    """Decompress, parse and validate a report (every stage is measured).
+
+    Raise DuplicateReport if the report is already in the database (found by
+    a pre-scan of its beginning, before the full parse) unless skip_known is
+    False."""
+    if isinstance(stream, mmap.mmap) and sniff(stream) not in (GZIP_MAGIC, ZIP_MAGIC):
+        return parse_mapped(stream, skip_known)
+    start = time.perf_counter()
+    stage = "decompress"
+    reader = None
+    try:
+        reader = TimedReader(extract_stream(stream))
+        reader.seconds += time.perf_counter() - start
+        stage = "prescan"
+        prefix, key = prescan(reader)
+        if skip_known and key is not None and is_known(*key):
+            metrics.registry.inc("marc_duplicates_skipped_total")
+            raise DuplicateReport(f"report {key[1]} of {key[0]} already imported")
+        scanned = time.perf_counter()
+        # decompression time of the prefix
+        prefix_seconds = reader.seconds
+        stage = "parse"
+        tree = ElementTree.parse(PrefixedReader(prefix, reader)).getroot()
+        parsed = time.perf_counter()
+        stage = "validate"
+        obj = validate(tree)
+    except DuplicateReport:
+        raise
+    except Exception as err:
+        if reader is not None and reader.failed:
+            stage = "decompress"
+        metrics.registry.inc(
+            "marc_import_failures_total", stage=stage, exception=type(err).__name__
+        )
+        raise
+
+    observe = metrics.registry.observe
+    observe("marc_import_stage_seconds", reader.seconds, stage="decompress")
+    observe(
+        "marc_import_stage_seconds", scanned - start - prefix_seconds, stage="prescan"
+    )
+    observe(
+        "marc_import_stage_seconds",
+        parsed - scanned - (reader.seconds - prefix_seconds),
+        stage="parse",
+    )
+    observe("marc_import_stage_seconds", time.perf_counter() - parsed, stage="validate")
+    return obj
+
 
+def parse_mapped(buffer: mmap.mmap, skip_known: bool = True) -> records.Report:
+    """extract_parse of an uncompressed report mapped in memory (see
+    open_report): the pre-scan and the XML parser read the mapping itself"""
+    start = time.perf_counter()
+    stage = "decompress"
+    try:
+        if len(buffer) > settings.REPORT_MAX_SIZE:
+            raise ReportTooLarge(f"report larger than {settings.REPORT_MAX_SIZE} bytes")
+        stage = "prescan"
+        key = scan_identifiers(mapped_chunks(buffer, PRESCAN_CHUNK, PRESCAN_LIMIT))
+        if skip_known and key is not None and is_known(*key):
+            metrics.registry.inc("marc_duplicates_skipped_total")
+            raise DuplicateReport(f"report {key[1]} of {key[0]} already imported")
+        scanned = time.perf_counter()
+        stage = "parse"
+        xml = ElementTree.XMLParser()
+        for chunk in mapped_chunks(buffer, MAPPED_CHUNK):
+            xml.feed(chunk)
+        tree = xml.close()
+        parsed = time.perf_counter()
+        stage = "validate"
+        obj = validate(tree)
+    except DuplicateReport:
+        raise
+    except Exception as err:
+        metrics.registry.inc(
+            "marc_import_failures_total", stage=stage, exception=type(err).__name__
+        )
+        raise
 
-def extract_parse(stream: BufferedReader) -> FeedbackDataclass:
-    return parse(extract_stream(stream))
+    # nothing to decompress
+    observe = metrics.registry.observe
+    observe("marc_import_stage_seconds", 0.0, stage="decompress")
+    observe("marc_import_stage_seconds", scanned - start, stage="prescan")
+    observe("marc_import_stage_seconds", parsed - scanned, stage="parse")
+    observe("marc_import_stage_seconds", time.perf_counter() - parsed, stage="validate")
+    return obj
 
 
 def as_dict(obj: Any) -> Dict[str, Any]:
@@ -76,66 +455,124 @@ def as_dict(obj: Any) -> Dict[str, Any]:
     )
 
 
-def import_to_database(obj: FeedbackDataclass) -> Feedback:
-    # create the policy
-    policy_published, _ = PolicyPublished.objects.get_or_create(
-        **as_dict(obj.policy_published)
-    )
+def import_to_database(obj: records.Report | FeedbackDataclass) -> Feedback:
+    if isinstance(obj, FeedbackDataclass):
+        obj = records.from_feedback(obj)
+    try:
+        with metrics.registry.timer("marc_import_stage_seconds", stage="write"):
+            feedback = _import_to_database(obj)
+    except IntegrityError:
+        # the report_id is unique
+        metrics.registry.inc("marc_duplicates_skipped_total")
+        raise
+    except Exception as err:
+        metrics.registry.inc(
+            "marc_import_failures_total", stage="write", exception=type(err).__name__
+        )
+        raise
 
-    # create the feedback
-    feedback = Feedback.objects.create(
-        # report_metadata=report_metadata,
-        policy_published=policy_published,
-        version=obj.version,
-    )
+    n = len(obj.record)
 
-    raw = as_dict(obj.report_metadata)
-    # create date range
-    date_range = raw.pop("date_range")
-    ReportMetadata.objects.create(
-        feedback=feedback,
-        **raw,
-        date_range_begin=datetime.fromtimestamp(date_range["begin"], tz=UTC),
-        date_range_end=datetime.fromtimestamp(date_range["end"], tz=UTC),
-    )
+    def imported():
+        metrics.registry.inc("marc_reports_imported_total")
+        metrics.registry.inc("marc_records_imported_total", n)
 
-    for record in obj.record:
-        # create identifiers
-        identifiers, _ = Identifier.objects.get_or_create(**as_dict(record.identifiers))
+    transaction.on_commit(imported)
+    return feedback
+
+
+def _import_to_database(obj: records.Report) -> Feedback:
+    with transaction.atomic():
+        # create the policy
+        policy_published, created = PolicyPublished.objects.get_or_create(
+            **as_dict(obj.policy_published)
+        )
+        if created:
+            metrics.inserted(PolicyPublished, 1)
+
+        # create the feedback
+        feedback = Feedback.objects.create(
+            policy_published=policy_published,
+            version=obj.version,
+        )
 
-        # create record
-        rec = Record.objects.create(
+        raw = as_dict(obj.report_metadata)
+        # create date range
+        date_range = raw.pop("date_range")
+        ReportMetadata.objects.create(
             feedback=feedback,
-            identifiers=identifiers,
+            **raw,
+            date_range_begin=datetime.fromtimestamp(date_range["begin"], tz=UTC),
+            date_range_end=datetime.fromtimestamp(date_range["end"], tz=UTC),
         )
+        metrics.inserted(Feedback, 1)
+        metrics.inserted(ReportMetadata, 1)
 
-        # create auth_results
-        auth_results = AuthResult.objects.create(record=rec)
-
-        # spf results
-        for spf in record.auth_results.spf:
-            spf_r = as_dict(spf)
-            SpfAuthResult.objects.create(**spf_r, auth_results=auth_results)
-
-        # dkim results
-        for dkim in record.auth_results.dkim:
-            dkim_r = as_dict(dkim)
-            DkimAuthResult.objects.create(**dkim_r, auth_results=auth_results)
-
-        raw = as_dict(record.row)
-        # create policy_evaluated
-        pe = raw.pop("policy_evaluated")
-        # create row
-        row = Row.objects.create(**raw, record=rec)
-
-        reason = pe.pop("reason")
-        policy_evaluated = PolicyEvaluated.objects.create(**pe, row=row)
-        for reason in reason:
-            PolicyOverrideReason.objects.create(
-                **reason,
-                policy_evaluated=policy_evaluated,
-            )
-        # # create row
-        # row = Row.objects.create(**raw, policy_evaluated=policy_evaluated)
+        import_records(feedback, obj.record)
+        bump_data_version()
 
     return feedback
+
+
+def import_records(feedback: Feedback, compact: List[records.Record]):
+    """Bulk insert the records of a feedback and all their children.
+
+    The feedback must have been created in the current transaction.
+    """
+    n = len(compact)
+    record_ids = reserve_ids(Record, n)
+    auth_results_ids = reserve_ids(AuthResult, n)
+    row_ids = reserve_ids(Row, n)
+    policy_evaluated_ids = reserve_ids(PolicyEvaluated, n)
+
+    identifiers: Dict[tuple, int] = {}
+    record_rows = []
+    auth_results_rows = []
+    spf_rows = []
+    dkim_rows = []
+    row_rows = []
+    policy_evaluated_rows = []
+    reason_rows = []
+    for i, record in enumerate(compact):
+        # identifiers are shared between records (and reports)
+        k = record.identifiers
+        if k not in identifiers:
+            identifier, created = Identifier.objects.get_or_create(**k._asdict())
+            identifiers[k] = identifier.id
+            if created:
+                metrics.inserted(Identifier, 1)
+
+        record_rows.append((record_ids[i], feedback.id, identifiers[k]))
+        auth_results_rows.append((auth_results_ids[i], record_ids[i]))
+        for spf in record.spf:
+            spf_rows.append((*spf, auth_results_ids[i]))
+        for dkim in record.dkim:
+            dkim_rows.append((*dkim, auth_results_ids[i]))
+
+        row_rows.append((row_ids[i], record.source_ip, record.count, record_ids[i]))
+        pe = record.policy_evaluated
+        policy_evaluated_rows.append(
+            (policy_evaluated_ids[i], pe.disposition, pe.dkim, pe.spf, row_ids[i])
+        )
+        for reason in pe.reason:
+            reason_rows.append((*reason, policy_evaluated_ids[i]))
+
+    write_rows(Record, ("id", "feedback", "identifiers"), record_rows)
+    write_rows(AuthResult, ("id", "record"), auth_results_rows)
+    write_rows(SpfAuthResult, ("domain", "scope", "result", "auth_results"), spf_rows)
+    write_rows(
+        DkimAuthResult,
+        ("domain", "selector", "result", "human_result", "auth_results"),
+        dkim_rows,
+    )
+    write_rows(Row, ("id", "source_ip", "count", "record"), row_rows)
+    write_rows(
+        PolicyEvaluated,
+        ("id", "disposition", "dkim", "spf", "row"),
+        policy_evaluated_rows,
+    )
+    write_rows(
+        PolicyOverrideReason,
+        ("type_value", "comment", "policy_evaluated"),
+        reason_rows,
+    )
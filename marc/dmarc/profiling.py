@@ -0,0 +1,148 @@
+"""
+Profile a piece of work with cProfile and tracemalloc.
+
+Every profile is written to settings.PROFILE_DIR as 3 files sharing the same
+stem (<date>-<name>):
+- .pstats: cProfile statistics (python -m pstats, snakeviz...)
+- .alloc.txt: top allocations (tracemalloc, by line)
+- .json: summary shown on the profiles page
+"""
+
+import cProfile
+import io
+import json
+import logging
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List
+
+from django.conf import settings
+
+logger = logging.getLogger("django.marc")
+
+# cProfile does not support concurrent profilers
+_lock = threading.Lock()
+
+_UNSAFE = re.compile(r"[^\w.-]+")
+
+
+@dataclass
+class Profile:
+    stem: str
+    summary: Dict[str, Any]
+
+    @property
+    def date(self) -> datetime:
+        return datetime.fromisoformat(self.summary["date"])
+
+
+def profile_dir() -> Path:
+    return Path(settings.PROFILE_DIR)
+
+
+@contextmanager
+def profile(name: str, enabled: bool = True) -> Iterator[Profile | None]:
+    """Profile the body of the with statement (yield None if profiling is off or
+    if another profile is running)"""
+    if not enabled or not _lock.acquire(blocking=False):
+        if enabled:
+            logger.warning(f"profile {name} skipped: another profile is running")
+        yield None
+        return
+
+    try:
+        date = datetime.now()
+        stem = f"{date:%Y%m%d-%H%M%S-%f}-{_UNSAFE.sub('_', name)}"
+        result = Profile(stem, {})
+
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(settings.PROFILE_FRAMES)
+        tracemalloc.reset_peak()
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            yield result
+        finally:
+            profiler.disable()
+            seconds = time.perf_counter() - start
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            if started_tracing:
+                tracemalloc.stop()
+            result.summary = _save(stem, name, date, seconds, peak, profiler, snapshot)
+            logger.info(f"profile saved to {profile_dir() / stem}.pstats")
+    finally:
+        _lock.release()
+
+
+def _save(
+    stem: str,
+    name: str,
+    date: datetime,
+    seconds: float,
+    peak: int,
+    profiler: cProfile.Profile,
+    snapshot: tracemalloc.Snapshot,
+) -> Dict[str, Any]:
+    directory = profile_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    profiler.dump_stats(directory / f"{stem}.pstats")
+
+    top = settings.PROFILE_TOP
+    snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+    allocations = snapshot.statistics("lineno")[:top]
+    with open(directory / f"{stem}.alloc.txt", "w") as f:
+        f.write(f"peak: {peak} bytes\n")
+        for stat in allocations:
+            f.write(f"{stat}\n")
+
+    out = io.StringIO()
+    stats = pstats.Stats(profiler, stream=out)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top)
+    summary = {
+        "name": name,
+        "date": date.isoformat(),
+        "seconds": seconds,
+        "peak_bytes": peak,
+        "calls": stats.total_calls,
+        "functions": out.getvalue(),
+        "allocations": [str(stat) for stat in allocations[:10]],
+    }
+    with open(directory / f"{stem}.json", "w") as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+def recent_profiles(limit: int = 50) -> List[Profile]:
+    """Most recent profiles first"""
+    directory = profile_dir()
+    if not directory.is_dir():
+        return []
+    out = []
+    paths = [p for p in directory.glob("*.json") if p.with_suffix(".pstats").exists()]
+    for path in sorted(paths, reverse=True)[:limit]:
+        try:
+            with open(path, "r") as f:
+                out.append(Profile(path.stem, json.load(f)))
+        except (OSError, ValueError):
+            continue
+    return out
+
+
+def profile_file(filename: str) -> Path | None:
+    """Path of a file of a profile (None if it is not a profile file)"""
+    if filename != Path(filename).name or not filename.endswith(
+        (".pstats", ".alloc.txt", ".json")
+    ):
+        return None
+    path = profile_dir() / filename
+    return path if path.is_file() else None
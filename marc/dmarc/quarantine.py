@@ -0,0 +1,195 @@
+"""
+Quarantine of the report files which cannot be imported (dead letters).
+
+A failed file is recorded with its hash, its size and modification time and
+the error. The collector loads these fingerprints once and skips the files
+which did not change since they failed, from a stat() (they are neither read
+nor decompressed again). Files are retried or purged in bulk with
+`marc quarantine` or on /dmarc/quarantine/.
+
+Transient errors (database unavailable, missing or unreadable file) are not
+recorded: the file is simply tried again next time.
+"""
+
+import hashlib
+import logging
+import os
+from dataclasses import dataclass
+from datetime import UTC, datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+
+from django.conf import settings
+from django.db import IntegrityError, OperationalError, transaction
+from django.db.models import F, QuerySet
+from django.utils import timezone
+
+from marc.dmarc import metrics
+from marc.dmarc.models import QuarantinedFile
+
+logger = logging.getLogger("django.marc")
+
+TRANSIENT_ERRORS = (OperationalError, FileNotFoundError, PermissionError)
+
+MAX_MESSAGE_LENGTH = 4096
+
+# path -> (size, mtime_ns)
+Fingerprints = Dict[str, Tuple[int, int]]
+
+
+@dataclass
+class RetryResult:
+    imported: int = 0
+    duplicates: int = 0
+    failed: int = 0
+    missing: int = 0
+
+
+def select(
+    ids: List[int] | None = None,
+    error: str | None = None,
+    path: str | None = None,
+    older_than: timedelta | None = None,
+) -> QuerySet[QuarantinedFile]:
+    """Quarantined files (filtered by id, error class, path prefix, last failure)"""
+    files = QuarantinedFile.objects.all()
+    if ids:
+        files = files.filter(id__in=ids)
+    if error:
+        files = files.filter(error_class=error)
+    if path:
+        files = files.filter(path__startswith=path)
+    if older_than is not None:
+        files = files.filter(last_seen__lt=datetime.now(UTC) - older_than)
+    return files
+
+
+def file_sha256(path: str | os.PathLike) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(2**20):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def fingerprints(paths: Iterable[str | os.PathLike] | None = None) -> Fingerprints:
+    """Fingerprints of the quarantined files (of the given paths only)"""
+    files = QuarantinedFile.objects.order_by()
+    if paths is not None:
+        files = files.filter(path__in=[os.path.abspath(p) for p in paths])
+    return {
+        path: (size, mtime_ns)
+        for path, size, mtime_ns in files.values_list("path", "size", "mtime_ns")
+    }
+
+
+def is_quarantined(path: str | os.PathLike, known: Fingerprints) -> bool:
+    """The file failed and did not change since"""
+    fingerprint = known.get(os.path.abspath(path))
+    if fingerprint is None:
+        return False
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    if fingerprint != (st.st_size, st.st_mtime_ns):
+        return False
+    metrics.registry.inc("marc_quarantine_skipped_total")
+    return True
+
+
+def record(path: str | os.PathLike, err: BaseException) -> QuarantinedFile | None:
+    """Quarantine the file which failed with err (or count one more attempt)"""
+    if isinstance(err, TRANSIENT_ERRORS):
+        return None
+    path = os.path.abspath(path)
+    try:
+        st = os.stat(path)
+        sha256 = file_sha256(path)
+    except OSError:
+        return None
+
+    fields = dict(
+        sha256=sha256,
+        size=st.st_size,
+        mtime_ns=st.st_mtime_ns,
+        error_class=type(err).__name__,
+        message=str(err)[:MAX_MESSAGE_LENGTH],
+    )
+    files = QuarantinedFile.objects.filter(path=path)
+    if files.update(**fields, attempts=F("attempts") + 1, last_seen=timezone.now()):
+        return files.first()
+    logger.warning(f"{path} quarantined ({fields['error_class']})")
+    return QuarantinedFile.objects.create(path=path, **fields)
+
+
+def release(path: str | os.PathLike) -> int:
+    """Forget the file (imported)"""
+    return QuarantinedFile.objects.filter(path=os.path.abspath(path)).delete()[0]
+
+
+def _failed_spool() -> Path:
+    # reports of the ingest daemon which failed (see marc.dmarc.ingestd)
+    return Path(os.path.abspath(settings.INGEST_SPOOL)) / "failed"
+
+
+def retry(files: QuerySet[QuarantinedFile]) -> RetryResult:
+    """Import the files again: the imported ones leave the quarantine"""
+    # heavy (xsdata, pydantic, report dataclasses): not needed to list files
+    from marc.dmarc.parser import extract_parse, import_to_database, open_report
+
+    result = RetryResult()
+    failed_spool = _failed_spool()
+    for f in list(files):
+        try:
+            with open_report(f.path) as raw:
+                with transaction.atomic():
+                    import_to_database(extract_parse(raw))
+            result.imported += 1
+        except FileNotFoundError:
+            logger.warning(f"{f.path}: file not found")
+            result.missing += 1
+            continue
+        except IntegrityError:
+            result.duplicates += 1
+        except Exception as err:
+            logger.error(f"{f.path}: {err}")
+            record(f.path, err)
+            result.failed += 1
+            continue
+
+        f.delete()
+        path = Path(f.path)
+        if path.parent == failed_spool:
+            path.unlink(missing_ok=True)
+    return result
+
+
+def is_owned(path: str | os.PathLike) -> bool:
+    """Whether the file is a copy kept by marc (failed reports of the ingest
+    daemon and of the chunked uploads), not a file of the user"""
+    path = os.path.realpath(path)
+    for directory in (_failed_spool(), Path(settings.UPLOAD_STAGING) / "failed"):
+        directory = os.path.realpath(directory)
+        if os.path.commonpath([path, directory]) == directory:
+            return True
+    return False
+
+
+def purge(
+    files: QuerySet[QuarantinedFile],
+    delete_files: bool = False,
+    owned_only: bool = False,
+) -> int:
+    """Forget the files (and remove them from the disk, only the copies kept
+    by marc if owned_only, see is_owned)"""
+    if delete_files:
+        for path in files.values_list("path", flat=True):
+            if owned_only and not is_owned(path):
+                logger.warning(f"{path}: not deleted (not a file of marc)")
+                continue
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+    return files.delete()[0]
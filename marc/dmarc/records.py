@@ -0,0 +1,160 @@
+"""
+Compact representation of the reports on the import path.
+
+The records of a report are validated one by one by the marc.report
+dataclasses (pydantic), then converted to these tuples at once: no
+per-instance __dict__, and the parts shared by many records (identifiers,
+policy evaluated, auth results) are the same tuple. Strings and enum members
+are shared the same way. The marc.report dataclasses remain the public types
+of a report.
+"""
+
+from decimal import Decimal
+from typing import Any, Dict, List, NamedTuple, Tuple
+
+from marc.report import (
+    DispositionType,
+    DkimauthResultType,
+    DkimresultType,
+    DmarcresultType,
+    Feedback,
+    IdentifierType,
+    PolicyEvaluatedType,
+    PolicyOverrideReason,
+    PolicyOverrideType,
+    PolicyPublishedType,
+    RecordType,
+    ReportMetadataType,
+    SpfauthResultType,
+    SpfdomainScope,
+    SpfresultType,
+)
+
+
+class Identifiers(NamedTuple):
+    envelope_to: str | None
+    envelope_from: str | None
+    header_from: str | None
+
+
+class Reason(NamedTuple):
+    type_value: PolicyOverrideType | None
+    comment: str | None
+
+
+class PolicyEvaluated(NamedTuple):
+    disposition: DispositionType | None
+    dkim: DmarcresultType | None
+    spf: DmarcresultType | None
+    reason: Tuple[Reason, ...]
+
+
+class DkimResult(NamedTuple):
+    domain: str | None
+    selector: str | None
+    result: DkimresultType | None
+    human_result: str | None
+
+
+class SpfResult(NamedTuple):
+    domain: str | None
+    scope: SpfdomainScope | None
+    result: SpfresultType | None
+
+
+class Record(NamedTuple):
+    """A record and its row"""
+
+    source_ip: str | None
+    count: int | None
+    policy_evaluated: PolicyEvaluated
+    identifiers: Identifiers
+    dkim: Tuple[DkimResult, ...]
+    spf: Tuple[SpfResult, ...]
+
+
+class Report(NamedTuple):
+    """A report: its metadata and its policy are kept as validated (one per
+    report), its records are compact"""
+
+    version: Decimal | None
+    report_metadata: ReportMetadataType | None
+    policy_published: PolicyPublishedType | None
+    record: List[Record]
+
+
+class Converter:
+    """Convert the records of a report, sharing the equal values between them"""
+
+    def __init__(self):
+        self.shared: Dict[Any, Any] = {}
+
+    def share(self, value: Any) -> Any:
+        # the first equal value of the same type seen (named tuples are equal
+        # to any tuple of the same values, StrEnum members to their value)
+        return self.shared.setdefault((type(value), value), value)
+
+    def identifiers(self, i: IdentifierType | None) -> Identifiers:
+        if i is None:
+            raise ValueError("record without identifiers")
+        return self.share(
+            Identifiers(
+                self.share(i.envelope_to),
+                self.share(i.envelope_from),
+                self.share(i.header_from),
+            )
+        )
+
+    def policy_evaluated(self, pe: PolicyEvaluatedType | None) -> PolicyEvaluated:
+        if pe is None:
+            raise ValueError("row without policy_evaluated")
+        return self.share(
+            PolicyEvaluated(
+                pe.disposition,
+                pe.dkim,
+                pe.spf,
+                self.share(tuple(self.reason(r) for r in pe.reason)),
+            )
+        )
+
+    def reason(self, r: PolicyOverrideReason) -> Reason:
+        return self.share(Reason(r.type_value, self.share(r.comment)))
+
+    def dkim(self, d: DkimauthResultType) -> DkimResult:
+        return self.share(
+            DkimResult(
+                self.share(d.domain),
+                self.share(d.selector),
+                d.result,
+                self.share(d.human_result),
+            )
+        )
+
+    def spf(self, s: SpfauthResultType) -> SpfResult:
+        return self.share(SpfResult(self.share(s.domain), s.scope, s.result))
+
+    def record(self, record: RecordType) -> Record:
+        row, auth_results = record.row, record.auth_results
+        if row is None:
+            raise ValueError("record without row")
+        if auth_results is None:
+            raise ValueError("record without auth_results")
+        return Record(
+            row.source_ip,
+            row.count,
+            self.policy_evaluated(row.policy_evaluated),
+            self.identifiers(record.identifiers),
+            self.share(tuple(self.dkim(d) for d in auth_results.dkim)),
+            self.share(tuple(self.spf(s) for s in auth_results.spf)),
+        )
+
+
+def from_feedback(feedback: Feedback) -> Report:
+    """Convert a report bound to the marc.report dataclasses"""
+    converter = Converter()
+    return Report(
+        feedback.version,
+        feedback.report_metadata,
+        feedback.policy_published,
+        [converter.record(r) for r in feedback.record],
+    )
@@ -0,0 +1,282 @@
+"""
+Static assets: fingerprinted and precompressed by the buildstatic command,
+served from settings.STATIC_ROOT by the serve view.
+
+- hashed names (ManifestStaticFilesStorage) are cached forever by browsers
+  (Cache-Control: immutable), other names are revalidated (ETag)
+- .br (if brotli is installed) and .gz variants are written next to each
+  compressible file and picked according to Accept-Encoding
+- single byte ranges are supported (Range, If-Range)
+- woff2 subsets of the fonts are generated with fontTools
+"""
+
+import gzip
+import logging
+import mimetypes
+import re
+from functools import cached_property, lru_cache
+from pathlib import Path
+from types import ModuleType
+from typing import Iterable, Iterator, List, Set, Tuple
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import (
+    ManifestStaticFilesStorage,
+    staticfiles_storage,
+)
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpRequest,
+    HttpResponse,
+    HttpResponseNotModified,
+)
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_etags
+from django.views.decorators.http import require_safe
+from django.views.static import was_modified_since
+
+# one year
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+COMPRESSIBLE = {
+    ".css",
+    ".js",
+    ".mjs",
+    ".map",
+    ".json",
+    ".svg",
+    ".txt",
+    ".html",
+    ".xml",
+    ".ico",
+    ".ttf",
+    ".otf",
+}
+# smaller files are not worth a variant
+MIN_COMPRESS_SIZE = 256
+
+# Content-Encoding -> suffix, by order of preference
+ENCODINGS = {"br": ".br", "gzip": ".gz"}
+
+# latin subset (basic latin, latin-1 supplement, punctuation, common symbols)
+FONT_UNICODES = (
+    "U+0000-00FF,U+0131,U+0152-0153,U+02BB-02BC,U+02C6,U+02DA,U+02DC,"
+    "U+2000-206F,U+2074,U+20AC,U+2122,U+2191,U+2193,U+2212,U+2215,U+FEFF,U+FFFD"
+)
+
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+@lru_cache(maxsize=None)
+def load_brotli() -> ModuleType | None:
+    """brotli if installed (imported by the builds only: startup time)"""
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+class StaticFilesStorage(ManifestStaticFilesStorage):
+    """Hashed names once buildstatic has run, plain names before"""
+
+    manifest_strict = False
+
+    def stored_name(self, name: str) -> str:
+        if not self.hashed_files:
+            return name
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            # file added after the last build
+            return name
+
+    @cached_property
+    def hashed_names(self) -> Set[str]:
+        return set(self.hashed_files.values())
+
+
+def compress(
+    root: Path, names: Iterable[str] | None = None, force: bool = False
+) -> Iterator[Tuple[Path, str, int]]:
+    """Write the compressed variants of the files of root (only the given
+    names if any), yield (path, encoding, size) for every variant written"""
+    paths = (
+        sorted(root.rglob("*")) if names is None else sorted(map(root.joinpath, names))
+    )
+    brotli = load_brotli()
+    for path in paths:
+        if (
+            not path.is_file()
+            or path.suffix not in COMPRESSIBLE
+            or path.stat().st_size < MIN_COMPRESS_SIZE
+        ):
+            continue
+        data = None
+        for encoding, suffix in ENCODINGS.items():
+            if encoding == "br" and brotli is None:
+                continue
+            target = path.with_name(path.name + suffix)
+            if (
+                not force
+                and target.exists()
+                and target.stat().st_mtime >= path.stat().st_mtime
+            ):
+                continue
+            if data is None:
+                data = path.read_bytes()
+            if encoding == "br":
+                out = brotli.compress(data, quality=11)
+            else:
+                out = gzip.compress(data, compresslevel=9, mtime=0)
+            # keep the variant only if it saves at least 5%
+            if len(out) < len(data) * 0.95:
+                target.write_bytes(out)
+                yield target, encoding, len(out)
+            elif target.exists():
+                target.unlink()
+
+
+def subset_fonts(directory: Path, unicodes: str = FONT_UNICODES) -> List[Path]:
+    """Write a woff2 subset next to every TrueType/OpenType font of the
+    directory (requires fontTools and brotli)"""
+    from fontTools import subset
+
+    # fontTools logs every pruned table
+    logging.getLogger("fontTools").setLevel(logging.WARNING)
+    options = subset.Options()
+    options.flavor = "woff2"
+    options.hinting = False
+    options.desubroutinize = True
+    out = []
+    for path in sorted(directory.rglob("*")):
+        if path.suffix not in (".ttf", ".otf"):
+            continue
+        target = path.with_suffix(".woff2")
+        font = subset.load_font(str(path), options)
+        subsetter = subset.Subsetter(options)
+        subsetter.populate(unicodes=subset.parse_unicodes(unicodes))
+        subsetter.subset(font)
+        subset.save_font(font, str(target), options)
+        out.append(target)
+    return out
+
+
+def accepted_encodings(request: HttpRequest) -> Set[str]:
+    out = set()
+    for item in request.headers.get("Accept-Encoding", "").split(","):
+        coding, _, params = item.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q=") and q[2:].strip() in ("0", "0.0", "0.00", "0.000"):
+            continue
+        if coding:
+            out.add(coding.strip().lower())
+    return out
+
+
+def byte_range(header: str, size: int) -> Tuple[int, int] | None:
+    """(start, end) of a single byte range (end included), None if the header
+    is not a single byte range. Raise ValueError if it is unsatisfiable."""
+    match = _RANGE.match(header.strip())
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if first == "":
+        # suffix range: the last bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError(header)
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+@require_safe
+def serve(request: HttpRequest, path: str) -> HttpResponse:
+    """Serve a file of settings.STATIC_ROOT"""
+    try:
+        fullpath = Path(safe_join(settings.STATIC_ROOT, path))
+    except SuspiciousFileOperation as err:
+        raise Http404(path) from err
+    if not fullpath.is_file():
+        # sources (not built) in DEBUG mode
+        found = finders.find(path) if settings.DEBUG else None
+        if not found:
+            raise Http404(path)
+        fullpath = Path(found)
+
+    content_type, _ = mimetypes.guess_type(fullpath.name)
+    content_type = content_type or "application/octet-stream"
+    range_header = request.headers.get("Range")
+
+    # ranges are served from the identity encoding
+    encoding, selected = None, fullpath
+    if range_header is None:
+        accepted = accepted_encodings(request)
+        for name, suffix in ENCODINGS.items():
+            variant = fullpath.with_name(fullpath.name + suffix)
+            if name in accepted and variant.is_file():
+                encoding, selected = name, variant
+                break
+
+    stat = selected.stat()
+    etag = (
+        f'"{stat.st_mtime_ns:x}-{stat.st_size:x}{"-" + encoding if encoding else ""}"'
+    )
+    if path in getattr(staticfiles_storage, "hashed_names", ()):
+        cache_control = f"public, max-age={IMMUTABLE_MAX_AGE}, immutable"
+    else:
+        cache_control = "public, no-cache"
+    headers = {
+        "Cache-Control": cache_control,
+        "ETag": etag,
+        "Last-Modified": http_date(stat.st_mtime),
+        "Accept-Ranges": "bytes",
+        "Vary": "Accept-Encoding",
+    }
+
+    if_none_match = request.headers.get("If-None-Match")
+    if (if_none_match and etag in parse_etags(if_none_match)) or (
+        not if_none_match
+        and not was_modified_since(
+            request.headers.get("If-Modified-Since"), stat.st_mtime
+        )
+    ):
+        response = HttpResponseNotModified()
+        for key, value in headers.items():
+            response[key] = value
+        return response
+
+    size = stat.st_size
+    if range_header is not None and request.headers.get("If-Range", etag) == etag:
+        try:
+            bounds = byte_range(range_header, size)
+        except ValueError:
+            response = HttpResponse(status=416, headers=headers)
+            response["Content-Range"] = f"bytes */{size}"
+            return response
+        if bounds is not None:
+            start, end = bounds
+            with open(selected, "rb") as f:
+                f.seek(start)
+                data = f.read(end - start + 1)
+            response = HttpResponse(
+                data, status=206, content_type=content_type, headers=headers
+            )
+            response["Content-Range"] = f"bytes {start}-{end}/{size}"
+            return response
+
+    response = FileResponse(
+        open(selected, "rb"), content_type=content_type, filename=fullpath.name
+    )
+    for key, value in headers.items():
+        response[key] = value
+    if encoding:
+        response["Content-Encoding"] = encoding
+    return response
@@ -1,8 +1,8 @@
 import json
 import re
+from functools import lru_cache
 from typing import Any
 
-import markdown
 from django import template
 from django.utils.crypto import get_random_string
 from django.utils.safestring import mark_safe
@@ -25,9 +25,15 @@ def _sum(value: list) -> Any:
 def class_help_text(value: Any) -> str:
     if not isinstance(value, type):
         value = type(value)
+    return mark_safe(_class_help_text(value))
 
-    raw = multi_spaces.sub(" ", value.__doc__.split("\n\n\n")[0])
-    return mark_safe(markdown.markdown(raw))
+
+@lru_cache(maxsize=None)
+def _class_help_text(cls: type) -> str:
+    import markdown
+
+    raw = multi_spaces.sub(" ", cls.__doc__.split("\n\n\n")[0])
+    return markdown.markdown(raw)
 
 
 @register.simple_tag(name="random_string")
@@ -1,18 +1,106 @@
+import gzip
+import hashlib
+import http.client
+import json
 import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+from io import BytesIO, StringIO
 from pathlib import Path
-from typing import List
+from typing import Dict, List, Tuple
+from unittest import mock
 
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, transaction
 from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
-from marc.dmarc.models import Config, Feedback, PolicyPublished
+from marc import ingest
+from marc.dmarc import (
+    benchmark,
+    benchmark_startup,
+    benchmark_views,
+    bulkimport,
+    chunkedupload,
+    export,
+    ingestd,
+    metrics,
+    parser,
+    profiling,
+    quarantine,
+    records,
+    staticfiles,
+)
+from marc.dmarc.collect import collect
+from marc.dmarc.models import (
+    AuthResult,
+    Config,
+    Feedback,
+    ImportJobFile,
+    PolicyEvaluated,
+    PolicyPublished,
+    QuarantinedFile,
+    Record,
+    Row,
+    bump_data_version,
+    get_config,
+    get_data_version,
+)
 from marc.dmarc.parser import extract_parse, import_to_database
+from marc.dmarc.templatetags import dmarc_extras
+from marc.report.synthetic import GeneratorConfig, ReportGenerator
+from marc.settings import local_timezone
 
 TEST_DIR = Path(__file__).parent.parent.parent / "tests"
 DATA_DIR = TEST_DIR / "data"
 TEST_FILES = [DATA_DIR / file for file in os.listdir(DATA_DIR)]
 
 
+# maximum number of SQL queries of a GET on every named URL of marc.dmarc.urls,
+# whatever the number of rows (see TestQueryBudgets)
+QUERY_BUDGETS = {
+    "index": 10,
+    "file": 0,
+    "collect": 0,
+    "config": 0,
+    "config-form": 1,
+    "feedback-list": 2,
+    "feedback-details": 2,
+    "feedback-records": 2,
+    "feedback-row": 11,
+    "record-list": 2,
+    "record-details": 2,
+    "record-row": 2,
+    "profile-list": 0,
+    "profile-file": 0,
+    "quarantine": 2,
+    "upload-list": 0,
+    "upload-details": 0,
+    "upload-finalize": 0,
+    # the rows and the savepoint of the read transaction
+    "export-records": 3,
+    "export-feedbacks": 3,
+}
+
+# routes with a known N+1 pattern (skipped until fixed)
+KNOWN_N_PLUS_ONE = set()
+
+
+def clear_caches():
+    # ids and data versions are reused between tests
+    for c in caches.all():
+        c.clear()
+
+
 def import_all_test_files() -> List[Feedback]:
     out = []
     for file in TEST_FILES:
@@ -21,6 +109,16 @@ def import_all_test_files() -> List[Feedback]:
     return out
 
 
+class TestTemplateTags(TestCase):
+    def test_class_help_text(self):
+        dmarc_extras._class_help_text.cache_clear()
+        first = dmarc_extras.class_help_text(PolicyEvaluated)
+        second = dmarc_extras.class_help_text(PolicyEvaluated())
+        assert first == second, "help text differs between the class and an instance"
+        info = dmarc_extras._class_help_text.cache_info()
+        assert info.hits == 1 and info.misses == 1, f"not memoized: {info}"
+
+
 class TestStringListField(TestCase):
     def test_io(self):
         # value = "\n".join(os.listdir("/"))
@@ -32,6 +130,19 @@ class TestStringListField(TestCase):
         # print(c.directories, type(c.directories))
 
 
+class TestSqliteProfile(TestCase):
+    def test_pragmas(self):
+        if connection.vendor != "sqlite":
+            self.skipTest("SQLite only")
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA synchronous")
+            assert cursor.fetchone()[0] == 1, "synchronous must be NORMAL"
+            cursor.execute("PRAGMA temp_store")
+            assert cursor.fetchone()[0] == 2, "temp_store must be MEMORY"
+            cursor.execute("PRAGMA busy_timeout")
+            assert cursor.fetchone()[0] > 0, "busy_timeout must be set"
+
+
 class TestParser(TestCase):
     files = [DATA_DIR / file for file in os.listdir(DATA_DIR)]
 
@@ -58,6 +169,497 @@ class TestParser(TestCase):
         ), f"bad number of policy published: {after - before} != 6"
 
 
+class TestReports(TestCase):
+    def test_import_records(self):
+        feedbacks = import_all_test_files()
+        records = Record.objects.filter(feedback__in=feedbacks)
+        n = records.count()
+        assert n > 0, "no record imported"
+        for model in (AuthResult, Row):
+            assert model.objects.filter(record__in=records).count() == n, (
+                f"bad number of {model.__name__}"
+            )
+        assert PolicyEvaluated.objects.filter(row__record__in=records).count() == n, (
+            "bad number of PolicyEvaluated"
+        )
+
+    def test_prescan(self):
+        data = ReportGenerator(seed=44).report(0)
+        prefix, key = parser.prescan(BytesIO(data))
+        assert data.startswith(prefix), "bad prefix"
+        obj = extract_parse(BytesIO(data))
+        metadata = obj.report_metadata
+        assert key == (metadata.org_name, metadata.report_id), f"bad key {key}"
+        assert parser.prescan(BytesIO(b"<feedback/>"))[1] is None, "key found"
+
+        import_to_database(obj)
+        for raw in (data, gzip.compress(data)):
+            with mock.patch.object(parser, "xml_parser") as xml_parser:
+                with CaptureQueriesContext(connection) as queries:
+                    with self.assertRaises(parser.DuplicateReport):
+                        extract_parse(BytesIO(raw))
+            assert not xml_parser.called, "duplicate report parsed"
+            assert len(queries) == 1, f"{len(queries)} queries != 1"
+        assert extract_parse(BytesIO(data), skip_known=False).report_metadata
+
+    def test_limits(self):
+        # 64 MiB of blanks in a 64 KiB gzip member
+        bomb = gzip.compress(b"<feedback>" + b" " * 64 * 2**20)
+        with self.assertRaisesRegex(parser.ReportTooLarge, "ratio"):
+            extract_parse(BytesIO(bomb))
+
+        data = ReportGenerator(seed=48).report(0)
+        buffer = BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as z:
+            z.writestr("report.xml", data)
+        for raw in (data, gzip.compress(data), buffer.getvalue()):
+            with self.settings(REPORT_MAX_SIZE=len(data) - 1):
+                with self.assertRaisesRegex(parser.ReportTooLarge, "larger"):
+                    extract_parse(BytesIO(raw))
+            assert parser.extract_stream(BytesIO(raw)).read() == data, "bad data"
+
+    def test_compact_records(self):
+        data = ReportGenerator(
+            seed=50, config=GeneratorConfig(records=(40, 40))
+        ).report(0)
+        obj = extract_parse(BytesIO(data))
+        feedback = parser.parse(BytesIO(data))
+        assert obj == records.from_feedback(feedback), "bad conversion"
+        assert all(type(r) is records.Record for r in obj.record), "not compact"
+        shared = {id(r.identifiers) for r in obj.record}
+        assert len(shared) == len({r.identifiers for r in obj.record}), "not shared"
+
+        # the marc.report dataclasses are still accepted
+        import_to_database(feedback)
+        n = Record.objects.filter(
+            feedback__report_metadata__report_id=obj.report_metadata.report_id
+        ).count()
+        assert n == len(feedback.record), f"{n} records imported"
+
+    def test_mmap(self):
+        data = ReportGenerator(seed=49).report(0)
+        expected = extract_parse(BytesIO(data))
+        with (
+            tempfile.TemporaryDirectory() as tmp,
+            self.settings(REPORT_MMAP_MIN_SIZE=0),
+        ):
+            plain, compressed, empty = (Path(tmp) / n for n in ("r.xml", "r.gz", "e"))
+            plain.write_bytes(data)
+            compressed.write_bytes(gzip.compress(data))
+            empty.touch()
+            for path in (plain, compressed):
+                with parser.open_report(path, mapped=True) as f:
+                    assert isinstance(f, parser.mmap.mmap), f"{path} not mapped"
+                    assert extract_parse(f) == expected, f"{path}: bad report"
+            with parser.open_report(empty, mapped=True) as f:
+                assert not isinstance(f, parser.mmap.mmap), "empty file mapped"
+            with self.settings(REPORT_MMAP_MIN_SIZE=-1):
+                with parser.open_report(plain, mapped=True) as f:
+                    assert not isinstance(f, parser.mmap.mmap), "mapping not disabled"
+            # files written by other processes (collect, ingestd) are read
+            with parser.open_report(plain) as f:
+                assert not isinstance(f, parser.mmap.mmap), "mapped by default"
+
+            # the mapping is closed after a failure (no view left)
+            import_to_database(expected)
+            truncated = data.replace(b"<report_id>", b"<report_id>x")[:-100]
+            for error, raw in (
+                (parser.DuplicateReport, data),
+                (parser.ElementTree.ParseError, truncated),
+            ):
+                plain.write_bytes(raw)
+                with self.assertRaises(error), parser.open_report(plain, True) as f:
+                    extract_parse(f)
+            plain.write_bytes(data)
+            with self.settings(REPORT_MAX_SIZE=len(data) - 1):
+                with self.assertRaises(parser.ReportTooLarge):
+                    with parser.open_report(plain, mapped=True) as f:
+                        extract_parse(f)
+
+
+class TestSynthetic(TestCase):
+    config = GeneratorConfig(records=(5, 30), override_ratio=0.5, ipv6_ratio=0.5)
+
+    def test_seed(self):
+        a = ReportGenerator(seed=1, config=self.config)
+        b = ReportGenerator(seed=1, config=self.config)
+        c = ReportGenerator(seed=2, config=self.config)
+        assert a.report(3) == b.report(3), "same seed must give the same report"
+        assert a.report(3) != c.report(3), "different seeds must differ"
+
+    def test_import(self):
+        generator = ReportGenerator(seed=0, config=self.config)
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = generator.write_all(Path(tmp), 6, compression="mixed")
+            for path in paths:
+                with open(path, "rb") as f:
+                    import_to_database(extract_parse(f))
+        assert Feedback.objects.count() == 6, "bad number of feedbacks"
+
+    def test_benchmark(self):
+        generator = ReportGenerator(seed=0, config=self.config)
+        with tempfile.TemporaryDirectory() as tmp:
+            generator.write_all(Path(tmp), 4, compression="mixed")
+            result = benchmark.run(benchmark.iter_files([tmp]))
+        assert result.files == 4, f"bad number of files: {result.failures}"
+        assert result.records > 0, "no record"
+        assert Feedback.objects.count() == 0, "imports must be rolled back"
+        results = result.as_dict()
+        for stage in benchmark.STAGES:
+            assert results["stages"][stage]["records_per_s"] > 0, stage
+
+    def test_benchmark_views(self):
+        benchmark_views.seed(feedbacks=3, records=30)
+        # the upload API and the profiles are disabled by default
+        with self.settings(UPLOAD_TOKEN="secret", DEBUG=True):
+            results = benchmark_views.run(requests=2, sample=5)
+        for name, route in results["routes"].items():
+            assert route["requests"] == 2, f"{name} not requested"
+            assert set(route["statuses"]) == {200}, f"{name}: {route['statuses']}"
+
+
+class TestCleanup(TestCase):
+    models = [Feedback, Record, AuthResult, Row, PolicyEvaluated, PolicyPublished]
+
+    def test_cleanall(self):
+        import_all_test_files()
+        call_command("cleanall", "--chunk-size", "2", verbosity=0)
+        for model in self.models:
+            assert model.objects.count() == 0, f"{model.__name__} not empty"
+
+    def test_prune(self):
+        import_all_test_files()
+        # sample reports are older than that
+        call_command("prune", "--older-than", "1d", verbosity=0)
+        for model in self.models:
+            assert model.objects.count() == 0, f"{model.__name__} not empty"
+
+    def test_ids_not_reused(self):
+        import_all_test_files()
+        last = Record.objects.order_by("-id").values_list("id", flat=True).first()
+        call_command("cleanall", verbosity=0)
+        import_all_test_files()
+        first = Record.objects.order_by("id").values_list("id", flat=True).first()
+        assert first > last, f"record id {first} reused (<= {last})"
+
+    def test_prune_keeps_recent(self):
+        import_all_test_files()
+        call_command("prune", "--older-than", "100000w", verbosity=0)
+        assert Feedback.objects.count() == len(TEST_FILES), "recent reports removed"
+
+
+class TestMetrics(TestCase):
+    def setUp(self) -> None:
+        metrics.registry.clear()
+        return super().setUp()
+
+    def test_import(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            import_all_test_files()
+        counters = metrics.registry.counters
+        reports = counters["marc_reports_imported_total"][()]
+        assert reports == len(TEST_FILES), f"bad number of reports: {reports}"
+        rows = counters["marc_rows_inserted_total"][(("table", "dmarc_record"),)]
+        assert rows == Record.objects.count(), f"bad number of records: {rows}"
+        for stage in ("decompress", "parse", "validate", "write"):
+            key = (("stage", stage),)
+            h = metrics.registry.histograms["marc_import_stage_seconds"][key]
+            assert h[-2] == len(TEST_FILES), f"{stage}: bad count {h[-2]}"
+
+    def test_loadreport(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "metrics.json"
+            with self.settings(METRICS_FILE=path):
+                files = list(map(str, TEST_FILES))
+                call_command("loadreport", *files, verbosity=0)
+                call_command("loadreport", *files, verbosity=0)
+                text = Client().get(reverse("metrics")).content.decode()
+        duplicates = f"marc_duplicates_skipped_total {len(TEST_FILES)}"
+        assert duplicates in text, "duplicates not counted"
+        assert "marc_database_size_bytes" in text, "no database size"
+
+    def test_unwritable_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            (Path(tmp) / "file").touch()
+            with self.settings(METRICS_FILE=Path(tmp) / "file" / "m.json"):
+                call_command("loadreport", str(TEST_FILES[0]), verbosity=0)
+        assert Feedback.objects.count() == 1, "not imported"
+        counters = metrics.registry.counters
+        files = counters["marc_files_total"][(("source", "loadreport"),)]
+        assert files == 1, "counters lost"
+
+    def test_shared(self):
+        # two workers of marc serve (processes): one registry each
+        with (
+            tempfile.TemporaryDirectory() as tmp,
+            self.settings(METRICS_FILE=Path(tmp) / "m.json"),
+            mock.patch.object(metrics, "shared", True),
+        ):
+            other = {"counters": {"marc_reports_imported_total": [[[], 2]]}}
+            (Path(tmp) / "m.json").write_text(json.dumps(other))
+            metrics.registry.inc("marc_reports_imported_total")
+            for _ in range(2):
+                text = metrics.exposition()
+                assert "marc_reports_imported_total 3" in text, "counter went back"
+            assert not metrics.registry.counters, "registry of the worker not saved"
+
+    def test_gauges_cached(self):
+        clear_caches()
+        with tempfile.TemporaryDirectory() as tmp:
+            with self.settings(METRICS_FILE=Path(tmp) / "m.json"):
+                first = metrics.exposition()
+                with self.assertNumQueries(0):
+                    second = metrics.exposition()
+                assert first == second, "cached gauges differ"
+                with self.settings(METRICS_GAUGES_TTL=0):
+                    import_all_test_files()
+                    text = metrics.exposition()
+        rows = f'marc_table_rows{{table="dmarc_feedback"}} {len(TEST_FILES)}'
+        assert rows in text, "gauges cached without TTL"
+
+
+class TestProfiling(TestCase):
+    def test_loadreport(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with self.settings(PROFILE_DIR=tmp, METRICS_FILE=Path(tmp) / "m.json"):
+                files = list(map(str, TEST_FILES))
+                call_command("loadreport", *files, "--profile", verbosity=0)
+                profiles = profiling.recent_profiles()
+                assert len(profiles) == 1, f"bad number of profiles: {len(profiles)}"
+                for ext in (".pstats", ".alloc.txt", ".json"):
+                    path = profiling.profile_file(profiles[0].stem + ext)
+                    assert path is not None, f"{ext} file missing"
+                res = Client().get(reverse("profile-list"))
+                assert res.status_code == 404, "profiles served without DEBUG"
+                file_url = reverse("profile-file", args=(profiles[0].stem + ".json",))
+                assert Client().get(file_url).status_code == 404, "file without DEBUG"
+                with self.settings(DEBUG=True):
+                    res = Client().get(reverse("profile-list"))
+                assert profiles[0].stem in res.content.decode(), "profile not listed"
+
+    def test_view(self):
+        url = reverse("index") + "?profile"
+        with tempfile.TemporaryDirectory() as tmp:
+            with self.settings(PROFILE_DIR=tmp, DEBUG=False):
+                res = Client().get(url)
+                assert "X-Profile" not in res, "profiled without DEBUG"
+            with self.settings(PROFILE_DIR=tmp, DEBUG=True):
+                res = Client().get(url)
+                assert "X-Profile" in res, "not profiled"
+        assert profiling.profile_file("../db.sqlite3") is None, "path traversal"
+
+
+class TestQueryBudgets(TestCase):
+    # deterministic number of rows per record (no optional dkim result)
+    config = GeneratorConfig(records=(3, 3), dkim=(1, 1), override_ratio=0)
+
+    def setUp(self) -> None:
+        # the config is created on first access
+        get_config()
+        return super().setUp()
+
+    def seed(self, start: int, count: int, records: int):
+        self.config.records = (records, records)
+        generator = ReportGenerator(seed=0, config=self.config)
+        for i in range(start, start + count):
+            import_to_database(extract_parse(BytesIO(generator.report(i))))
+
+    def route_args(self, pattern) -> tuple:
+        if pattern.name == "profile-file":
+            return ("missing.pstats",)
+        if "upload_id" in pattern.pattern.converters:
+            return ("0" * 32,)
+        if "pk" in pattern.pattern.converters:
+            # the newest object is the one with the most rows
+            model = benchmark_views.ROUTE_MODELS[pattern.name.split("-")[0]]
+            return (model.objects.order_by("-id").first().id,)
+        return ()
+
+    def count_queries(self) -> Dict[str, int]:
+        client = Client()
+        out = {}
+        for pattern in benchmark_views.routes():
+            url = reverse(pattern.name, args=self.route_args(pattern))
+            clear_caches()
+            with CaptureQueriesContext(connection) as ctx:
+                res = client.get(url)
+                if res.streaming:
+                    # queries run while the response is sent
+                    b"".join(res.streaming_content)
+            assert res.status_code < 500, f"{pattern.name}: {res.status_code}"
+            out[pattern.name] = len(ctx.captured_queries)
+        return out
+
+    def test_every_route_has_a_budget(self):
+        names = {pattern.name for pattern in benchmark_views.routes()}
+        missing = names - set(QUERY_BUDGETS)
+        assert not missing, f"no query budget for {missing}"
+
+    def test_budgets(self):
+        self.seed(0, 2, records=2)
+        small = self.count_queries()
+        self.seed(2, 3, records=40)
+        large = self.count_queries()
+
+        for name, budget in QUERY_BUDGETS.items():
+            with self.subTest(route=name):
+                if name in KNOWN_N_PLUS_ONE:
+                    self.skipTest(f"{name}: known N+1 ({large[name]} queries)")
+                assert large[name] <= budget, (
+                    f"{name}: {large[name]} queries, budget {budget}"
+                )
+                assert small[name] == large[name], (
+                    f"{name}: {small[name]} queries with 2 rows, "
+                    f"{large[name]} with 40 (N+1)"
+                )
+
+
+class TestFeedbackRecords(TestCase):
+    def setUp(self) -> None:
+        clear_caches()
+        config = GeneratorConfig(records=(250, 250), fail_ratio=0.3)
+        report = ReportGenerator(seed=0, config=config).report(0)
+        self.feedback = import_to_database(extract_parse(BytesIO(report)))
+        self.url = reverse("feedback-records", args=(self.feedback.id,))
+        return super().setUp()
+
+    def records(self, **params) -> Tuple[List[Record], str | None]:
+        res = Client().get(self.url, params)
+        assert res.status_code == 200, f"bad status: {res.status_code}"
+        return res.context["records"], res.context["next_page_url"]
+
+    def test_pages(self):
+        ids = []
+        url = self.url
+        while url:
+            res = Client().get(url)
+            ids += [r.id for r in res.context["records"]]
+            url = res.context["next_page_url"]
+        expected = list(
+            self.feedback.record.order_by("id").values_list("id", flat=True)
+        )
+        assert ids == expected, "pages must cover every record once"
+
+    def test_filters(self):
+        records, _ = self.records(dmarc="fail", disposition="none")
+        for r in records:
+            pe = r.row.policy_evaluated
+            assert not pe.dmarc(), f"record {r.id} passes dmarc"
+            assert pe.disposition == "none", f"record {r.id}: {pe.disposition}"
+
+        ip = self.feedback.record.first().row.source_ip
+        records, _ = self.records(source_ip=ip)
+        assert ip in [r.row.source_ip for r in records], f"{ip} not found"
+
+    def test_sort(self):
+        records, next_page_url = self.records(sort="-count")
+        counts = [r.row.count for r in records]
+        assert counts == sorted(counts, reverse=True), "not sorted"
+        assert "sort=-count" in next_page_url, "sort lost in the next page"
+        top = self.feedback.record.order_by("-row__count").first().row.count
+        assert counts[0] == top, "sorted on the page only, not in SQL"
+
+
+class TestConditionalGet(TestCase):
+    def setUp(self) -> None:
+        clear_caches()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.feedback = import_all_test_files()[0]
+        self.record = Record.objects.filter(feedback=self.feedback).first()
+        return super().setUp()
+
+    def test_not_modified(self):
+        client = Client()
+        for name, pk in [
+            ("feedback-details", self.feedback.id),
+            ("feedback-row", self.feedback.id),
+            ("record-details", self.record.id),
+            ("record-row", self.record.id),
+        ]:
+            with self.subTest(route=name):
+                url = reverse(name, args=(pk,))
+                res = client.get(url)
+                etag = res.headers.get("ETag")
+                assert res.status_code == 200, f"{name}: {res.status_code}"
+                assert etag, f"{name}: no ETag"
+                assert res.headers.get("Last-Modified"), f"{name}: no Last-Modified"
+                res = client.get(url, HTTP_IF_NONE_MATCH=etag)
+                assert res.status_code == 304, f"{name}: {res.status_code} != 304"
+                assert not res.content, f"{name}: 304 with a body"
+                # the htmx fragment is another representation
+                res = client.get(url, HTTP_IF_NONE_MATCH=etag, HTTP_HX_REQUEST="true")
+                assert res.status_code == 200, f"{name}: fragment not modified"
+
+    def test_import_changes_etag(self):
+        client = Client()
+        url = reverse("record-row", args=(self.record.id,))
+        etag = client.get(url).headers["ETag"]
+        version = get_data_version()
+        # the version is incremented once the import is committed
+        with self.captureOnCommitCallbacks(execute=True):
+            import_to_database(
+                extract_parse(BytesIO(ReportGenerator(seed=1).report(0)))
+            )
+            import_to_database(
+                extract_parse(BytesIO(ReportGenerator(seed=1).report(1)))
+            )
+        assert get_data_version() == version + 1, (
+            f"data version {get_data_version()} != {version} + 1"
+        )
+        res = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert res.status_code == 200, "ETag unchanged after an import"
+        assert res.headers["ETag"] != etag, "same ETag after an import"
+
+    def test_data_version_rollback(self):
+        version = get_data_version()
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                bump_data_version()
+                raise ValueError("rolled back")
+        for n in (1, 2):
+            with self.captureOnCommitCallbacks(execute=True):
+                bump_data_version()
+            assert get_data_version() == version + n, f"not incremented ({n})"
+
+    def test_cache_control(self):
+        client = Client()
+        url = reverse("feedback-row", args=(self.feedback.id,))
+        version = get_data_version()
+        res = client.get(f"{url}?v={version}")
+        assert "immutable" in res.headers["Cache-Control"], res.headers["Cache-Control"]
+        res = client.get(f"{url}?v={version - 1}")
+        assert "no-cache" in res.headers["Cache-Control"], res.headers["Cache-Control"]
+        res = client.get(url)
+        assert "no-cache" in res.headers["Cache-Control"], res.headers["Cache-Control"]
+        assert "HX-Request" in res.headers["Vary"], "no Vary on HX-Request"
+
+    def test_list_urls_are_versioned(self):
+        res = Client().get(reverse("feedback-list"))
+        assert f"?v={get_data_version()}" in res.content.decode(), (
+            "row URL not versioned"
+        )
+
+    def test_fragment_cache(self):
+        url = reverse("feedback-row", args=(self.feedback.id,))
+        with CaptureQueriesContext(connection) as cold:
+            first = Client().get(url).content
+        with CaptureQueriesContext(connection) as warm:
+            second = Client().get(url).content
+        assert first == second, "cached fragment differs"
+        assert len(warm) < len(cold), f"not cached: {len(warm)} >= {len(cold)} queries"
+        with self.captureOnCommitCallbacks(execute=True):
+            import_to_database(
+                extract_parse(BytesIO(ReportGenerator(seed=1).report(0)))
+            )
+        with CaptureQueriesContext(connection) as bumped:
+            Client().get(url)
+        assert len(bumped) == len(cold), "fragment not invalidated by an import"
+
+    def test_not_found(self):
+        res = Client().get(reverse("record-row", args=(0,)))
+        assert res.status_code == 404, f"{res.status_code} != 404"
+
+
 class TestViews(TestCase):
     files = [DATA_DIR / file for file in os.listdir(DATA_DIR)]
     feedbacks: List[Feedback] = []
@@ -70,3 +672,658 @@ class TestViews(TestCase):
         client = Client()
         res = client.get(reverse("feedback-details", args=(self.feedbacks[0].id,)))
         print(res)
+
+
+class TestViewInstrumentation(TestCase):
+    feedbacks: List[Feedback] = []
+
+    def setUp(self) -> None:
+        clear_caches()
+        self.feedbacks = import_all_test_files()
+        return super().setUp()
+
+    def test_server_timing(self):
+        client = Client()
+        res = client.get(reverse("feedback-details", args=(self.feedbacks[0].id,)))
+        timing = res.headers.get("Server-Timing", "")
+        for metric in ("db;dur=", "tpl;dur=", "total;dur="):
+            assert metric in timing, f"{metric} missing in '{timing}'"
+
+    def test_upload(self):
+        data = ReportGenerator(seed=49).report(0)
+        client = Client()
+        url = reverse("file")
+        spooled = []
+
+        def spy(stream, *args, **kwargs):
+            spooled.append(os.path.exists(getattr(stream, "name", "")))
+            return extract_parse(stream, *args, **kwargs)
+
+        with self.settings(FILE_UPLOAD_MAX_MEMORY_SIZE=len(data) // 2):
+            with mock.patch.object(parser, "extract_parse", spy):
+                client.post(url, {"file": SimpleUploadedFile("r.xml", data)})
+        assert Feedback.objects.count() == len(self.feedbacks) + 1, "not imported"
+        assert spooled == [True], "upload not spooled to disk"
+
+        with self.settings(UPLOAD_MAX_SIZE=len(data) // 2):
+            with mock.patch.object(parser, "extract_parse") as parse:
+                res = client.post(url, {"file": SimpleUploadedFile("big.xml", data)})
+        assert not parse.called, "file larger than UPLOAD_MAX_SIZE parsed"
+        assert "larger than" in res.content.decode(), "upload not refused"
+
+    def test_query_budget(self):
+        client = Client()
+        url = reverse("index")
+        with self.settings(QUERY_BUDGET=1):
+            with self.assertLogs("django.marc", level="WARNING") as logs:
+                client.get(url)
+        assert "budget 1" in logs.output[0], "no budget warning"
+
+
+class TestStaticFiles(TestCase):
+    def setUp(self) -> None:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        src, self.root = Path(tmp.name) / "src", Path(tmp.name) / "root"
+        (src / "fonts").mkdir(parents=True)
+        (src / "fonts" / "a.ttf").write_bytes(bytes(range(256)) * 8)
+        (src / "a.css").write_text(
+            "body { color: red; }\n" * 100
+            + '@font-face { src: url(/static/fonts/a.ttf) format("truetype"); }\n'
+        )
+        settings = self.settings(
+            STATICFILES_DIRS=[src],
+            STATICFILES_FINDERS=["django.contrib.staticfiles.finders.FileSystemFinder"],
+            STATIC_ROOT=self.root,
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        return super().setUp()
+
+    def build(self):
+        call_command("buildstatic", verbosity=0)
+        return staticfiles_storage.stored_name("a.css")
+
+    def test_unbuilt(self):
+        assert staticfiles_storage.url("a.css") == "/static/a.css", (
+            "hashed before build"
+        )
+        with self.settings(DEBUG=True):
+            res = Client().get("/static/a.css")
+        assert res.status_code == 200, "sources not served in DEBUG mode"
+
+    def test_build(self):
+        name = self.build()
+        assert name != "a.css", "name not hashed"
+        css = (self.root / name).read_text()
+        font = staticfiles_storage.stored_name("fonts/a.ttf")
+        assert f"/static/{font}" in css, "font url not rewritten"
+        variants = [".gz", ".br"] if staticfiles.load_brotli() else [".gz"]
+        for suffix in variants:
+            assert (self.root / f"{name}{suffix}").is_file(), f"no {suffix}"
+
+    def test_serve(self):
+        name = self.build()
+        client = Client()
+        url = f"/static/{name}"
+        identity = (self.root / name).read_bytes()
+
+        res = client.get(url, HTTP_ACCEPT_ENCODING="gzip")
+        assert res.status_code == 200, f"{res.status_code} != 200"
+        assert "immutable" in res["Cache-Control"], res["Cache-Control"]
+        assert res["Content-Encoding"] == "gzip", "not gzip"
+        assert gzip.decompress(b"".join(res.streaming_content)) == identity
+        assert "Accept-Encoding" in res["Vary"], "no Vary"
+
+        res = client.get(url, HTTP_ACCEPT_ENCODING="gzip;q=0, identity")
+        assert not res.has_header("Content-Encoding"), "refused encoding served"
+        res = client.get("/static/a.css")
+        assert "no-cache" in res["Cache-Control"], "unhashed name is immutable"
+
+        res = client.get(url, HTTP_IF_NONE_MATCH=client.get(url)["ETag"])
+        assert res.status_code == 304, f"{res.status_code} != 304"
+
+        res = client.get(url, HTTP_RANGE="bytes=10-19")
+        assert res.status_code == 206, f"{res.status_code} != 206"
+        assert res.content == identity[10:20], "bad range"
+        assert res["Content-Range"] == f"bytes 10-19/{len(identity)}"
+        res = client.get(url, HTTP_RANGE="bytes=-5")
+        assert res.content == identity[-5:], "bad suffix range"
+        res = client.get(url, HTTP_RANGE=f"bytes={len(identity)}-")
+        assert res.status_code == 416, f"{res.status_code} != 416"
+        res = client.get(url, HTTP_RANGE="bytes=0-1", HTTP_IF_RANGE='"old"')
+        assert res.status_code == 200, "range of a changed file"
+
+        assert client.get("/static/../settings.py").status_code == 404
+        assert client.get("/static/missing.js").status_code == 404
+
+
+class TestServer(TestCase):
+    def test_serve(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            env = os.environ | {
+                "MARC_DB_ENGINE": "sqlite",
+                "MARC_DB_NAME": str(Path(tmp) / "db.sqlite3"),
+                "MARC_METRICS_FILE": str(Path(tmp) / "metrics.json"),
+                "MARC_DEBUG": "0",
+                "MARC_ALLOWED_HOSTS": "127.0.0.1",
+            }
+            cmd = [sys.executable, "-m", "marc"]
+            subprocess.run(cmd + ["migrate", "-v0"], env=env, check=True)
+            with socket.socket() as s:
+                s.bind(("127.0.0.1", 0))
+                port = s.getsockname()[1]
+            proc = subprocess.Popen(
+                cmd + ["serve", "-b", f"127.0.0.1:{port}", "-w", "2", "-t", "2"],
+                env=env,
+                stderr=subprocess.PIPE,
+                text=True,
+            )
+            try:
+                for line in proc.stderr:
+                    if "Listening at" in line:
+                        break
+                else:
+                    raise AssertionError("server not started")
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+                for _ in range(20):
+                    try:
+                        conn.request("GET", "/dmarc/")
+                        break
+                    except ConnectionRefusedError:
+                        time.sleep(0.1)
+                res = conn.getresponse()
+                assert res.status == 200, f"{res.status} != 200"
+                res.read()
+                conn.close()
+
+                # the retired workers close their idle connections
+                proc.send_signal(signal.SIGHUP)
+                for _ in range(5):
+                    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+                    conn.request("GET", "/dmarc/feedback/")
+                    res = conn.getresponse()
+                    assert res.status == 200, f"{res.status} != 200 after reload"
+                    res.read()
+                    conn.close()
+
+                # one connection per scrape: any worker answers
+                counts = []
+                for _ in range(6):
+                    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+                    conn.request("GET", "/metrics")
+                    lines = conn.getresponse().read().decode().splitlines()
+                    conn.close()
+                    counts.append(
+                        sum(
+                            float(line.rsplit(" ", 1)[1])
+                            for line in lines
+                            if line.startswith("marc_request_duration_seconds_count")
+                        )
+                    )
+                assert counts == sorted(counts), f"counters went back: {counts}"
+                # a worker answers twice at least: its first scrape is counted
+                assert counts[-1] > 0, f"requests not counted: {counts}"
+            finally:
+                proc.terminate()
+                code = proc.wait(30)
+                proc.stderr.close()
+            assert code == 0, f"exit code {code}"
+
+
+class TestQuarantine(TestCase):
+    def test_collect(self):
+        generator = ReportGenerator(seed=44)
+        with tempfile.TemporaryDirectory() as tmp:
+            bad = Path(tmp) / "bad.xml.gz"
+            bad.write_bytes(b"\x1f\x8bnot gzipped")
+            (Path(tmp) / "good.xml").write_bytes(generator.report(0))
+            config = Config(directories=tmp)
+
+            assert collect(config) == 1, "good report not imported"
+            files = list(QuarantinedFile.objects.all())
+            assert len(files) == 1, f"{len(files)} quarantined files != 1"
+            assert files[0].path == str(bad), f"bad path {files[0].path}"
+            assert files[0].error_class == "BadGzipFile", files[0].error_class
+            assert files[0].sha256 == quarantine.file_sha256(bad), "bad hash"
+
+            # known-bad files are not read again
+            with mock.patch(
+                "marc.dmarc.collect.extract_parse", wraps=extract_parse
+            ) as parse:
+                assert collect(config) == 0, "reimported"
+            assert parse.call_count == 1, f"{parse.call_count} files parsed != 1"
+            assert QuarantinedFile.objects.get().attempts == 1, "attempt counted"
+
+            # fixed: imported and released
+            bad.write_bytes(gzip.compress(generator.report(1)))
+            assert collect(config) == 1, "fixed report not imported"
+            assert not QuarantinedFile.objects.exists(), "fixed report kept"
+
+    def test_loadreport(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            bad = Path(tmp) / "bad.xml"
+            bad.write_bytes(b"<feedback>")
+            with self.settings(METRICS_FILE=Path(tmp) / "m.json"):
+                # unchanged (skipped), then modified (tried again)
+                for attempts, touch in ((1, False), (1, True), (2, False)):
+                    call_command("loadreport", str(bad), verbosity=0)
+                    f = QuarantinedFile.objects.get()
+                    assert f.attempts == attempts, f"{f.attempts} != {attempts}"
+                    if touch:
+                        os.utime(bad, ns=(0, f.mtime_ns - 1))
+
+    def test_command(self):
+        generator = ReportGenerator(seed=46)
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = [Path(tmp) / f"{i}.xml" for i in range(3)]
+            for path in paths:
+                path.write_bytes(b"garbage")
+                quarantine.record(path, ValueError("garbage"))
+            assert quarantine.record(paths[0], ValueError()).attempts == 2
+            assert quarantine.record(paths[0], OperationalError()) is None
+
+            out = StringIO()
+            call_command("quarantine", "list", stdout=out)
+            assert all(str(p) in out.getvalue() for p in paths), "files not listed"
+
+            paths[0].write_bytes(generator.report(0))
+            with self.settings(METRICS_FILE=Path(tmp) / "m.json"):
+                call_command("quarantine", "retry", "--path", str(paths[0]))
+            assert QuarantinedFile.objects.count() == 2, "imported file kept"
+
+            call_command("quarantine", "purge", "--delete-files", verbosity=0)
+            assert not QuarantinedFile.objects.exists(), "files not purged"
+            assert not paths[1].exists(), "file not deleted"
+
+    def test_view(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = [Path(tmp) / f"{i}.xml" for i in range(2)]
+            for path in paths:
+                path.write_bytes(b"garbage")
+            ids = [quarantine.record(p, ValueError("garbage")).id for p in paths]
+
+            client = Client()
+            res = client.get(reverse("quarantine"))
+            assert str(paths[1]) in res.content.decode(), "file not listed"
+            res = client.post(reverse("quarantine"), {"action": "retry", "id": ids})
+            assert "2 failed" in res.content.decode(), "retry not reported"
+            res = client.post(reverse("quarantine"), {"action": "purge", "id": ids[:1]})
+            assert res.status_code == 200, res.status_code
+            assert QuarantinedFile.objects.count() == 1, "file not purged"
+            assert paths[0].exists(), "file deleted"
+
+            # only the copies kept by marc are deleted from the web
+            spool = Path(tmp) / "spool"
+            (spool / "failed").mkdir(parents=True)
+            copy = spool / "failed" / "1.report"
+            copy.write_bytes(b"garbage")
+            ids = [ids[1], quarantine.record(copy, ValueError("garbage")).id]
+            with self.settings(INGEST_SPOOL=spool):
+                res = client.post(
+                    reverse("quarantine"),
+                    {"action": "purge", "id": ids, "delete_files": "on"},
+                )
+            assert not QuarantinedFile.objects.exists(), "files not purged"
+            assert paths[1].exists(), "file of the user deleted"
+            assert not copy.exists(), "spooled copy not deleted"
+
+
+class TestBulkImport(TestCase):
+    def test_resume(self):
+        generator = ReportGenerator(seed=47)
+        with tempfile.TemporaryDirectory() as tmp:
+            (Path(tmp) / "sub").mkdir()
+            for i in range(5):
+                (Path(tmp) / "sub" / f"{i}.xml").write_bytes(generator.report(i))
+            (Path(tmp) / "bad.xml").write_bytes(b"garbage")
+            job = bulkimport.create_job([tmp], batch_size=2)
+            assert job.total == 6, f"{job.total} files in the manifest != 6"
+
+            # the database goes away during the second batch
+            import_batch = bulkimport.import_batch
+            calls = iter([import_batch, mock.Mock(side_effect=OperationalError)])
+            with (
+                mock.patch.object(
+                    bulkimport, "import_batch", lambda *a: next(calls)(*a)
+                ),
+                self.settings(METRICS_FILE=Path(tmp) / "m.json"),
+            ):
+                with self.assertRaises(OperationalError):
+                    bulkimport.run(job)
+            job.refresh_from_db()
+            assert job.done == 2, f"{job.done} files checkpointed != 2"
+            assert job.finished_at is None, "interrupted job finished"
+
+            out = StringIO()
+            with self.settings(METRICS_FILE=Path(tmp) / "m.json"):
+                call_command("loadreport", "--resume", stdout=out)
+            job.refresh_from_db()
+            assert (job.imported, job.failed) == (5, 1), "bad counters"
+            assert Feedback.objects.count() == 5, "bad number of imports"
+            assert job.finished_at is not None, "job not finished"
+            assert not ImportJobFile.objects.exists(), "manifest kept"
+            assert "ETA" in out.getvalue(), "no progress"
+            with self.assertRaises(CommandError):
+                call_command("loadreport", "--resume", str(job.id))
+
+
+class TestExport(TestCase):
+    def setUp(self) -> None:
+        config = GeneratorConfig(records=(20, 20), fail_ratio=0.5)
+        generator = ReportGenerator(seed=0, config=config)
+        for i in range(3):
+            import_to_database(extract_parse(BytesIO(generator.report(i))))
+        return super().setUp()
+
+    def get(self, kind: str, **params) -> bytes:
+        res = Client().get(reverse(f"export-{kind}"), params)
+        assert res.status_code == 200, f"bad status: {res.status_code}"
+        assert res.streaming, "not streamed"
+        return b"".join(res.streaming_content)
+
+    def test_view(self):
+        lines = self.get("records").decode().splitlines()
+        assert lines[0].split(",") == list(export.RECORD_COLUMNS), "bad header"
+        assert len(lines) - 1 == Record.objects.count(), "bad number of records"
+
+        rows = [
+            json.loads(line)
+            for line in self.get("feedbacks", format="ndjson").splitlines()
+        ]
+        assert [r["records"] for r in rows] == [20] * 3, "bad number of feedbacks"
+
+        feedback = Feedback.objects.select_related(
+            "report_metadata", "policy_published"
+        ).first()
+        metadata = feedback.report_metadata
+        filters = {
+            "disposition": "reject",
+            "domain": feedback.policy_published.domain,
+            "since": metadata.date_range_end.date(),
+            "until": metadata.date_range_begin.date(),
+        }
+        for name, value in filters.items():
+            with self.subTest(filter=name):
+                lines = self.get(
+                    "records", format="ndjson", **{name: value}
+                ).splitlines()
+                rows = [json.loads(line) for line in lines]
+                _, expected = export.queryset("records", **{name: value})
+                assert len(rows) == expected.count() > 0, f"{name}: {len(rows)} rows"
+                if name in ("disposition", "domain"):
+                    assert {r[name] for r in rows} == {value}, f"bad {name}"
+        res = Client().get(reverse("export-records"), {"since": "yesterday"})
+        assert res.status_code == 400, f"bad status: {res.status_code}"
+
+    def test_command(self):
+        out = StringIO()
+        call_command("export", "records", "--chunk-size", "7", stdout=out)
+        assert out.getvalue().encode() == self.get("records"), "bad export"
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "feedbacks.ndjson"
+            call_command(
+                "export",
+                "feedbacks",
+                "--format",
+                "ndjson",
+                "--disposition",
+                "none",
+                "-o",
+                str(path),
+            )
+            assert path.read_bytes() == self.get(
+                "feedbacks", format="ndjson", disposition="none"
+            ), "bad file"
+
+
+class TestChunkedUpload(TestCase):
+    def put(self, client: Client, upload_id: str, offset: int, chunk: bytes, sha=None):
+        return client.put(
+            reverse("upload-details", args=(upload_id,)) + f"?offset={offset}",
+            data=chunk,
+            content_type="application/octet-stream",
+            headers={"X-Chunk-SHA256": sha or hashlib.sha256(chunk).hexdigest()},
+        )
+
+    def test_upload(self):
+        data = gzip.compress(ReportGenerator(seed=50).report(0))
+        client = Client()
+        with (
+            tempfile.TemporaryDirectory() as tmp,
+            self.settings(
+                UPLOAD_STAGING=Path(tmp) / "staging",
+                UPLOAD_CHUNK_SIZE=256,
+                UPLOAD_TOKEN="secret",
+                METRICS_FILE=Path(tmp) / "m.json",
+            ),
+        ):
+            staging = Path(tmp) / "staging"
+            init = {"filename": "r.xml.gz", "size": len(data)}
+            res = client.post(reverse("upload-list"), init, "application/json")
+            assert res.status_code == 401, "no token required"
+
+            client = Client(headers={"Authorization": "Bearer secret"})
+            init["sha256"] = hashlib.sha256(data).hexdigest()
+            res = client.post(reverse("upload-list"), init, "application/json")
+            assert res.status_code == 201, res.content
+            upload_id = res.json()["id"]
+
+            res = self.put(client, upload_id, 0, data[:256], sha="0" * 64)
+            assert res.status_code == 400, "corrupted chunk accepted"
+            assert self.put(client, upload_id, 0, data[:256]).status_code == 200
+            res = self.put(client, upload_id, 0, data[:256])
+            assert res.status_code == 409, "chunk appended twice"
+            assert res.json()["offset"] == 256, res.json()
+
+            res = client.get(reverse("upload-list"))
+            assert res.json()["uploads"][0]["offset"] == 256, "bad list"
+
+            # resume from the offset of the status
+            finalize = reverse("upload-finalize", args=(upload_id,))
+            assert client.post(finalize).status_code == 400, "incomplete import"
+            offset = client.get(reverse("upload-details", args=(upload_id,)))
+            offset = offset.json()["offset"]
+            while offset < len(data):
+                res = self.put(client, upload_id, offset, data[offset:][:256])
+                offset = res.json()["offset"]
+
+            # the thread of the server does not see the test transaction
+            with mock.patch.object(chunkedupload, "start_import") as start:
+                res = client.post(finalize)
+            assert res.status_code == 202, "import not started in the background"
+            assert not res.json()["finished"], res.json()
+            assert start.call_count == 1, "import not started"
+            upload = chunkedupload.get(upload_id)
+            with chunkedupload._locked(upload, "import"):
+                assert chunkedupload.import_upload(upload_id) is None, "imported twice"
+            chunkedupload.import_upload(upload_id)
+
+            for _ in range(2):
+                # polled, or finalized again after a lost response
+                res = client.post(finalize)
+                assert res.status_code == 200, res.content
+                assert res.json()["finished"], res.json()
+                assert res.json()["imported"] == 1, res.json()
+            assert Feedback.objects.count() == 1, "not imported"
+            res = client.get(reverse("upload-details", args=(upload_id,)))
+            assert res.status_code == 200, "imported upload forgotten"
+            assert not upload.part_path.exists(), "staged file kept"
+
+            staged = {p.name for p in staging.iterdir()}
+            with self.settings(UPLOAD_TTL=0):
+                chunkedupload.cleanup()
+            assert not list(staging.iterdir()), f"{staged} not removed"
+
+    def test_bundle_limits(self):
+        generator = ReportGenerator(seed=51)
+        with (
+            tempfile.TemporaryDirectory() as tmp,
+            self.settings(UPLOAD_STAGING=Path(tmp)),
+        ):
+            upload = chunkedupload.init("bundle.zip", 1)
+            with zipfile.ZipFile(upload.part_path, "w") as z:
+                for n in range(3):
+                    z.writestr(f"{n}.xml", generator.report(n))
+            size = sum(
+                i.file_size for i in zipfile.ZipFile(upload.part_path).infolist()
+            )
+            for limits in (
+                {"UPLOAD_BUNDLE_MAX_MEMBERS": 2},
+                {"UPLOAD_BUNDLE_MAX_SIZE": size - 1},
+            ):
+                with self.settings(**limits), self.assertRaises(parser.ReportTooLarge):
+                    chunkedupload.extract_members(upload)
+            with self.settings(
+                UPLOAD_BUNDLE_MAX_MEMBERS=3, UPLOAD_BUNDLE_MAX_SIZE=size
+            ):
+                assert len(chunkedupload.extract_members(upload)) == 3, "not extracted"
+
+    def test_disabled(self):
+        client = Client(headers={"Authorization": "Bearer "})
+        with self.settings(UPLOAD_TOKEN=""):
+            for res in (
+                client.get(reverse("upload-list")),
+                client.post(reverse("upload-list"), {}, "application/json"),
+            ):
+                assert res.status_code == 403, "upload API enabled without token"
+
+    def test_cleanup(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with self.settings(UPLOAD_STAGING=Path(tmp)):
+                upload = chunkedupload.init("r.xml", 10)
+                assert chunkedupload.cleanup() == 0, "fresh upload removed"
+                for path in (upload.meta_path, upload.part_path):
+                    os.utime(path, (0, 0))
+                chunkedupload.init("r.xml", 10)
+                with self.assertRaises(chunkedupload.UploadNotFound):
+                    chunkedupload.get(upload.id)
+
+                # imported: only its metadata is left
+                upload = chunkedupload.init("r.xml", 10)
+                upload.part_path.unlink()
+                assert chunkedupload.cleanup() == 0, "fresh import result removed"
+                assert chunkedupload.get(upload.id), "import result removed"
+
+
+class TestStartup(TestCase):
+    def test_local_timezone(self):
+        for tz in ("Europe/Paris", ":America/New_York"):
+            with mock.patch.dict(os.environ, {"TZ": tz}):
+                assert local_timezone() == tz.lstrip(":"), f"{tz}: bad time zone"
+
+    def test_heavy_imports(self):
+        # the import time budget is checked by `marc benchstartup --check`
+        commands = [("cleanall", "--help"), ("loadreport", "--help"), ("check",)]
+        for result in benchmark_startup.run(commands, runs=1):
+            command = " ".join(result.command)
+            assert not result.heavy, f"{command} imports {result.heavy}"
+
+
+class TestIngestDaemon(TestCase):
+    def test_ingest(self):
+        generator = ReportGenerator(seed=42)
+        with (
+            tempfile.TemporaryDirectory() as tmp,
+            self.settings(METRICS_FILE=Path(tmp) / "m.json", INGEST_PATHS=[tmp]),
+        ):
+            path = str(Path(tmp) / "ingestd.sock")
+            daemon = ingestd.IngestDaemon(path, spool=Path(tmp) / "spool", batch_wait=0)
+            daemon.start()
+            try:
+                report = Path(tmp) / "report.xml"
+                report.write_bytes(generator.report(1))
+                n = ingest.send(
+                    [
+                        ingest.data_item(generator.report(0)),
+                        ingest.path_item(report),
+                        ingest.data_item(generator.report(0)),
+                        ingest.data_item(b"not a report"),
+                    ],
+                    path,
+                )
+                assert n == 4, f"{n} items queued != 4"
+                with self.assertRaises(ingest.IngestError):
+                    # not in INGEST_PATHS
+                    ingest.send([ingest.path_item(TEST_FILES[0])], path)
+                assert daemon.queue.qsize() == 4, "path out of the directories queued"
+                # the client does not import Django
+                code = subprocess.run(
+                    [sys.executable, "-m", "marc", "ingest", "-s", path],
+                    input=generator.report(2),
+                    env=os.environ | {"DJANGO_SETTINGS_MODULE": "nonexistent"},
+                ).returncode
+                assert code == 0, f"marc ingest exited with {code}"
+                markers = list(daemon.spool.glob("*.path"))
+                assert len(markers) == 1, "path acknowledged without being spooled"
+
+                before = Feedback.objects.count()
+                daemon.flush()
+                assert Feedback.objects.count() - before == 3, "bad number of imports"
+                spooled = [*daemon.spool.glob("*.report"), *daemon.spool.glob("*.path")]
+                assert not spooled, f"spool not emptied: {spooled}"
+                failed = list(daemon.failed_dir.iterdir())
+                assert len(failed) == 1, f"{len(failed)} failed reports != 1"
+                assert report.exists(), "file sent by path removed"
+            finally:
+                daemon.close()
+            assert not os.path.exists(path), "socket not removed"
+
+            code = ingest.main(["-s", path, str(TEST_FILES[0])])
+            assert code == ingest.EX_TEMPFAIL, f"{code} != EX_TEMPFAIL without daemon"
+
+    def test_recover(self):
+        generator = ReportGenerator(seed=43)
+        with (
+            tempfile.TemporaryDirectory() as tmp,
+            self.settings(METRICS_FILE=Path(tmp) / "m.json"),
+        ):
+            spool = Path(tmp) / "spool"
+            spool.mkdir()
+            (spool / "1.report").write_bytes(generator.report(0))
+            (spool / "2.tmp").write_bytes(b"never acknowledged")
+            # sent by path
+            report = Path(tmp) / "report.xml"
+            report.write_bytes(generator.report(1))
+            (spool / "3.path").write_bytes(os.fsencode(report))
+            daemon = ingestd.IngestDaemon(str(Path(tmp) / "sock"), spool=spool)
+            daemon.start()
+            try:
+                assert daemon.queue.qsize() == 2, "spool not queued"
+                assert not (spool / "2.tmp").exists(), "partial report kept"
+                daemon.flush()
+            finally:
+                daemon.close()
+            assert Feedback.objects.count() == 2, "spooled reports not imported"
+            assert not (spool / "1.report").exists(), "spooled report not removed"
+            assert not (spool / "3.path").exists(), "path marker not removed"
+            assert report.exists(), "file sent by path removed"
+
+    def test_retry(self):
+        generator = ReportGenerator(seed=45)
+        with (
+            tempfile.TemporaryDirectory() as tmp,
+            self.settings(METRICS_FILE=Path(tmp) / "m.json"),
+        ):
+            spool = Path(tmp) / "spool"
+            daemon = ingestd.IngestDaemon(str(Path(tmp) / "sock"), spool, batch_wait=0)
+            spool.mkdir()
+            daemon.failed_dir.mkdir()
+            (spool / "1.report").write_bytes(b"not a report")
+            report = Path(tmp) / "report.xml"
+            report.write_bytes(generator.report(0))
+            (spool / "2.path").write_bytes(os.fsencode(report))
+            daemon.recover()
+
+            locked = OperationalError("database is locked")
+            with mock.patch.object(ingestd, "import_to_database", side_effect=locked):
+                assert daemon.process(daemon.next_batch(timeout=0)) is None
+            assert len(daemon.pending) == 2, "batch not retried"
+            assert (spool / "1.report").exists(), "failed report moved before commit"
+            assert (spool / "2.path").exists(), "marker removed before commit"
+            assert not QuarantinedFile.objects.exists(), "quarantined before commit"
+
+            result = daemon.process(daemon.next_batch(timeout=0))
+            assert (result.imported, result.failed) == (1, 1), result
+            assert (daemon.failed_dir / "1.report").exists(), "failed report lost"
+            assert QuarantinedFile.objects.count() == 1, "failed report not quarantined"
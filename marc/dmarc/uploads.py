@@ -0,0 +1,50 @@
+"""
+Upload handler refusing the report files larger than settings.UPLOAD_MAX_SIZE
+(first of settings.FILE_UPLOAD_HANDLERS, the next ones keep small files in
+memory and write the others to a temporary file).
+
+The upload is stopped as soon as it is known to be too large (Content-Length
+of the request, then bytes received) without reading the rest of the body,
+and the reason is set on request.upload_error.
+"""
+
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+from django.template.defaultfilters import filesizeformat
+
+# multipart boundaries and headers around the file (bytes)
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+class MaxSizeUploadHandler(FileUploadHandler):
+    request_length = 0
+
+    def handle_raw_input(
+        self, input_data, META, content_length, boundary, encoding=None
+    ):
+        self.request_length = content_length
+        return None
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        if (
+            self.request_length > settings.UPLOAD_MAX_SIZE + MULTIPART_OVERHEAD
+            or (self.content_length or 0) > settings.UPLOAD_MAX_SIZE
+        ):
+            self.refuse()
+
+    def receive_data_chunk(self, raw_data: bytes, start: int) -> bytes:
+        if start + len(raw_data) > settings.UPLOAD_MAX_SIZE:
+            self.refuse()
+        return raw_data
+
+    def file_complete(self, file_size: int):
+        return None
+
+    def refuse(self):
+        if self.request is not None:
+            self.request.upload_error = (
+                f"{self.file_name}: file larger than "
+                f"{filesizeformat(settings.UPLOAD_MAX_SIZE)}"
+            )
+        raise StopUpload(connection_reset=True)
@@ -1,22 +1,29 @@
 from django.urls import path
-from django.views.decorators.cache import cache_page
 
+from marc.dmarc.caching import conditional_report
+from marc.dmarc.models import Feedback, Record
 from marc.dmarc.views import (
     CollectView,
     ConfigUpdateView,
     ConfigView,
+    ExportView,
     FeedbackDetailView,
     FeedbackListView,
+    FeedbackRecordsView,
     FeedbackRowView,
     FileView,
     IndexView,
+    ProfileFileView,
+    ProfileListView,
+    QuarantineView,
     RecordDetailView,
     RecordListView,
     RecordRowView,
+    UploadDetailView,
+    UploadFinalizeView,
+    UploadListView,
 )
 
-CACHE_TIMEOUT = 1
-
 urlpatterns = [
     path(
         "",
@@ -50,12 +57,17 @@ urlpatterns = [
     ),
     path(
         "feedback/<int:pk>/",
-        cache_page(CACHE_TIMEOUT)(FeedbackDetailView.as_view()),
+        conditional_report(Feedback, FeedbackDetailView.as_view()),
         name="feedback-details",
     ),
+    path(
+        "feedback/<int:pk>/records/",
+        FeedbackRecordsView.as_view(),
+        name="feedback-records",
+    ),
     path(
         "feedback/<int:pk>/row/",
-        cache_page(CACHE_TIMEOUT)(FeedbackRowView.as_view()),
+        conditional_report(Feedback, FeedbackRowView.as_view()),
         name="feedback-row",
     ),
     path(
@@ -65,12 +77,52 @@ urlpatterns = [
     ),
     path(
         "record/<int:pk>/",
-        cache_page(CACHE_TIMEOUT)(RecordDetailView.as_view()),
+        conditional_report(Record, RecordDetailView.as_view()),
         name="record-details",
     ),
     path(
         "record/<int:pk>/row/",
-        cache_page(CACHE_TIMEOUT)(RecordRowView.as_view()),
+        conditional_report(Record, RecordRowView.as_view()),
         name="record-row",
     ),
+    path(
+        "export/records/",
+        ExportView.as_view(kind="records"),
+        name="export-records",
+    ),
+    path(
+        "export/feedbacks/",
+        ExportView.as_view(kind="feedbacks"),
+        name="export-feedbacks",
+    ),
+    path(
+        "profiles/",
+        ProfileListView.as_view(),
+        name="profile-list",
+    ),
+    path(
+        "profiles/<str:filename>",
+        ProfileFileView.as_view(),
+        name="profile-file",
+    ),
+    path(
+        "quarantine/",
+        QuarantineView.as_view(),
+        name="quarantine",
+    ),
+    path(
+        "uploads/",
+        UploadListView.as_view(),
+        name="upload-list",
+    ),
+    path(
+        "uploads/<str:upload_id>/",
+        UploadDetailView.as_view(),
+        name="upload-details",
+    ),
+    path(
+        "uploads/<str:upload_id>/finalize/",
+        UploadFinalizeView.as_view(),
+        name="upload-finalize",
+    ),
 ]
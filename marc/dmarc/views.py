@@ -1,17 +1,35 @@
+import hmac
+import json
 import logging
-import os
 from datetime import UTC, datetime, timedelta
-from pathlib import Path
 from typing import Any
 
+from django.conf import settings
 from django.contrib import messages
-from django.db import IntegrityError, transaction
+from django.db import IntegrityError
 from django.db.models import Max, Min, Sum
-from django.http import HttpRequest
-from django.urls import reverse_lazy
-from django.views.generic import DetailView, ListView, TemplateView, UpdateView
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpRequest,
+    HttpResponse,
+    HttpResponseBadRequest,
+    JsonResponse,
+    StreamingHttpResponse,
+)
+from django.urls import reverse, reverse_lazy
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt
+from django.views.generic import (
+    DetailView,
+    ListView,
+    TemplateView,
+    UpdateView,
+    View,
+)
 
-from marc.dmarc.forms import ConfigForm
+from marc.dmarc import chunkedupload, export, metrics, profiling, quarantine
+from marc.dmarc.forms import ConfigForm, ExportForm, RecordFilterForm
 from marc.dmarc.models import (
     Config,
     DispositionType,
@@ -21,7 +39,6 @@ from marc.dmarc.models import (
     Row,
     get_config,
 )
-from marc.dmarc.parser import extract_parse, import_to_database
 
 logger = logging.getLogger("django.marc")
 
@@ -43,22 +60,29 @@ __disposition_background_colors__ = {
 }
 
 
-def _must_collect(p: Path, recursive: bool = False) -> int:
-    if p.is_dir():
-        return sum(_must_collect(p / f, recursive) for f in os.listdir(p))
-    else:
-        try:
-            with open(p, "rb") as raw:
-                with transaction.atomic():
-                    import_to_database(extract_parse(raw))
-            logger.info(f"{p} imported")
-            return 1
-        except IntegrityError as err:
-            logger.debug(f"{p}: {err}")
-        except BaseException as err:
-            logger.error(f"{p}: {err}")
+# Query plans: everything rendered by the templates is fetched upfront
+# (constant number of queries whatever the number of records)
+
+# record_row.html
+RECORD_ROWS = Record.objects.select_related(
+    "identifiers",
+    "row__policy_evaluated",
+)
 
-    return 0
+# record.html
+RECORD_DETAILS = Record.objects.select_related(
+    "feedback__report_metadata",
+    "identifiers",
+    "row__policy_evaluated",
+    "auth_results__spf",
+    "auth_results__dkim",
+)
+
+# feedback.html (records are loaded by FeedbackRecordsView)
+FEEDBACK_DETAILS = Feedback.objects.select_related(
+    "report_metadata",
+    "policy_published",
+)
 
 
 class CollectView(TemplateView):
@@ -66,10 +90,11 @@ class CollectView(TemplateView):
     template_name = "collect_button.html"
 
     def post(self, request: HttpRequest, *args, **kwargs):
-        config = get_config()
-        total = sum(
-            _must_collect(Path(d), recursive=config.recursive) for d in config.dirlist()
-        )
+        # the parser (xsdata, pydantic, report dataclasses) is only imported
+        # when a report is imported
+        from marc.dmarc.collect import collect
+
+        total = collect()
         if total > 0:
             msg = f"{total} report(s) imported"
             messages.success(request, msg)
@@ -109,13 +134,13 @@ class RecordListView(FragmentTemplateMixin, ListView):
 
 
 class RecordDetailView(FragmentTemplateMixin, DetailView):
-    queryset = Record.objects.all()
+    queryset = RECORD_DETAILS
     context_object_name = "record"
     template_name = "record.html"
 
 
 class RecordRowView(DetailView):
-    queryset = Record.objects.all()
+    queryset = RECORD_ROWS
     context_object_name = "record"
     template_name = "record_row.html"
 
@@ -127,10 +152,44 @@ class FeedbackListView(FragmentTemplateMixin, ListView):
 
 
 class FeedbackDetailView(FragmentTemplateMixin, DetailView):
-    queryset = Feedback.objects.all()
+    queryset = FEEDBACK_DETAILS
     context_object_name = "feedback"
     template_name = "feedback.html"
 
+    def get_context_data(self, **kwargs: Any) -> dict[str, Any]:
+        context_data = super().get_context_data(**kwargs)
+        context_data["filter_form"] = RecordFilterForm()
+        return context_data
+
+
+class FeedbackRecordsView(TemplateView):
+    """A page of the (filtered and sorted) records of a feedback, with a
+    placeholder row that lazy-loads the next page"""
+
+    template_name = "feedback_records_page.html"
+    paginate_by = 100
+
+    def get_context_data(self, **kwargs: Any) -> dict[str, Any]:
+        context_data = super().get_context_data(**kwargs)
+        form = RecordFilterForm(self.request.GET)
+        queryset = form.apply(RECORD_ROWS.filter(feedback_id=self.kwargs["pk"]))
+        page = form.page_number()
+        start = (page - 1) * self.paginate_by
+        # one more record tells if there is a next page (no COUNT query)
+        records = list(queryset[start : start + self.paginate_by + 1])
+
+        next_page_url = None
+        if len(records) > self.paginate_by:
+            records = records[: self.paginate_by]
+            query = self.request.GET.copy()
+            query["page"] = page + 1
+            next_page_url = f"{self.request.path}?{query.urlencode()}"
+
+        context_data["records"] = records
+        context_data["page"] = page
+        context_data["next_page_url"] = next_page_url
+        return context_data
+
 
 class FeedbackRowView(DetailView):
     queryset = Feedback.objects.all()
@@ -158,7 +217,18 @@ class FileView(TemplateView):
     template_name = "file_form.html"
 
     def post(self, request: HttpRequest, *args, **kwargs):
-        file = request.FILES["file"]
+        from marc.dmarc.parser import extract_parse, import_to_database
+
+        file = request.FILES.get("file")
+        if file is None:
+            # refused by marc.dmarc.uploads.MaxSizeUploadHandler
+            msg = getattr(request, "upload_error", "No file uploaded")
+            messages.error(self.request, msg)
+            logger.error(msg)
+            return self.get(request)
+
+        # past FILE_UPLOAD_MAX_MEMORY_SIZE, the upload is a temporary file:
+        # it is decompressed and parsed as it is read
         try:
             obj = extract_parse(file.file)
             import_to_database(obj)
@@ -169,10 +239,218 @@ class FileView(TemplateView):
         except BaseException as err:
             messages.error(self.request, err.__str__())
             logger.error(err)
+        finally:
+            file.close()
 
         return self.get(request)
 
 
+class ExportView(View):
+    """Records or feedbacks as CSV or NDJSON, streamed while they are read
+    (see marc.dmarc.export)"""
+
+    kind = "records"
+
+    def get(self, request: HttpRequest, *args, **kwargs):
+        form = ExportForm(request.GET)
+        if not form.is_valid():
+            return HttpResponseBadRequest(form.errors.as_text())
+        format = form.cleaned_data["format"] or "csv"
+        response = StreamingHttpResponse(
+            export.stream(self.kind, format, **form.filters()),
+            content_type=f"{export.FORMATS[format]}; charset=utf-8",
+        )
+        response["Content-Disposition"] = (
+            f'attachment; filename="marc-{self.kind}.{format}"'
+        )
+        return response
+
+
+class MetricsView(View):
+    """Metrics in the Prometheus text format"""
+
+    def get(self, request: HttpRequest, *args, **kwargs):
+        return HttpResponse(
+            metrics.exposition(),
+            content_type="text/plain; version=0.0.4; charset=utf-8",
+        )
+
+
+class DebugOnlyMixin:
+    """404 unless DEBUG is on, like the profiling of the requests (profiles
+    hold SQL queries and local paths)"""
+
+    def dispatch(self, request: HttpRequest, *args, **kwargs):
+        if not settings.DEBUG:
+            raise Http404("Profiles are only served when DEBUG is on")
+        return super().dispatch(request, *args, **kwargs)
+
+
+class ProfileListView(DebugOnlyMixin, FragmentTemplateMixin, TemplateView):
+    template_name = "profile_list.html"
+
+    def get_context_data(self, **kwargs: Any) -> dict[str, Any]:
+        context_data = super().get_context_data(**kwargs)
+        context_data["profiles"] = profiling.recent_profiles()
+        context_data["profile_dir"] = profiling.profile_dir()
+        return context_data
+
+
+class ProfileFileView(DebugOnlyMixin, View):
+    def get(self, request: HttpRequest, filename: str, *args, **kwargs):
+        path = profiling.profile_file(filename)
+        if path is None:
+            raise Http404(f"No profile file {filename}")
+        return FileResponse(open(path, "rb"), as_attachment=True)
+
+
+class QuarantineView(FragmentTemplateMixin, TemplateView):
+    """Files which could not be imported: retry or purge a selection"""
+
+    template_name = "quarantine.html"
+    fragment = "quarantine_form.html"
+    max_files = 500
+
+    def get_template_names(self) -> list[str]:
+        if self.request.method == "POST":
+            # the form only
+            return [self.fragment]
+        return super().get_template_names()
+
+    def get_context_data(self, **kwargs: Any) -> dict[str, Any]:
+        context_data = super().get_context_data(**kwargs)
+        files = quarantine.select(
+            error=self.request.GET.get("error"), path=self.request.GET.get("path")
+        )
+        context_data["files"] = files[: self.max_files]
+        context_data["count"] = files.count()
+        return context_data
+
+    def post(self, request: HttpRequest, *args, **kwargs):
+        ids = [int(i) for i in request.POST.getlist("id") if i.isdigit()]
+        action = request.POST.get("action")
+        if not ids:
+            messages.info(request, "No file selected")
+        elif action == "retry":
+            result = quarantine.retry(quarantine.select(ids))
+            msg = (
+                f"{result.imported} imported, {result.duplicates} already imported, "
+                f"{result.failed} failed, {result.missing} missing"
+            )
+            if result.failed or result.missing:
+                messages.warning(request, msg)
+            else:
+                messages.success(request, msg)
+            logger.info(msg)
+        elif action == "purge":
+            # the files of the user (collected directories...) are only
+            # deleted by the command
+            total = quarantine.purge(
+                quarantine.select(ids),
+                delete_files="delete_files" in request.POST,
+                owned_only=True,
+            )
+            messages.success(request, f"{total} file(s) purged")
+        else:
+            return HttpResponseBadRequest(f"unknown action {action!r}")
+        return self.get(request)
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class UploadApiView(View):
+    """JSON API of the chunked uploads (see marc.dmarc.chunkedupload), for
+    scripts: no CSRF token but the bearer token of settings.UPLOAD_TOKEN (the
+    API is disabled without it)"""
+
+    def dispatch(self, request: HttpRequest, *args, **kwargs):
+        token = settings.UPLOAD_TOKEN
+        if not token:
+            return JsonResponse(
+                {"error": "the upload API is disabled (MARC_UPLOAD_TOKEN is not set)"},
+                status=403,
+            )
+        if not hmac.compare_digest(
+            request.headers.get("Authorization", ""), f"Bearer {token}"
+        ):
+            return JsonResponse({"error": "invalid token"}, status=401)
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        except chunkedupload.UploadError as err:
+            body = {"error": str(err)}
+            if isinstance(err, chunkedupload.OffsetMismatch):
+                body["offset"] = err.offset
+            return JsonResponse(body, status=err.status)
+
+
+class UploadListView(UploadApiView):
+    def get(self, request: HttpRequest, *args, **kwargs):
+        """Staged uploads (to resume one)"""
+        return JsonResponse({"uploads": [u.as_dict() for u in chunkedupload.uploads()]})
+
+    def post(self, request: HttpRequest, *args, **kwargs):
+        """Start an upload: {"filename", "size", "sha256" (optional)}"""
+        try:
+            data = json.loads(request.body)
+            size = int(data["size"])
+        except (ValueError, KeyError, TypeError) as err:
+            raise chunkedupload.UploadError(f"invalid request: {err}") from err
+        upload = chunkedupload.init(
+            str(data.get("filename", "")), size, str(data.get("sha256", ""))
+        )
+        response = JsonResponse(upload.as_dict(), status=201)
+        response["Location"] = reverse("upload-details", args=(upload.id,))
+        return response
+
+
+class UploadDetailView(UploadApiView):
+    def get(self, request: HttpRequest, upload_id: str, *args, **kwargs):
+        """Status (offset to resume from)"""
+        return JsonResponse(chunkedupload.get(upload_id).as_dict())
+
+    def put(self, request: HttpRequest, upload_id: str, *args, **kwargs):
+        """Append a chunk: ?offset=, X-Chunk-SHA256 header"""
+        upload = chunkedupload.get(upload_id)
+        try:
+            offset = int(request.GET["offset"])
+            length = int(request.META.get("CONTENT_LENGTH") or 0)
+        except (ValueError, KeyError) as err:
+            raise chunkedupload.UploadError(f"invalid request: {err}") from err
+        chunkedupload.write_chunk(
+            upload, offset, length, request.headers.get("X-Chunk-SHA256", ""), request
+        )
+        return JsonResponse(upload.as_dict())
+
+    def delete(self, request: HttpRequest, upload_id: str, *args, **kwargs):
+        chunkedupload.remove(chunkedupload.get(upload_id))
+        return HttpResponse(status=204)
+
+
+class UploadFinalizeView(UploadApiView):
+    def post(self, request: HttpRequest, upload_id: str, *args, **kwargs):
+        """Check the file and import it in the background: 202 while it is
+        imported (post again to poll), then 200 with the result"""
+        upload = chunkedupload.get(upload_id)
+        job = chunkedupload.finalize(upload)
+        finished = job.finished_at is not None
+        if not finished:
+            # started, or resumed if its process died
+            chunkedupload.start_import(upload)
+        return JsonResponse(
+            {
+                "id": upload.id,
+                "job": job.id,
+                "finished": finished,
+                "total": job.total,
+                "done": job.done,
+                "imported": job.imported,
+                "duplicates": job.duplicates,
+                "failed": job.failed,
+                "skipped": job.skipped,
+            },
+            status=200 if finished else 202,
+        )
+
+
 class IndexView(FragmentTemplateMixin, TemplateView):
     template_name = "index.html"
 
@@ -0,0 +1,111 @@
+"""
+Client of the ingest daemon (marc ingestd): queue report files or raw report
+bytes through its Unix socket.
+
+It is run once per message by mail hooks so it does not import Django:
+`marc ingest` is dispatched by marc.__main__ before Django is set up.
+
+Protocol (one connection, any number of items):
+- client: `PATH <absolute path>\\n` or `DATA <size>\\n<size bytes>` per item,
+  then it shuts down its side of the connection
+- daemon: `OK <items>\\n` once every item is queued (raw reports are written
+  to its spool first), `ERR <message>\\n` otherwise
+"""
+
+import argparse
+import os
+import socket
+import sys
+from typing import Iterable, List, Tuple
+
+# exit status asking the MTA to retry the delivery later (sysexits.h)
+EX_TEMPFAIL = 75
+
+# seconds
+TIMEOUT = 30.0
+
+Item = Tuple[str, bytes]
+
+
+class IngestError(Exception):
+    """Items refused by the daemon"""
+
+
+def socket_path() -> str:
+    return os.getenv("MARC_INGEST_SOCKET") or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "ingestd.sock"
+    )
+
+
+def path_item(path: str | os.PathLike) -> Item:
+    return "PATH", os.fsencode(os.path.abspath(path))
+
+
+def data_item(data: bytes) -> Item:
+    return "DATA", data
+
+
+def send(items: Iterable[Item], path: str | None = None, timeout=TIMEOUT) -> int:
+    """Queue the items in the daemon and return their number. Raise OSError if
+    the daemon cannot be reached, IngestError if it refuses them."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path or socket_path())
+        for kind, value in items:
+            if kind == "PATH":
+                sock.sendall(b"PATH " + value + b"\n")
+            else:
+                sock.sendall(f"DATA {len(value)}\n".encode())
+                sock.sendall(value)
+        sock.shutdown(socket.SHUT_WR)
+        with sock.makefile("rb") as f:
+            reply = f.readline().decode(errors="replace").strip()
+
+    status, _, rest = reply.partition(" ")
+    if status != "OK":
+        raise IngestError(rest or "connection closed by the daemon")
+    return int(rest)
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="marc ingest",
+        description="Queue DMARC reports (xml: raw, zipped or gzipped) "
+        "in the ingest daemon (marc ingestd)",
+    )
+    parser.add_argument(
+        "report", nargs="*", help="Report files (the report is read from stdin if none)"
+    )
+    parser.add_argument(
+        "--data",
+        action="store_true",
+        help="Send the content of the files instead of their path "
+        "(when the daemon cannot read them)",
+    )
+    parser.add_argument(
+        "-s",
+        "--socket",
+        default=socket_path(),
+        help="Socket of the daemon (MARC_INGEST_SOCKET, default: %(default)s)",
+    )
+    args = parser.parse_args(argv)
+
+    try:
+        if not args.report:
+            items = [data_item(sys.stdin.buffer.read())]
+        elif args.data:
+            items = []
+            for r in args.report:
+                with open(r, "rb") as f:
+                    items.append(data_item(f.read()))
+        else:
+            items = [path_item(r) for r in args.report]
+        send(items, args.socket)
+    except IngestError as err:
+        print(f"marc ingest: {err}", file=sys.stderr)
+        return 1
+    except OSError as err:
+        # daemon down: let the MTA retry
+        print(f"marc ingest: {args.socket}: {err}", file=sys.stderr)
+        return EX_TEMPFAIL
+    return 0
@@ -1,24 +1,36 @@
 import logging
+import threading
+from functools import lru_cache
+from types import ModuleType
 
-from colorama import Back, Fore, Style, just_fix_windows_console
+# statistics of the last request handled by the thread
+# (set by marc.dmarc.middleware.RequestStatsMiddleware)
+request_stats = threading.local()
 
-just_fix_windows_console()
+
+@lru_cache(maxsize=None)
+def colorama() -> ModuleType:
+    """colorama, imported on the first record (startup time)"""
+    import colorama
+
+    colorama.just_fix_windows_console()
+    return colorama
 
 
 class MarcFormatter(logging.Formatter):
     """Pretty formatter for requests"""
 
-    color_mapper = {
-        logging.DEBUG: Style.DIM,
-        logging.INFO: Fore.GREEN,
-        logging.WARNING: Fore.YELLOW,
-        logging.ERROR: Fore.RED,
-        logging.CRITICAL: Fore.WHITE + Back.RED,
-    }
-
     def format(self, record: logging.LogRecord) -> str:
+        Back, Fore, Style = colorama().Back, colorama().Fore, colorama().Style
+        color_mapper = {
+            logging.DEBUG: Style.DIM,
+            logging.INFO: Fore.GREEN,
+            logging.WARNING: Fore.YELLOW,
+            logging.ERROR: Fore.RED,
+            logging.CRITICAL: Fore.WHITE + Back.RED,
+        }
         record.levelname = (
-            self.color_mapper[record.levelno] + record.levelname + Style.RESET_ALL
+            color_mapper[record.levelno] + record.levelname + Style.RESET_ALL
         )
         return super().format(record)
 
@@ -30,6 +42,7 @@ class ServerFormatter(logging.Formatter):
         # backup values
         msg = record.msg
         args = tuple(record.args)
+        Fore, Style = colorama().Fore, colorama().Style
 
         col = Fore.RESET
         if record.status_code >= 200 and record.status_code < 300:
@@ -43,12 +56,24 @@ class ServerFormatter(logging.Formatter):
 
         try:
             # modify args
-            record.msg = f"{col}%s{Fore.RESET} {Style.BRIGHT}%s{Style.RESET_ALL} %s {Style.DIM}%sµs{Style.RESET_ALL}"
+            record.msg = f"{col}%s{Fore.RESET} {Style.BRIGHT}%s{Style.RESET_ALL} %s {Style.DIM}%sB{Style.RESET_ALL}"
             record.args = (
                 record.args[1],
                 *record.args[0].split(" ")[:2],
                 record.args[2],
             )
+            stats = getattr(request_stats, "value", None)
+            if stats is not None:
+                request_stats.value = None
+                record.msg += (
+                    f" {Style.DIM}%sq %.1fms sql %.1fms tpl %.1fms{Style.RESET_ALL}"
+                )
+                record.args += (
+                    stats.queries,
+                    stats.sql_seconds * 1e3,
+                    stats.render_seconds * 1e3,
+                    stats.total_seconds * 1e3,
+                )
             return super().format(record)
         except BaseException:
             # restore
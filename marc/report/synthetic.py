@@ -0,0 +1,253 @@
+"""
+Seeded generator of synthetic DMARC aggregate reports.
+
+The produced XML follows the schema of marc.report.dmarc_relaxed, so that
+it goes through the same parsing and import path as real reports. The same
+seed always produces the same reports.
+"""
+
+import gzip
+import io
+import random
+import zipfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Literal, Tuple
+from xml.sax.saxutils import escape
+
+from marc.report.dmarc_relaxed import (
+    DispositionType,
+    DkimresultType,
+    PolicyOverrideType,
+    SpfresultType,
+)
+
+Compression = Literal["none", "gzip", "zip", "mixed"]
+
+COMPRESSIONS = ("none", "gzip", "zip")
+
+REPORTERS = [
+    (
+        "google.com",
+        "noreply-dmarc-support@google.com",
+        "https://support.google.com/a/answer/2466580",
+    ),
+    ("Outlook.com", "dmarcreport@microsoft.com", None),
+    ("Yahoo", "dmarchelp@yahooinc.com", None),
+    ("Zoho", "noreply-dmarc@zoho.com", "https://www.zoho.com"),
+    ("Fastmail Pty Ltd", "dmarc-reports@fastmail.com", None),
+    ("Amazon SES", "postmaster@amazonses.com", None),
+    ("Mail.Ru", "dmarc_support@corp.mail.ru", "http://help.mail.ru/mail-help"),
+]
+
+DOMAINS = ["example.org", "example.com", "example.net", "mail.example.org"]
+
+SELECTORS = ["google", "selector1", "selector2", "s1", "mail", "dkim"]
+
+FORWARDERS = ["lists.example.edu", "relay.example.io", "forward.example.co"]
+
+
+@dataclass
+class GeneratorConfig:
+    # (min, max) number of records per report
+    records: Tuple[int, int] = (1, 20)
+    # (min, max) number of DKIM results per record
+    # (the database stores a single DKIM and a single SPF result per record)
+    dkim: Tuple[int, int] = (0, 1)
+    # (min, max) number of SPF results per record
+    spf: Tuple[int, int] = (1, 1)
+    # probability that a record has policy override reasons
+    override_ratio: float = 0.05
+    # probability that a source IP is IPv6
+    ipv6_ratio: float = 0.2
+    # probability that a record fails DMARC
+    fail_ratio: float = 0.1
+    # timestamp of the end of the most recent report
+    end: int = 1_714_000_000
+    # period covered by a report (seconds)
+    period: int = 86_400
+
+
+class ReportGenerator:
+    """Generate reports deterministically: report i only depends on (seed, i)"""
+
+    def __init__(self, seed: int = 0, config: GeneratorConfig | None = None):
+        self.seed = seed
+        self.config = config or GeneratorConfig()
+
+    def _random(self, index: int) -> random.Random:
+        return random.Random(f"{self.seed}-{index}")
+
+    def _ip(self, rnd: random.Random) -> str:
+        if rnd.random() < self.config.ipv6_ratio:
+            # full notation (the schema pattern does not accept '::')
+            return "2001:db8:" + ":".join(f"{rnd.getrandbits(16):x}" for _ in range(6))
+        return ".".join(str(rnd.randint(1, 254)) for _ in range(4))
+
+    def _record(self, rnd: random.Random, domain: str) -> str:
+        cfg = self.config
+        fail = rnd.random() < cfg.fail_ratio
+        dkim_aligned = not fail and rnd.random() < 0.9
+        spf_aligned = not fail and (not dkim_aligned or rnd.random() < 0.8)
+        if fail:
+            disposition = rnd.choice(
+                [
+                    DispositionType.NONE,
+                    DispositionType.QUARANTINE,
+                    DispositionType.REJECT,
+                ]
+            )
+        else:
+            disposition = DispositionType.NONE
+
+        reasons = []
+        if rnd.random() < cfg.override_ratio:
+            for _ in range(rnd.randint(1, 2)):
+                reason_type = rnd.choice(list(PolicyOverrideType))
+                comment = ""
+                if rnd.random() < 0.5:
+                    comment = f"<comment>{escape(rnd.choice(FORWARDERS))}</comment>"
+                reasons.append(f"<reason><type>{reason_type}</type>{comment}</reason>")
+
+        header_from = domain
+        envelope_from = domain if spf_aligned else rnd.choice(FORWARDERS)
+        envelope_to = ""
+        if rnd.random() < 0.3:
+            envelope_to = f"<envelope_to>{rnd.choice(DOMAINS)}</envelope_to>"
+
+        dkim = []
+        for _ in range(rnd.randint(*cfg.dkim)):
+            result = (
+                DkimresultType.PASS
+                if dkim_aligned
+                else rnd.choice(list(DkimresultType))
+            )
+            dkim.append(
+                "<dkim>"
+                f"<domain>{domain if dkim_aligned else rnd.choice(FORWARDERS)}</domain>"
+                f"<selector>{rnd.choice(SELECTORS)}</selector>"
+                f"<result>{result}</result>"
+                "</dkim>"
+            )
+        spf = []
+        for _ in range(rnd.randint(*cfg.spf)):
+            result = (
+                SpfresultType.PASS if spf_aligned else rnd.choice(list(SpfresultType))
+            )
+            spf.append(
+                "<spf>"
+                f"<domain>{envelope_from}</domain>"
+                "<scope>mfrom</scope>"
+                f"<result>{result}</result>"
+                "</spf>"
+            )
+
+        count = max(1, int(rnd.paretovariate(1.2)))
+        return (
+            "<record>"
+            "<row>"
+            f"<source_ip>{self._ip(rnd)}</source_ip>"
+            f"<count>{count}</count>"
+            "<policy_evaluated>"
+            f"<disposition>{disposition}</disposition>"
+            f"<dkim>{'pass' if dkim_aligned else 'fail'}</dkim>"
+            f"<spf>{'pass' if spf_aligned else 'fail'}</spf>"
+            f"{''.join(reasons)}"
+            "</policy_evaluated>"
+            "</row>"
+            "<identifiers>"
+            f"{envelope_to}"
+            f"<envelope_from>{envelope_from}</envelope_from>"
+            f"<header_from>{header_from}</header_from>"
+            "</identifiers>"
+            "<auth_results>"
+            f"{''.join(dkim)}{''.join(spf)}"
+            "</auth_results>"
+            "</record>"
+        )
+
+    def report(self, index: int) -> bytes:
+        """Return the XML of the index-th report"""
+        cfg = self.config
+        rnd = self._random(index)
+        org_name, email, extra = rnd.choice(REPORTERS)
+        domain = rnd.choice(DOMAINS)
+        end = cfg.end - index * cfg.period
+        extra_contact_info = ""
+        if extra:
+            extra_contact_info = (
+                f"<extra_contact_info>{escape(extra)}</extra_contact_info>"
+            )
+        sp = rnd.choice(["", "<sp>none</sp>", "<sp>quarantine</sp>"])
+        records = "".join(
+            self._record(rnd, domain) for _ in range(rnd.randint(*cfg.records))
+        )
+        xml = (
+            '<?xml version="1.0" encoding="UTF-8" ?>\n'
+            "<feedback>"
+            "<version>1.0</version>"
+            "<report_metadata>"
+            f"<org_name>{escape(org_name)}</org_name>"
+            f"<email>{escape(email)}</email>"
+            f"{extra_contact_info}"
+            f"<report_id>synthetic-{self.seed}-{index}</report_id>"
+            "<date_range>"
+            f"<begin>{end - cfg.period}</begin>"
+            f"<end>{end}</end>"
+            "</date_range>"
+            "</report_metadata>"
+            "<policy_published>"
+            f"<domain>{domain}</domain>"
+            f"<adkim>{rnd.choice('rs')}</adkim>"
+            f"<aspf>{rnd.choice('rs')}</aspf>"
+            f"<p>{rnd.choice(list(DispositionType))}</p>"
+            f"{sp}"
+            f"<pct>{rnd.choice([100, 100, 100, 50])}</pct>"
+            "</policy_published>"
+            f"{records}"
+            "</feedback>\n"
+        )
+        return xml.encode()
+
+    def filename(self, index: int) -> str:
+        """Name the report like reporters do: receiver!domain!begin!end"""
+        rnd = self._random(index)
+        # same draws as in report()
+        _, email, _ = rnd.choice(REPORTERS)
+        domain = rnd.choice(DOMAINS)
+        end = self.config.end - index * self.config.period
+        return f"{email.split('@')[1]}!{domain}!{end - self.config.period}!{end}"
+
+    def write(
+        self, directory: Path, index: int, compression: Compression = "none"
+    ) -> Path:
+        """Write the index-th report in the directory and return its path"""
+        if compression == "mixed":
+            compression = COMPRESSIONS[index % len(COMPRESSIONS)]
+
+        xml = self.report(index)
+        name = self.filename(index)
+        if compression == "gzip":
+            path = directory / f"{name}.xml.gz"
+            # mtime=0 keeps the output deterministic
+            path.write_bytes(gzip.compress(xml, mtime=0))
+        elif compression == "zip":
+            path = directory / f"{name}.zip"
+            buffer = io.BytesIO()
+            with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as z:
+                info = zipfile.ZipInfo(f"{name}.xml", date_time=(1980, 1, 1, 0, 0, 0))
+                z.writestr(info, xml, compress_type=zipfile.ZIP_DEFLATED)
+            path.write_bytes(buffer.getvalue())
+        else:
+            path = directory / f"{name}.xml"
+            path.write_bytes(xml)
+        return path
+
+    def write_all(
+        self,
+        directory: Path,
+        count: int,
+        compression: Compression = "none",
+    ) -> List[Path]:
+        directory.mkdir(parents=True, exist_ok=True)
+        return [self.write(directory, i, compression) for i in range(count)]
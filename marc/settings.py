@@ -13,12 +13,24 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 import os
 from pathlib import Path
 
-from colorama import Style
-from tzlocal import get_localzone
-
 BASE_DIR = Path(__file__).resolve().parent
 
 
+def data_dir() -> Path:
+    """Writable files of marc (metrics, profiles, spool, uploads), outside of
+    the package: next to the SQLite database when its path is given, in the
+    state directory of the user otherwise"""
+    if os.getenv("MARC_DATA_DIR"):
+        return Path(os.environ["MARC_DATA_DIR"])
+    if os.getenv("MARC_DB_ENGINE", "sqlite") == "sqlite" and os.getenv("MARC_DB_NAME"):
+        return Path(os.environ["MARC_DB_NAME"]).resolve().parent
+    state = os.getenv("XDG_STATE_HOME") or Path.home() / ".local" / "state"
+    return Path(state) / "marc"
+
+
+DATA_DIR = data_dir()
+
+
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.0/howto/deployment/checklist/
 
@@ -26,9 +38,10 @@ BASE_DIR = Path(__file__).resolve().parent
 SECRET_KEY = "django-insecure-_&p6a_9b8wpcv(ajbbhrnyk=oj3$0)uvcgu+#559)4$ri$+^-&"
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = os.getenv("MARC_DEBUG", "1").lower() in ("1", "true", "yes")
 
-ALLOWED_HOSTS = []
+# comma separated (only localhost is allowed by default when DEBUG is on)
+ALLOWED_HOSTS = [h for h in os.getenv("MARC_ALLOWED_HOSTS", "").split(",") if h]
 
 
 # Application definition
@@ -43,18 +56,22 @@ INSTALLED_APPS = [
     "marc.dmarc",
 ]
 
+# colorama's Style.DIM and Style.RESET_ALL (colorama is only imported by the
+# formatters, on the first record)
+dim, reset_all = "\x1b[2m", "\x1b[0m"
+
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
     "formatters": {
         "color": {
-            "format": f"{Style.DIM}[%(asctime)s.%(msecs)03d]{Style.RESET_ALL} %(levelname)s %(message)s",
+            "format": f"{dim}[%(asctime)s.%(msecs)03d]{reset_all} %(levelname)s %(message)s",
             "style": "%",
             "class": "marc.logging.MarcFormatter",
             "datefmt": "%H:%M:%S",
         },
         "request": {
-            "format": f"{Style.DIM}[%(asctime)s.%(msecs)03d]{Style.RESET_ALL} %(message)s",
+            "format": f"{dim}[%(asctime)s.%(msecs)03d]{reset_all} %(message)s",
             "style": "%",
             "class": "marc.logging.ServerFormatter",
             "datefmt": "%H:%M:%S",
@@ -101,7 +118,69 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "marc.dmarc.middleware.RequestStatsMiddleware",
+    "marc.dmarc.middleware.ProfileMiddleware",
+]
+
+# warn when a request runs more SQL queries than that (0 to disable)
+QUERY_BUDGET = int(os.getenv("MARC_QUERY_BUDGET", "50"))
+# number of slowest queries reported in the warning
+SLOW_QUERIES = int(os.getenv("MARC_SLOW_QUERIES", "3"))
+# counters of the commands (loadreport) served on /metrics
+METRICS_FILE = os.getenv("MARC_METRICS_FILE", DATA_DIR / "metrics.json")
+# seconds the gauges read from the database (rows per table...) are cached
+METRICS_GAUGES_TTL = int(os.getenv("MARC_METRICS_GAUGES_TTL", "60"))
+
+# profile loadreport and collect (same as --profile)
+PROFILE = os.getenv("MARC_PROFILE", "0").lower() in ("1", "true", "yes")
+# where profiles (pstats and allocations) are written
+PROFILE_DIR = os.getenv("MARC_PROFILE_DIR", DATA_DIR / "profiles")
+# number of functions and allocations kept in the summary of a profile
+PROFILE_TOP = int(os.getenv("MARC_PROFILE_TOP", "25"))
+# depth of the tracebacks recorded by tracemalloc
+PROFILE_FRAMES = int(os.getenv("MARC_PROFILE_FRAMES", "1"))
+
+# raw reports received by the ingest daemon, kept until they are imported
+INGEST_SPOOL = os.getenv("MARC_INGEST_SPOOL", DATA_DIR / "spool")
+# directories of the reports the ingest daemon reads when they are sent by
+# path (os.pathsep separated), besides the collected directories and the spool
+INGEST_PATHS = [p for p in os.getenv("MARC_INGEST_PATHS", "").split(os.pathsep) if p]
+
+# uploaded reports larger than that are written to a temporary file
+FILE_UPLOAD_MAX_MEMORY_SIZE = int(
+    os.getenv("MARC_UPLOAD_MEMORY_SIZE", str(2 * 1024 * 1024))
+)
+# uploads larger than that are refused before being read (bytes)
+UPLOAD_MAX_SIZE = int(os.getenv("MARC_UPLOAD_MAX_SIZE", str(64 * 1024 * 1024)))
+FILE_UPLOAD_HANDLERS = [
+    "marc.dmarc.uploads.MaxSizeUploadHandler",
+    "django.core.files.uploadhandler.MemoryFileUploadHandler",
+    "django.core.files.uploadhandler.TemporaryFileUploadHandler",
 ]
+# chunked uploads (/dmarc/uploads/): staged files, largest chunk and file
+# (bytes), seconds before an unchanged upload is removed, bearer token
+# required by the API (if set)
+UPLOAD_STAGING = os.getenv("MARC_UPLOAD_STAGING", DATA_DIR / "uploads")
+UPLOAD_CHUNK_SIZE = int(os.getenv("MARC_UPLOAD_CHUNK_SIZE", str(8 * 1024 * 1024)))
+UPLOAD_CHUNKED_MAX_SIZE = int(
+    os.getenv("MARC_UPLOAD_CHUNKED_MAX_SIZE", str(1024 * 1024 * 1024))
+)
+UPLOAD_TTL = int(os.getenv("MARC_UPLOAD_TTL", str(24 * 3600)))
+# limits of a zip bundle of reports uploaded by chunks: number of members and
+# size of the members once extracted (bytes)
+UPLOAD_BUNDLE_MAX_MEMBERS = int(os.getenv("MARC_UPLOAD_BUNDLE_MAX_MEMBERS", "10000"))
+UPLOAD_BUNDLE_MAX_SIZE = int(
+    os.getenv("MARC_UPLOAD_BUNDLE_MAX_SIZE", str(4 * 1024 * 1024 * 1024))
+)
+UPLOAD_TOKEN = os.getenv("MARC_UPLOAD_TOKEN", "")
+# limits of a decompressed report (every import): size in bytes and ratio to
+# the compressed size
+REPORT_MAX_SIZE = int(os.getenv("MARC_REPORT_MAX_SIZE", str(256 * 1024 * 1024)))
+REPORT_MAX_RATIO = float(os.getenv("MARC_REPORT_MAX_RATIO", "200"))
+# report files of loadreport from that size (bytes) are memory-mapped (-1: never)
+REPORT_MMAP_MIN_SIZE = int(os.getenv("MARC_REPORT_MMAP_MIN_SIZE", str(64 * 1024)))
+# rows fetched at once by the exports (/dmarc/export/, marc export)
+EXPORT_CHUNK_SIZE = int(os.getenv("MARC_EXPORT_CHUNK_SIZE", "2000"))
 
 ROOT_URLCONF = "marc.urls"
 
@@ -109,31 +188,96 @@ TEMPLATES = [
     {
         "BACKEND": "django.template.backends.django.DjangoTemplates",
         "DIRS": [],
-        "APP_DIRS": True,
+        "APP_DIRS": DEBUG,
         "OPTIONS": {
             "context_processors": [
                 "django.template.context_processors.debug",
                 "django.template.context_processors.request",
                 "django.contrib.auth.context_processors.auth",
                 "django.contrib.messages.context_processors.messages",
+                "marc.dmarc.context_processors.data_version",
             ],
         },
     },
 ]
 
+if not DEBUG:
+    # templates are compiled once per process (no reload on change)
+    TEMPLATES[0]["OPTIONS"]["loaders"] = [
+        (
+            "django.template.loaders.cached.Loader",
+            [
+                "django.template.loaders.filesystem.Loader",
+                "django.template.loaders.app_directories.Loader",
+            ],
+        )
+    ]
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    # rendered fragments ({% cache %}), keyed by object id and data version
+    "template_fragments": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "template_fragments",
+        "TIMEOUT": None,
+        "OPTIONS": {
+            "MAX_ENTRIES": int(os.getenv("MARC_FRAGMENT_CACHE_ENTRIES", "20000"))
+        },
+    },
+}
+
 WSGI_APPLICATION = "marc.wsgi.application"
 
 
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
+DB_ENGINE = os.getenv("MARC_DB_ENGINE", "sqlite")
+
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+        "NAME": os.getenv("MARC_DB_NAME", BASE_DIR / "db.sqlite3"),
+        # keep connections open between requests (seconds, 0 to disable)
+        "CONN_MAX_AGE": int(os.getenv("MARC_DB_CONN_MAX_AGE", "600")),
+        "CONN_HEALTH_CHECKS": True,
+        "OPTIONS": {
+            # seconds to wait for the write lock before raising 'database is locked'
+            "timeout": float(os.getenv("MARC_SQLITE_TIMEOUT", "20")),
+        },
     }
 }
 
+if DB_ENGINE in ("postgres", "postgresql"):
+    # requires psycopg (pip install marc[postgres])
+    DATABASES["default"] = {
+        "ENGINE": "django.db.backends.postgresql",
+        "NAME": os.getenv("MARC_DB_NAME", "marc"),
+        "USER": os.getenv("MARC_DB_USER", ""),
+        "PASSWORD": os.getenv("MARC_DB_PASSWORD", ""),
+        "HOST": os.getenv("MARC_DB_HOST", ""),
+        "PORT": os.getenv("MARC_DB_PORT", ""),
+        "CONN_MAX_AGE": int(os.getenv("MARC_DB_CONN_MAX_AGE", "600")),
+        "CONN_HEALTH_CHECKS": True,
+    }
+
+# SQLite tuning applied on every new connection (see marc.dmarc.apps).
+# MARC_SQLITE_PROFILE=default leaves the SQLite defaults untouched.
+SQLITE_PROFILE = os.getenv("MARC_SQLITE_PROFILE", "tuned")
+SQLITE_PRAGMAS = {
+    "journal_mode": os.getenv("MARC_SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("MARC_SQLITE_SYNCHRONOUS", "NORMAL"),
+    # bytes of the database file mapped in memory
+    "mmap_size": int(os.getenv("MARC_SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    # negative values are KiB, positive values are pages
+    "cache_size": int(os.getenv("MARC_SQLITE_CACHE_SIZE", str(-64 * 1024))),
+    "temp_store": os.getenv("MARC_SQLITE_TEMP_STORE", "MEMORY"),
+    # milliseconds
+    "busy_timeout": int(os.getenv("MARC_SQLITE_BUSY_TIMEOUT", "20000")),
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -159,7 +303,24 @@ AUTH_PASSWORD_VALIDATORS = [
 
 LANGUAGE_CODE = "en-us"
 
-TIME_ZONE = get_localzone().key
+
+def local_timezone() -> str:
+    """Name of the local time zone, from TZ or the /etc/localtime link
+    (tzlocal is only imported when they do not give it)"""
+    name = os.getenv("TZ", "").lstrip(":")
+    if name and not name.startswith("/"):
+        return name
+    link = Path(name or "/etc/localtime")
+    if link.is_symlink():
+        _, sep, key = str(link.resolve()).partition("/zoneinfo/")
+        if sep and key:
+            return key
+    from tzlocal import get_localzone
+
+    return get_localzone().key
+
+
+TIME_ZONE = local_timezone()
 
 USE_I18N = True
 
@@ -170,6 +331,18 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/5.0/howto/static-files/
 STATIC_URL = "static/"
 STATICFILES_DIRS = [BASE_DIR / "static"]
+# output of the buildstatic command
+STATIC_ROOT = os.getenv("MARC_STATIC_ROOT", BASE_DIR / "staticfiles")
+
+STORAGES = {
+    "default": {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+    },
+    "staticfiles": {
+        "BACKEND": "marc.dmarc.staticfiles.StaticFilesStorage",
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
@@ -0,0 +1,187 @@
+"""
+Client of the chunked upload API (/dmarc/uploads/, see
+marc.dmarc.chunkedupload): push a large report archive to a remote marc.
+
+It runs on the remote sites, without Django: `marc upload` is dispatched by
+marc.__main__ before Django is set up. Failed chunks are sent again and an
+interrupted upload is continued with --resume <id>. The server imports the
+file in the background, finalize is polled until the import is over.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+import urllib.error
+import urllib.request
+from typing import Any, Dict, List
+
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+RETRIES = 5
+# seconds (doubled after each failure)
+RETRY_DELAY = 1.0
+TIMEOUT = 60.0
+# seconds between two polls of the import
+POLL_INTERVAL = 5.0
+
+
+class UploadError(Exception):
+    pass
+
+
+class Client:
+    def __init__(self, url: str, token: str = "", timeout: float = TIMEOUT):
+        # .../dmarc/uploads/
+        self.url = url.rstrip("/") + "/"
+        self.token = token
+        self.timeout = timeout
+
+    def request(
+        self,
+        method: str,
+        path: str = "",
+        body: bytes | None = None,
+        headers: Dict[str, str] | None = None,
+    ) -> Dict[str, Any]:
+        req = urllib.request.Request(
+            self.url + path, data=body, method=method, headers=headers or {}
+        )
+        if self.token:
+            req.add_header("Authorization", f"Bearer {self.token}")
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as res:
+                return json.loads(res.read() or b"{}")
+        except urllib.error.HTTPError as err:
+            try:
+                data = json.loads(err.read())
+            except ValueError:
+                data = {"error": f"HTTP {err.code}"}
+            data["status"] = err.code
+            return data
+
+    def retry(self, method: str, path: str = "", **kwargs) -> Dict[str, Any]:
+        """Send the request again after network and server (5xx) errors"""
+        delay = RETRY_DELAY
+        for _ in range(RETRIES):
+            try:
+                data = self.request(method, path, **kwargs)
+                if data.get("status", 200) < 500:
+                    return data
+                error = data["error"]
+            except OSError as err:
+                error = str(err)
+            print(f"marc upload: {method} {path}: {error}, retrying", file=sys.stderr)
+            time.sleep(delay)
+            delay *= 2
+        raise UploadError(f"{method} {path}: {error}")
+
+    def check(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        if "error" in data:
+            raise UploadError(data["error"])
+        return data
+
+    def upload(self, path: str, resume: str | None = None, chunk_size: int = 0):
+        """Send the file (from the offset of the upload to resume) and import
+        it, return the result of the import"""
+        if resume:
+            status = self.check(self.retry("GET", f"{resume}/"))
+        else:
+            body = json.dumps(
+                {
+                    "filename": os.path.basename(path),
+                    "size": os.path.getsize(path),
+                    "sha256": file_sha256(path),
+                }
+            ).encode()
+            status = self.check(
+                self.retry(
+                    "POST", body=body, headers={"Content-Type": "application/json"}
+                )
+            )
+        upload_id = status["id"]
+        print(f"marc upload: {upload_id} (--resume {upload_id})", file=sys.stderr)
+        if status.get("job") is not None:
+            # already finalized
+            return self.finalize(upload_id)
+        chunk_size = min(chunk_size or status["chunk_size"], status["chunk_size"])
+        offset = status["offset"]
+        corrupted = 0
+        with open(path, "rb") as f:
+            while offset < status["size"]:
+                f.seek(offset)
+                chunk = f.read(chunk_size)
+                data = self.retry(
+                    "PUT",
+                    f"{upload_id}/?offset={offset}",
+                    body=chunk,
+                    headers={
+                        "Content-Type": "application/octet-stream",
+                        "X-Chunk-SHA256": hashlib.sha256(chunk).hexdigest(),
+                    },
+                )
+                if data.get("status") == 409:
+                    # a retried chunk already received
+                    offset = data["offset"]
+                    continue
+                if "sha256 mismatch" in data.get("error", "") and corrupted < RETRIES:
+                    # altered on the way
+                    corrupted += 1
+                    continue
+                offset = self.check(data)["offset"]
+        return self.finalize(upload_id)
+
+    def finalize(self, upload_id: str) -> Dict[str, Any]:
+        """Start the import (or poll it) until it is over"""
+        while True:
+            data = self.check(self.retry("POST", f"{upload_id}/finalize/"))
+            if data.get("finished", True):
+                return data
+            print(
+                f"marc upload: importing, {data['done']}/{data['total']} files",
+                file=sys.stderr,
+            )
+            time.sleep(POLL_INTERVAL)
+
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(2**20):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="marc upload",
+        description="Upload a large DMARC report archive by chunks to a marc "
+        "server, which imports it",
+    )
+    parser.add_argument(
+        "url", help="Upload API (ex: https://dmarc.example.com/dmarc/uploads/)"
+    )
+    parser.add_argument("file")
+    parser.add_argument(
+        "--token",
+        default=os.getenv("MARC_UPLOAD_TOKEN", ""),
+        help="Token of the server (MARC_UPLOAD_TOKEN)",
+    )
+    parser.add_argument("--resume", metavar="ID", help="Continue an upload")
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+        help="Bytes per request (at most the chunk size of the server)",
+    )
+    args = parser.parse_args(argv)
+
+    client = Client(args.url, args.token)
+    try:
+        result = client.upload(args.file, args.resume, args.chunk_size)
+    except (UploadError, OSError) as err:
+        print(f"marc upload: {err}", file=sys.stderr)
+        return 1
+    print(json.dumps(result))
+    return 0
@@ -15,12 +15,24 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 
+from django.conf import settings
 from django.contrib import admin
 from django.urls import include, path
 from django.views.generic.base import RedirectView
 
+from marc.dmarc import staticfiles
+from marc.dmarc.views import MetricsView
+
 urlpatterns = [
     path("", RedirectView.as_view(url="/dmarc/")),
     path("admin/", admin.site.urls),
     path("dmarc/", include("marc.dmarc.urls")),
+    path("metrics", MetricsView.as_view(), name="metrics"),
+    # files built by the buildstatic command (runserver serves the sources
+    # instead when DEBUG is on)
+    path(
+        f"{settings.STATIC_URL.strip('/')}/<path:path>",
+        staticfiles.serve,
+        name="static",
+    ),
 ]